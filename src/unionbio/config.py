@@ -1,3 +1,5 @@
+import os
+import hashlib
 import logging
 from pathlib import Path
 
@@ -12,10 +14,37 @@ logger.setLevel(logging.DEBUG)
 
 seq_dir_pth = "s3://my-s3-bucket/my-data/sequences"
 ref_loc = "s3://my-s3-bucket/my-data/refs/GRCh38_short.fasta"
-ref_hash = str(hash(ref_loc))[:4]
+# Stable across processes, unlike hash(), so task cache versions survive re-registration
+ref_hash = hashlib.sha256(ref_loc.encode()).hexdigest()[:8]
+
+# Content-addressed store of built aligner indices, see unionbio.tasks.index_registry
+index_registry = os.getenv(
+    "UNIONBIO_INDEX_REGISTRY", "s3://my-s3-bucket/my-data/indices"
+)
 
 # Tool config
+fastqc_cpu = "2"
 fastp_cpu = "3"
+bowtie2_cpu = "4"
+sort_cpu = "8"
+dedup_cpu = "8"
+
+# Download config
+dl_connections = 8
+dl_concurrency = 16
+dl_host_concurrency = 4
+dl_host_rate = 20
+dl_part_size = 64 * 1024 * 1024
+dl_retries = 3
+
+# Node-local download cache, off unless UNIONBIO_CACHE_DIR points at a node-local mount
+# (e.g. a hostPath volume) shared between pods. Inside a pod's own filesystem it would
+# be neither shared nor safe from ephemeral storage eviction.
+dl_cache_dir = os.getenv("UNIONBIO_CACHE_DIR")
+dl_cache_budget = int(os.getenv("UNIONBIO_CACHE_BUDGET", 20 * 1024**3))
+
+# Size of buffered reads and writes when streaming files
+io_chunk_size = 1024 * 1024
 
 # current_registry = "ghcr.io/unionai-oss"
 current_registry = "localhost:30000"
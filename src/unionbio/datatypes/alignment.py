@@ -1,8 +1,26 @@
+import re
 from mashumaro.mixins.json import DataClassJSONMixin
 from dataclasses import dataclass
 from flytekit.types.file import FlyteFile
+from flytekit.types.directory import FlyteDirectory
 from pathlib import Path
+import pyarrow.compute as pc
 from unionbio.config import logger
+from unionbio.datatypes.manifest import (
+    build_all,
+    check_sheet,
+    present,
+    raise_for_errors,
+    read_sheet,
+    row_errors,
+)
+
+ALIGNMENT_FORMATS = (".sam", ".bam", ".cram")
+ALIGNMENT_IDX_FORMATS = (".bai", ".crai", ".csi")
+# Index extension written by `samtools index` for each alignment format
+ALIGNMENT_IDX_EXT = {"bam": "bai", "cram": "crai"}
+# Alignments of one lane of a sample are named <sample>-L<lane>_<aligner>...
+LANE_SUFFIX = re.compile(r"^(?P<sample>.+?)(?:-L(?P<lane>\d+))?$")
 
 
 @dataclass
@@ -16,6 +34,7 @@ class Alignment(DataClassJSONMixin):
     Attributes:
         sample (str): The name or identifier of the sample to which the SAM file belongs.
         aligner (str): The name of the aligner used to generate the SAM file.
+        format (str): The alignment format, one of "sam", "bam" or "cram".
         alignment (FlyteFile): A FlyteFile object representing the path to the alignment file.
         alignment_report (FlyteFile): A FlyteFile object representing an associated report
             for performance of the aligner.
@@ -23,6 +42,11 @@ class Alignment(DataClassJSONMixin):
         deduped (bool): A boolean value indicating whether the SAM file has been deduplicated.
         bqsr_report (FlyteFile): A FlyteFile object representing a report from the Base Quality
             Score Recalibration (BQSR) process.
+        dedup_metrics (FlyteFile): A FlyteFile object representing the duplicate marking
+            metrics of a deduplicated alignment.
+        lane (str): The sequencing lane, for samples split across several lanes.
+        intermediates (FlyteDirectory): A FlyteDirectory object holding the output of each
+            stage of a multi-stage alignment, kept for debugging.
     """
 
     sample: str
@@ -34,9 +58,13 @@ class Alignment(DataClassJSONMixin):
     sorted: bool | None = None
     deduped: bool | None = None
     bqsr_report: FlyteFile | None = None
+    dedup_metrics: FlyteFile | None = None
+    lane: str | None = None
+    intermediates: FlyteDirectory | None = None
 
     def _get_state_str(self):
-        state = f"{self.sample}_{self.aligner}"
+        sample = f"{self.sample}-L{self.lane}" if self.lane else self.sample
+        state = f"{sample}_{self.aligner}"
         if self.sorted:
             state += "_sorted"
         if self.deduped:
@@ -47,7 +75,10 @@ class Alignment(DataClassJSONMixin):
         return f"{self._get_state_str()}_aligned.{self.format}"
 
     def get_alignment_idx_fname(self):
-        return f"{self._get_state_str()}_aligned.bam.BAI"
+        fmt = self.format or "bam"
+        return (
+            f"{self._get_state_str()}_aligned.{fmt}.{ALIGNMENT_IDX_EXT.get(fmt, 'bai')}"
+        )
 
     def get_report_fname(self):
         return f"{self._get_state_str()}_aligned_report.txt"
@@ -58,38 +89,81 @@ class Alignment(DataClassJSONMixin):
     def get_metrics_fname(self):
         return f"{self._get_state_str()}_metrics.txt"
 
+    def dl_all(self, workdir: Path):
+        a_loc = Path(self.alignment.download())
+        i_loc = Path(self.alignment_idx.download())
+        a_new = workdir.joinpath(a_loc.name)
+        i_new = workdir.joinpath(i_loc.name)
+        a_loc.rename(a_new)
+        i_loc.rename(i_new)
+        self.alignment = FlyteFile(path=str(a_new))
+        self.alignment_idx = FlyteFile(path=str(i_new))
+
     @classmethod
     def make_all(cls, dir: Path):
         samples = {}
         pattern = "*aligned*"
         dir_contents = list(dir.rglob(pattern))
-        logger.info(
+        logger.debug(
             f"Found following alignment files in {dir} matching {pattern}: {dir_contents}"
         )
         for fp in dir_contents:
-            sample, aligner = fp.stem.split("_")[0:2]
-
-            if sample not in samples:
-                samples[sample] = Alignment(sample=sample, aligner=aligner)
-
-            if "sorted" in fp.name:
-                setattr(samples[sample], "sorted", True)
-            else:
-                setattr(samples[sample], "sorted", False)
-
-            if "deduped" in fp.name:
-                setattr(samples[sample], "deduped", True)
-            else:
-                setattr(samples[sample], "deduped", False)
-
-            if "bam" in fp.name:
-                setattr(samples[sample], "format", "bam")
-                setattr(samples[sample], "alignment", FlyteFile(path=str(fp)))
-            elif "sam" in fp.name:
-                setattr(samples[sample], "format", "sam")
-                setattr(samples[sample], "alignment", FlyteFile(path=str(fp)))
-            elif "report" in fp.name:
-                setattr(samples[sample], "alignment_report", FlyteFile(path=str(fp)))
-
-        logger.info(f"Created following Alignment objects from {dir}: {samples}")
+            tokens = fp.name.split(".")[0].split("_")
+            state, aligner = tokens[0:2]
+            sample, lane = LANE_SUFFIX.match(state).group("sample", "lane")
+            suffix = fp.suffix.lower()
+
+            if state not in samples:
+                samples[state] = Alignment(sample=sample, aligner=aligner, lane=lane)
+
+            setattr(samples[state], "sorted", "sorted" in tokens)
+            setattr(samples[state], "deduped", "deduped" in tokens)
+
+            if suffix in ALIGNMENT_FORMATS:
+                setattr(samples[state], "format", suffix[1:])
+                setattr(samples[state], "alignment", FlyteFile(path=str(fp)))
+            elif suffix in ALIGNMENT_IDX_FORMATS:
+                setattr(samples[state], "alignment_idx", FlyteFile(path=str(fp)))
+            elif fp.name.endswith("_report.txt"):
+                setattr(samples[state], "alignment_report", FlyteFile(path=str(fp)))
+
+        logger.info(f"Created {len(samples)} Alignment objects from {dir}")
         return list(samples.values())
+
+    @classmethod
+    def from_sheet(cls, path: str):
+        """
+        Create Alignment objects from a CSV, TSV or Parquet sample sheet with one row per
+        sample, aligner and lane. Columns are named after the fields of this class;
+        "sample", "aligner" and "alignment" are required. The format is inferred from the
+        alignment's extension when not given. All rows are validated before any objects are
+        built, and every problem found is reported at once.
+
+        Args:
+            path (str): Local path or remote URI of the sample sheet.
+
+        Returns:
+            List[Alignment]: One Alignment object per row of the sheet.
+        """
+        table = read_sheet(path)
+        errors = check_sheet(
+            table,
+            path,
+            ["sample", "aligner", "alignment"],
+            ["sample", "aligner", "lane"],
+        )
+        known = pc.match_substring_regex(
+            table["alignment"], r"\.(sam|bam|cram)$", ignore_case=True
+        )
+        errors += row_errors(
+            table,
+            pc.and_(present(table, "alignment"), pc.invert(pc.fill_null(known, False))),
+            f"alignment is not one of {ALIGNMENT_FORMATS}",
+        )
+        raise_for_errors(errors, path)
+
+        alignments = build_all(cls, table)
+        for al in alignments:
+            if not al.format:
+                al.format = Path(al.alignment.path).suffix[1:].lower()
+        return alignments
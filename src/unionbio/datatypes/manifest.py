@@ -0,0 +1,114 @@
+import fsspec
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from dataclasses import fields
+from typing import get_args
+from flytekit.types.file import FlyteFile
+from unionbio.config import logger
+
+
+def read_sheet(path: str) -> pa.Table:
+    """
+    Read a sample sheet into an Arrow table of string columns.
+
+    Sheets may be CSV, TSV (.tsv) or Parquet (.parquet), chosen by extension, and may live locally or in
+    object storage. All columns are read as strings so identifiers like lane "001" keep
+    their leading zeros, and empty cells are read as nulls.
+
+    Args:
+        path (str): Local path or remote URI of the sample sheet.
+
+    Returns:
+        pa.Table: The sample sheet with one row per entry.
+    """
+    with fsspec.open(path, "rb") as f:
+        if path.endswith(".parquet"):
+            table = pq.read_table(f)
+            table = table.cast(
+                pa.schema([pa.field(n, pa.string()) for n in table.column_names])
+            )
+        else:
+            data = f.read()
+            delim = "\t" if path.endswith(".tsv") else ","
+            names = data.split(b"\n", 1)[0].decode().strip().split(delim)
+            table = pacsv.read_csv(
+                pa.BufferReader(data),
+                parse_options=pacsv.ParseOptions(delimiter=delim),
+                convert_options=pacsv.ConvertOptions(
+                    column_types={n: pa.string() for n in names},
+                    strings_can_be_null=True,
+                ),
+            )
+    logger.info(f"Read {table.num_rows} rows from sample sheet {path}")
+    return table
+
+
+def present(table: pa.Table, col: str) -> pa.ChunkedArray:
+    """
+    Boolean mask of the rows that have a non-empty value in `col`. Missing columns are
+    treated as entirely empty.
+    """
+    if col not in table.column_names:
+        return pa.chunked_array([pa.array([False] * table.num_rows)])
+    return pc.fill_null(pc.not_equal(pc.utf8_trim_whitespace(table[col]), ""), False)
+
+
+def row_errors(table: pa.Table, mask: pa.ChunkedArray, msg: str) -> list[str]:
+    """
+    Format `msg` for every row selected by `mask`, identifying rows by line number and sample.
+    """
+    rows = pc.indices_nonzero(mask).to_pylist()
+    samples = table["sample"].to_pylist()
+    return [f"line {i + 2} ({samples[i]}): {msg}" for i in rows]
+
+
+def check_sheet(
+    table: pa.Table, path: str, required: list[str], keys: list[str]
+) -> list[str]:
+    """
+    Run the checks common to all sample sheets: required columns exist and are filled in,
+    and no two rows share the same key.
+
+    Returns:
+        list[str]: A description of every problem found.
+    """
+    missing = [c for c in required if c not in table.column_names]
+    if missing:
+        raise ValueError(f"Sample sheet {path} is missing required columns {missing}")
+
+    errors = []
+    for col in required:
+        errors += row_errors(table, pc.invert(present(table, col)), f"no {col}")
+
+    keys = [k for k in keys if k in table.column_names]
+    counts = table.select(keys).group_by(keys).aggregate([([], "count_all")])
+    for dup in counts.filter(pc.greater(counts["count_all"], 1)).to_pylist():
+        errors.append(f"{dup['count_all']} rows share {({k: dup[k] for k in keys})}")
+    return errors
+
+
+def raise_for_errors(errors: list[str], path: str):
+    if errors:
+        raise ValueError(f"Invalid sample sheet {path}:\n  " + "\n  ".join(errors))
+
+
+def build_all(cls, table: pa.Table) -> list:
+    """
+    Construct one `cls` per row, mapping columns onto dataclass fields of the same name.
+    FlyteFile fields are wrapped and boolean fields parsed from "true"/"false" strings.
+    Unknown columns are ignored.
+    """
+    cols = {}
+    for f in fields(cls):
+        if f.name not in table.column_names:
+            continue
+        vals = table[f.name].to_pylist()
+        types = (f.type, *get_args(f.type))
+        if FlyteFile in types:
+            vals = [FlyteFile(path=v) if v else None for v in vals]
+        elif bool in types:
+            vals = [v.lower() in ("true", "1", "yes") if v else None for v in vals]
+        cols[f.name] = vals
+    return [cls(**dict(zip(cols, row))) for row in zip(*cols.values())]
@@ -1,8 +1,25 @@
 from mashumaro.mixins.json import DataClassJSONMixin
 from dataclasses import dataclass
 from flytekit.types.file import FlyteFile
-from pathlib import Path
+import re
+import pyarrow.compute as pc
+from pathlib import Path, PurePosixPath
 from unionbio.config import logger
+from unionbio.datatypes.manifest import (
+    build_all,
+    check_sheet,
+    present,
+    raise_for_errors,
+    read_sheet,
+    row_errors,
+)
+
+# Read files are named <sample>[_<mate>][.filt].<fastq|fq|fasta|fa>[.gz], where the mate may
+# also be written R1/R2 and separated by a "." as in HG002.30x.R1.fastq.gz
+READ_FNAME = re.compile(
+    r"^(?P<sample>.+?)(?:[._]R?(?P<mate>[12]))?(?:\.filt)?\.(?:fastq|fq|fasta|fa)(?:\.gz)?$"
+)
+FILT_REPORT_SUFFIX = "_fastq-filter-report.json"
 
 
 @dataclass
@@ -19,6 +36,7 @@ class Reads(DataClassJSONMixin):
         filt_report (FlyteFile): A FlyteFile object representing the path to the filter report.
         read1 (FlyteFile): A FlyteFile object representing the path to the raw R1 read file.
         read2 (FlyteFile): A FlyteFile object representing the path to the raw R2 read file.
+        lane (str): The sequencing lane, for samples split across several lanes.
     """
 
     sample: str
@@ -27,41 +45,76 @@ class Reads(DataClassJSONMixin):
     uread: FlyteFile | None = None
     read1: FlyteFile | None = None
     read2: FlyteFile | None = None
+    lane: str | None = None
+
+    def _get_state_str(self):
+        return f"{self.sample}-L{self.lane}" if self.lane else self.sample
 
     def get_read_fnames(self):
         filt = "filt." if self.filtered else ""
         return (
-            f"{self.sample}_1.{filt}fastq.gz",
-            f"{self.sample}_2.{filt}fastq.gz",
+            f"{self._get_state_str()}_1.{filt}fastq.gz",
+            f"{self._get_state_str()}_2.{filt}fastq.gz",
         )
 
     def get_report_fname(self):
-        return f"{self.sample}_fastq-filter-report.json"
+        return f"{self._get_state_str()}{FILT_REPORT_SUFFIX}"
 
     @classmethod
-    def make_all(cls, dir: Path):
+    def from_paths(cls, paths: list[str]):
+        """
+        Create Reads objects from a list of file paths or remote URIs. Only file names are
+        inspected, so remote files are referenced without being downloaded.
+        """
         samples = {}
-        for fp in list(dir.rglob("*fast*")):
-            logger.debug(f"Processing {fp}")
-            sample = fp.stem.split("_")[0]
-            logger.debug(f"Found sample {sample}")
-
-            if sample not in samples:
-                samples[sample] = Reads(sample=sample)
-
-            if ".fastq.gz" in fp.name or "fasta" in fp.name:
-                mate = fp.name.strip(".fastq.gz").strip(".filt").split("_")[-1]
-                logger.debug(f"Found mate {mate} for {sample}")
-                if "1" in mate:
-                    setattr(samples[sample], "read1", FlyteFile(path=str(fp)))
-                elif "2" in mate:
-                    setattr(samples[sample], "read2", FlyteFile(path=str(fp)))
-                else:
-                    setattr(samples[sample], "uread", FlyteFile(path=str(fp)))
-            elif "filter-report" in fp.name:
-                logger.debug(f"Found filter report for {sample}")
+        for fp in paths:
+            name = PurePosixPath(fp).name
+            match = READ_FNAME.match(name)
+            if match:
+                sample, mate = match.group("sample", "mate")
+                samples.setdefault(sample, Reads(sample=sample))
+                field = {"1": "read1", "2": "read2"}.get(mate, "uread")
+                setattr(samples[sample], field, FlyteFile(path=fp))
+            elif name.endswith(FILT_REPORT_SUFFIX):
+                sample = name[: -len(FILT_REPORT_SUFFIX)]
+                samples.setdefault(sample, Reads(sample=sample))
                 setattr(samples[sample], "filtered", True)
-                setattr(samples[sample], "filt_report", FlyteFile(path=str(fp)))
+                setattr(samples[sample], "filt_report", FlyteFile(path=fp))
 
-        logger.info(f"Created {samples} from {dir}")
+        logger.debug(f"Classified {len(paths)} paths into {len(samples)} samples")
         return list(samples.values())
+
+    @classmethod
+    def from_sheet(cls, path: str):
+        """
+        Create Reads objects from a CSV, TSV or Parquet sample sheet with one row per sample
+        and lane. Columns are named after the fields of this class; "sample" is required along
+        with either both of "read1" and "read2", or "uread". All rows are validated before any
+        objects are built, and every problem found is reported at once.
+
+        Args:
+            path (str): Local path or remote URI of the sample sheet.
+
+        Returns:
+            List[Reads]: One Reads object per row of the sheet.
+        """
+        table = read_sheet(path)
+        errors = check_sheet(table, path, ["sample"], ["sample", "lane"])
+        r1, r2 = present(table, "read1"), present(table, "read2")
+        errors += row_errors(
+            table, pc.and_(r1, pc.invert(r2)), "read1 has no read2 mate"
+        )
+        errors += row_errors(
+            table, pc.and_(r2, pc.invert(r1)), "read2 has no read1 mate"
+        )
+        errors += row_errors(
+            table, pc.invert(pc.or_(r1, present(table, "uread"))), "no reads"
+        )
+        raise_for_errors(errors, path)
+        return build_all(cls, table)
+
+    @classmethod
+    def make_all(cls, dir: Path):
+        samples = cls.from_paths([str(fp) for fp in dir.rglob("*") if fp.is_file()])
+        logger.info(f"Created {len(samples)} Reads objects from {dir}")
+        return samples
@@ -1,8 +1,28 @@
 from mashumaro.mixins.json import DataClassJSONMixin
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from flytekit import FlyteContextManager
 from flytekit.types.directory import FlyteDirectory
 from pathlib import Path
+from unionbio.config import logger, dl_concurrency
 from unionbio.tasks.helpers import gunzip_file
+from unionbio.tasks.fasta import open_fasta
+
+# Files each kind of consumer needs from a reference directory. {ref} is the reference's
+# file name, {stem} that name without its extension and {idx} the index name.
+_FASTA = ["{ref}", "{ref}.fai", "{ref}.gzi"]
+_SEQ_INDEX = ["{ref}.fai", "{stem}.dict", "{ref}.dict"]
+_BWA = [f"{{idx}}.{ext}" for ext in ("amb", "ann", "bwt", "pac", "sa")]
+REF_FILE_SETS = {
+    "fasta": _FASTA,
+    "seq_index": _SEQ_INDEX,
+    "gatk": _FASTA + _SEQ_INDEX,
+    "bwa": _FASTA + _BWA,
+    "parabricks": _FASTA + _SEQ_INDEX + _BWA,
+    "bowtie2": ["{idx}.*.bt2", "{idx}.*.bt2l"],
+    "hisat2": ["{idx}.*.ht2", "{idx}.*.ht2l"],
+}
 
 
 @dataclass
@@ -34,3 +54,90 @@ class Reference(DataClassJSONMixin):
             return unzipped
         else:
             return fp
+
+    def fetch(self, contig: str, start: int = 0, end: int | None = None) -> str:
+        """
+        Fetch a subsequence of the reference in 0-based, half-open coordinates, reading
+        only the bytes needed from a memory map rather than loading or decompressing the
+        genome. Requires the .fai, and the .gzi for bgzipped references, to be local, e.g.
+        with `download("fasta")`.
+
+        Args:
+            contig (str): The contig name.
+            start (int): The start of the subsequence.
+            end (int, optional): The end of the subsequence. Defaults to the contig's end.
+
+        Returns:
+            str: The subsequence.
+        """
+        return open_fasta(str(self.get_ref_path(unzip=False))).fetch(contig, start, end)
+
+    def _file_patterns(self, consumer: str) -> list[str]:
+        if consumer not in REF_FILE_SETS:
+            raise ValueError(
+                f"Unknown reference consumer {consumer}, expected one of {list(REF_FILE_SETS)}"
+            )
+        names = {
+            "ref": self.ref_name,
+            "stem": Path(self.ref_name.removesuffix(".gz")).stem,
+            "idx": self.index_name or self.ref_name,
+        }
+        return [p.format(**names) for p in REF_FILE_SETS[consumer]]
+
+    def local_files(self, consumer: str) -> list[Path]:
+        """
+        The files `consumer` needs that are present in the local reference directory,
+        e.g. after `download(consumer)`.
+
+        Args:
+            consumer (str): One of the keys of `REF_FILE_SETS`, e.g. "gatk" or "bwa".
+
+        Returns:
+            list[Path]: The local files.
+        """
+        patterns = self._file_patterns(consumer)
+        local_dir = Path(self.ref_dir.path)
+        return sorted(
+            p
+            for p in local_dir.rglob("*")
+            if p.is_file()
+            and any(fnmatch(str(p.relative_to(local_dir)), pat) for pat in patterns)
+        )
+
+    def download(self, consumer: str) -> Path:
+        """
+        Download only the files `consumer` needs from the reference directory, in parallel,
+        instead of the whole directory with `ref_dir.download()`.
+
+        Args:
+            consumer (str): One of the keys of `REF_FILE_SETS`, e.g. "gatk" or "bwa".
+
+        Returns:
+            Path: The local reference directory.
+        """
+        patterns = self._file_patterns(consumer)
+        local_dir = Path(self.ref_dir.path)
+        remote = self.ref_dir.remote_source
+        if not remote:
+            return local_dir
+
+        wanted = [
+            rel
+            for _, rel in self.ref_dir.crawl()
+            if any(fnmatch(rel, p) for p in patterns)
+        ]
+        logger.info(
+            f"Downloading {len(wanted)} {consumer} reference files from {remote}"
+        )
+
+        file_access = FlyteContextManager.current_context().file_access
+
+        def fetch(rel: str):
+            dst = local_dir.joinpath(rel)
+            if not dst.exists():
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                file_access.get_data(f"{remote.rstrip('/')}/{rel}", str(dst))
+
+        with ThreadPoolExecutor(max_workers=dl_concurrency) as pool:
+            list(pool.map(fetch, wanted))
+        return local_dir
@@ -2,7 +2,19 @@ from pathlib import Path
 from mashumaro.mixins.json import DataClassJSONMixin
 from dataclasses import dataclass
 from flytekit.types.file import FlyteFile
+from flytekit.types.directory import FlyteDirectory
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 from unionbio.config import logger
+from unionbio.datatypes.manifest import (
+    build_all,
+    check_sheet,
+    present,
+    raise_for_errors,
+    read_sheet,
+    row_errors,
+)
 
 
 @dataclass
@@ -18,6 +30,8 @@ class VCF(DataClassJSONMixin):
         caller (str): The name of the variant caller used to generate the VCF.
         vcf (FlyteFile): The VCF file.
         vcf_idx (FlyteFile): The index file for the VCF.
+        sites (FlyteDirectory): The VCF's sites as a Parquet dataset partitioned by
+            contig, written by `export_vcf_sites`.
 
     """
 
@@ -25,6 +39,7 @@ class VCF(DataClassJSONMixin):
     caller: str
     vcf: FlyteFile | None = None
     vcf_idx: FlyteFile | None = None
+    sites: FlyteDirectory | None = None
 
     def _get_state_str(self):
         state = f"{self.sample}_{self.caller}"
@@ -36,6 +51,22 @@ class VCF(DataClassJSONMixin):
     def get_vcf_idx_fname(self):
         return f"{self._get_state_str()}.vcf.gz.tbi"
 
+    def get_sites_dname(self):
+        return f"{self._get_state_str()}_sites"
+
+    def sites_dataset(self) -> ds.Dataset:
+        """
+        Open the sites exported by `export_vcf_sites` as an Arrow dataset, with CHROM read
+        from the partitions. Filters on CHROM only read the matching contigs.
+        """
+        return ds.dataset(
+            self.sites.download(),
+            format="parquet",
+            partitioning=ds.partitioning(
+                pa.schema([("CHROM", pa.string())]), flavor="hive"
+            ),
+        )
+
     def dl_all(self, workdir: Path):
         v_loc = Path(self.vcf.download())
         i_loc = Path(self.vcf_idx.download())
@@ -53,7 +84,7 @@ class VCF(DataClassJSONMixin):
         samples = {}
         pattern = "*vcf*"
         dir_contents = list(dir.rglob(pattern))
-        logger.info(
+        logger.debug(
             f"Found following VCF files in {dir} matching {pattern}: {dir_contents}"
         )
         for fp in dir_contents:
@@ -63,10 +94,35 @@ class VCF(DataClassJSONMixin):
             if sample not in samples:
                 samples[sample] = VCF(sample=sample, caller=caller)
 
-            if "tbi" in fp.name:
+            if fp.name.endswith((".tbi", ".csi")):
                 setattr(samples[sample], "vcf_idx", FlyteFile(path=str(fp)))
-            if "vcf" in fp.name and "tbi" not in fp.name:
+            elif fp.name.endswith((".vcf", ".vcf.gz", ".bcf")):
                 setattr(samples[sample], "vcf", FlyteFile(path=str(fp)))
 
-        logger.info(f"Created following VCF objects from {dir}: {samples}")
+        logger.info(f"Created {len(samples)} VCF objects from {dir}")
         return list(samples.values())
+
+    @classmethod
+    def from_sheet(cls, path: str):
+        """
+        Create VCF objects from a CSV, TSV or Parquet sample sheet with one row per sample and
+        caller. Columns are named after the fields of this class; "sample", "caller" and "vcf"
+        are required, and compressed VCFs must have a "vcf_idx". All rows are validated before
+        any objects are built, and every problem found is reported at once.
+
+        Args:
+            path (str): Local path or remote URI of the sample sheet.
+
+        Returns:
+            List[VCF]: One VCF object per row of the sheet.
+        """
+        table = read_sheet(path)
+        errors = check_sheet(
+            table, path, ["sample", "caller", "vcf"], ["sample", "caller"]
+        )
+        gz = pc.fill_null(pc.ends_with(table["vcf"], ".gz"), False)
+        errors += row_errors(
+            table, pc.and_(gz, pc.invert(present(table, "vcf_idx"))), "no vcf_idx"
+        )
+        raise_for_errors(errors, path)
+        return build_all(cls, table)
@@ -1,9 +1,25 @@
-from flytekit import TaskMetadata, kwtypes
-from flytekit.extras.tasks.shell import OutputLocation, ShellTask
+from functools import partial
+from pathlib import Path
+from typing import List
+from flytekit import (
+    TaskMetadata,
+    kwtypes,
+    task,
+    dynamic,
+    map_task,
+    Resources,
+    current_context,
+)
+from flytekit.extras.tasks.shell import OutputLocation, ShellTask, subproc_execute
 from flytekit.types.file import FlyteFile
 from flytekit.types.directory import FlyteDirectory
 
-from unionbio.config import main_img_fqn
+from unionbio.config import main_img_fqn, logger
+from unionbio.datatypes.alignment import Alignment
+from unionbio.datatypes.reference import Reference
+from unionbio.datatypes.variants import VCF
+from unionbio.tasks.intervals import reference_lengths, balance_contigs
+from unionbio.tasks.resources import java_opts
 
 """
 Produce a base quality score recalibration report from a deduped alignment file.
@@ -25,6 +41,7 @@ base_recal = ShellTask(
     script="""
     mkdir /tmp/recal
     "java" \
+    $(python -m unionbio.tasks.resources java-opts) \
     "-jar" \
     "/usr/local/bin/gatk" \
     "BaseRecalibrator" \
@@ -43,3 +60,126 @@ base_recal = ShellTask(
     ],
     container_image=main_img_fqn,
 )
+
+
+@task(container_image=main_img_fqn)
+def plan_bqsr_groups(ref: Reference, n_scatter: int) -> List[str]:
+    """
+    Split the reference's contigs into balanced groups to recalibrate in parallel.
+
+    Whole contigs are grouped, as in GATK's best practices pipeline, so that no read
+    spanning a group boundary is counted twice.
+
+    Args:
+        ref (Reference): The reference, with its .fai or .dict alongside the FASTA.
+        n_scatter (int): The number of groups to aim for.
+
+    Returns:
+        List[str]: Comma separated contig names for each group.
+    """
+    ref.download("seq_index")
+    groups = balance_contigs(
+        reference_lengths(ref.get_ref_path(unzip=False)), n_scatter
+    )
+    logger.info(f"Scattering BQSR over {len(groups)} contig groups")
+    return [",".join(g) for g in groups]
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu="2", mem="8Gi"),
+)
+def base_recal_contigs(
+    al: Alignment, ref: Reference, sites: VCF, contigs: str
+) -> FlyteFile:
+    """
+    Produce a base quality score recalibration table for a group of contigs.
+
+    Args:
+        al (Alignment): A deduped, indexed alignment.
+        ref (Reference): The reference, with its .fai and .dict alongside the FASTA.
+        sites (VCF): Known variant sites and their index.
+        contigs (str): Comma separated contig names to recalibrate.
+
+    Returns:
+        FlyteFile: The recalibration table for the given contigs.
+    """
+    ldir = Path(current_context().working_directory)
+    ref.download("gatk")
+    al.dl_all(ldir)
+    sites.dl_all(ldir)
+    out = ldir.joinpath(al.get_bqsr_fname())
+
+    cmd = [
+        "gatk",
+        "--java-options",
+        java_opts(),
+        "BaseRecalibrator",
+        "--input",
+        al.alignment.path,
+        "--output",
+        str(out),
+        "--reference",
+        str(ref.get_ref_path()),
+        "--known-sites",
+        sites.vcf.path,
+    ]
+    for contig in contigs.split(","):
+        cmd += ["-L", contig]
+    logger.debug(f"Running command: {cmd}")
+    subproc_execute(cmd)
+
+    return FlyteFile(path=str(out))
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu="1", mem="4Gi"),
+)
+def gather_bqsr_reports(al: Alignment, reports: List[FlyteFile]) -> Alignment:
+    """
+    Merge per-contig recalibration tables into a single BQSR report for the alignment.
+
+    Args:
+        al (Alignment): The alignment the tables were produced from.
+        reports (List[FlyteFile]): The recalibration tables of each contig group.
+
+    Returns:
+        Alignment: The alignment with its gathered BQSR report attached.
+    """
+    out = Path(current_context().working_directory).joinpath(al.get_bqsr_fname())
+    cmd = ["gatk", "--java-options", java_opts(), "GatherBQSRReports"]
+    for rep in reports:
+        cmd += ["-I", rep.download()]
+    cmd += ["-O", str(out)]
+    logger.debug(f"Running command: {cmd}")
+    subproc_execute(cmd)
+
+    setattr(al, "bqsr_report", FlyteFile(path=str(out)))
+    return al
+
+
+@dynamic(container_image=main_img_fqn)
+def base_recal_scattered(
+    al: Alignment, ref: Reference, sites: VCF, n_scatter: int = 24
+) -> Alignment:
+    """
+    Run base quality score recalibration scattered across balanced groups of contigs.
+
+    Each group is recalibrated in its own task via a map task, and the tables are merged
+    with GatherBQSRReports into the file named by `Alignment.get_bqsr_fname()`.
+
+    Args:
+        al (Alignment): A deduped, indexed alignment.
+        ref (Reference): The reference, with its .fai and .dict alongside the FASTA.
+        sites (VCF): Known variant sites and their index.
+        n_scatter (int): The number of contig groups to recalibrate in parallel.
+
+    Returns:
+        Alignment: The alignment with its BQSR report attached.
+    """
+    groups = plan_bqsr_groups(ref=ref, n_scatter=n_scatter)
+    reports = map_task(partial(base_recal_contigs, al=al, ref=ref, sites=sites))(
+        contigs=groups
+    )
+    return gather_bqsr_reports(al=al, reports=reports)
@@ -1,14 +1,29 @@
+from functools import partial
 from pathlib import Path
-from typing import List
-from flytekit import kwtypes, task, Resources, current_context, TaskMetadata, dynamic
+from typing import List, Optional
+from flytekit import (
+    kwtypes,
+    task,
+    Resources,
+    current_context,
+    TaskMetadata,
+    dynamic,
+    map_task,
+)
 from flytekit.extras.tasks.shell import OutputLocation, ShellTask, subproc_execute
 from flytekit.types.file import FlyteFile
 from flytekit.types.directory import FlyteDirectory
 
-from unionbio.config import ref_hash, main_img_fqn, logger
+from unionbio.config import ref_hash, main_img_fqn, logger, bowtie2_cpu
 from unionbio.datatypes.alignment import Alignment
 from unionbio.datatypes.reads import Reads
-
+from unionbio.tasks.helpers import (
+    shard_paired_fastq,
+    merge_alignment_summaries,
+    sam_output_args,
+    sam_output_threads,
+)
+from unionbio.tasks.resources import task_cpus, tool_threads, samtools_sort_mem
 
 """
 Generate Bowtie2 index files from a reference genome.
@@ -38,19 +53,25 @@ bowtie2_index = ShellTask(
 
 @task(
     container_image=main_img_fqn,
-    requests=Resources(cpu="4", mem="10Gi"),
+    requests=Resources(cpu=bowtie2_cpu, mem="10Gi"),
 )
-def bowtie2_align_paired_reads(idx: FlyteDirectory, fs: Reads) -> Alignment:
+def bowtie2_align_paired_reads(
+    idx: FlyteDirectory, fs: Reads, fmt: str = "bam", ref: Optional[FlyteFile] = None
+) -> Alignment:
     """
     Perform paired-end alignment using Bowtie 2 on a filtered sample.
 
     This function takes a FlyteDirectory object representing the Bowtie 2 index and a
     FiltSample object containing filtered sample data. It performs paired-end alignment
     using Bowtie 2 and returns a Alignment object representing the resulting alignment.
+    Output is streamed straight into the requested format.
 
     Args:
         idx (FlyteDirectory): A FlyteDirectory object representing the Bowtie 2 index.
         fs (Reads): A filtered sample Reads object containing filtered sample data to be aligned.
+        fmt (str): The alignment format to write, one of "sam", "bam" or "cram".
+        ref (FlyteFile, optional): The reference FASTA the index was built from, required
+            for CRAM.
 
     Returns:
         Alignment: An Alignment object representing the alignment result.
@@ -59,39 +80,406 @@ def bowtie2_align_paired_reads(idx: FlyteDirectory, fs: Reads) -> Alignment:
     logger.debug(f"Index downloaded to {idx.path}")
     ldir = Path(current_context().working_directory)
 
-    alignment = Alignment(fs.sample, "bowtie2", "sam")
+    alignment = Alignment(fs.sample, "bowtie2", fmt, lane=fs.lane)
     al = ldir.joinpath(alignment.get_alignment_fname())
     rep = ldir.joinpath(alignment.get_report_fname())
     logger.debug(f"Writing alignment to {al} and report to {rep}")
 
-    cmd = [
-        "bowtie2",
-        "-x",
-        f"{idx.path}/bt2_idx",
-        "-1",
-        fs.read1,
-        "-2",
-        fs.read2,
-        "-S",
-        al,
+    # samtools compresses the output alongside, so bowtie2 gets the remaining CPUs
+    aligner_threads = tool_threads(
+        "bowtie2", cpus=max(1, task_cpus() - sam_output_threads(fmt))
+    )
+    cmd = " ".join(
+        [
+            "set -o pipefail;",
+            "bowtie2",
+            "-p",
+            str(aligner_threads),
+            "-x",
+            f"{idx.path}/bt2_idx",
+            "-1",
+            fs.read1.download(),
+            "-2",
+            fs.read2.download(),
+            "2>",
+            str(rep),
+        ]
+        + sam_output_args(fmt, al, ref.download() if ref else None)
+    )
+    logger.debug(f"Running command: {cmd}")
+
+    subproc_execute(cmd, shell=True, executable="/bin/bash")
+
+    setattr(alignment, "alignment", FlyteFile(path=str(al)))
+    setattr(alignment, "alignment_report", FlyteFile(path=str(rep)))
+    setattr(alignment, "sorted", False)
+    setattr(alignment, "deduped", False)
+
+    return alignment
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu=bowtie2_cpu, mem="10Gi"),
+)
+def bowtie2_align_dedup(
+    idx: FlyteDirectory,
+    fs: Reads,
+    fmt: str = "bam",
+    ref: Optional[FlyteFile] = None,
+    debug: bool = False,
+) -> Alignment:
+    """
+    Align, coordinate sort and mark duplicates in a paired-end sample in a single task.
+
+    Bowtie 2's output is streamed through samtools fixmate, sort and markdup, so no
+    intermediate alignment is written, uploaded or downloaded between steps. With `debug`
+    set, each stage instead writes its output to a file, and the intermediates are returned
+    in the Alignment's `intermediates` directory for inspection.
+
+    Args:
+        idx (FlyteDirectory): A FlyteDirectory object representing the Bowtie 2 index.
+        fs (Reads): A Reads object containing filtered sample data to be aligned.
+        fmt (str): The alignment format to write, either "bam" or "cram".
+        ref (FlyteFile, optional): The reference FASTA the index was built from, required
+            for CRAM.
+        debug (bool): Keep the output of every stage.
+
+    Returns:
+        Alignment: A sorted, deduplicated and indexed Alignment with its duplicate metrics.
+    """
+    if fmt not in ("bam", "cram"):
+        raise ValueError(f"Deduplicated alignments must be bam or cram, not {fmt}")
+    if fmt == "cram" and not ref:
+        raise ValueError("A reference is required to write CRAM")
+    idx.download()
+    ldir = Path(current_context().working_directory)
+
+    alignment = Alignment(
+        fs.sample, "bowtie2", fmt, sorted=True, deduped=True, lane=fs.lane
+    )
+    al = ldir.joinpath(alignment.get_alignment_fname())
+    al_idx = ldir.joinpath(alignment.get_alignment_idx_fname())
+    rep = ldir.joinpath(alignment.get_report_fname())
+    metrics = ldir.joinpath(alignment.get_metrics_fname())
+
+    threads = str(tool_threads("samtools"))
+    out_args = ["-O", fmt.upper()]
+    if ref:
+        out_args += ["--reference", ref.download()]
+
+    # Intermediate stages pass uncompressed BAM (-u) to avoid needless compression
+    stages = [
+        [
+            "bowtie2",
+            "-p",
+            str(tool_threads("bowtie2")),
+            "-x",
+            f"{idx.path}/bt2_idx",
+            "-1",
+            fs.read1.download(),
+            "-2",
+            fs.read2.download(),
+            "2>",
+            str(rep),
+        ],
+        ["samtools", "fixmate", "-m", "-u", "-", "-"],
+        [
+            "samtools",
+            "sort",
+            "-@",
+            threads,
+            "-m",
+            samtools_sort_mem(),
+            "-u",
+            "-T",
+            str(ldir.joinpath("sort_tmp")),
+            "-",
+        ],
+        ["samtools", "markdup", "-@", threads, "-f", str(metrics)]
+        + out_args
+        + ["-", str(al)],
+    ]
+
+    if debug:
+        dbg_dir = ldir.joinpath("intermediates")
+        dbg_dir.mkdir(exist_ok=True)
+        inters = [
+            Alignment(fs.sample, "bowtie2", "sam", lane=fs.lane).get_alignment_fname(),
+            f"{fs._get_state_str()}_bowtie2_fixmate.bam",
+            Alignment(
+                fs.sample, "bowtie2", "bam", sorted=True, lane=fs.lane
+            ).get_alignment_fname(),
+        ]
+        stdin = []
+        for stage, inter in zip(stages, inters):
+            out = dbg_dir.joinpath(inter)
+            cmd = " ".join(stage + stdin + [">", str(out)])
+            logger.debug(f"Running command: {cmd}")
+            subproc_execute(cmd, shell=True, executable="/bin/bash")
+            stdin = ["<", str(out)]
+        cmd = " ".join(stages[-1] + stdin)
+    else:
+        cmd = " ".join(["set -o pipefail;"] + stages[0])
+        for stage in stages[1:]:
+            cmd += " | " + " ".join(stage)
+    logger.debug(f"Running command: {cmd}")
+    subproc_execute(cmd, shell=True, executable="/bin/bash")
+    subproc_execute(["samtools", "index", "-@", threads, str(al), "-o", str(al_idx)])
+
+    if debug:
+        setattr(alignment, "intermediates", FlyteDirectory(path=str(dbg_dir)))
+    setattr(alignment, "alignment", FlyteFile(path=str(al)))
+    setattr(alignment, "alignment_idx", FlyteFile(path=str(al_idx)))
+    setattr(alignment, "alignment_report", FlyteFile(path=str(rep)))
+    setattr(alignment, "dedup_metrics", FlyteFile(path=str(metrics)))
+
+    return alignment
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu="2", mem="2Gi"),
+)
+def split_reads(fs: Reads, n_shards: int) -> List[Reads]:
+    """
+    Split a paired-end sample into synchronized shards of read pairs.
+
+    Args:
+        fs (Reads): A Reads object containing the paired-end sample to split.
+        n_shards (int): The number of shards to split the sample into.
+
+    Returns:
+        List[Reads]: One Reads object per non-empty shard, named <sample>-shard<N>.
+    """
+    ldir = Path(current_context().working_directory)
+    shards = shard_paired_fastq(
+        Path(fs.read1.download()),
+        Path(fs.read2.download()),
+        ldir,
+        f"{fs.sample}-shard",
+        n_shards,
+    )
+    return [
+        Reads(
+            sample=f"{fs.sample}-shard{i}",
+            filtered=fs.filtered,
+            lane=fs.lane,
+            read1=FlyteFile(path=str(r1)),
+            read2=FlyteFile(path=str(r2)),
+        )
+        for i, (r1, r2) in enumerate(shards)
     ]
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu=bowtie2_cpu, mem="10Gi"),
+)
+def bowtie2_align_shard(
+    idx: FlyteDirectory, fs: Reads, sort: bool = False
+) -> Alignment:
+    """
+    Align one shard of a paired-end sample with Bowtie 2, streaming the output straight into
+    a BAM so shards can be concatenated without converting them, or into samtools sort so
+    sorted shards can be merged without re-sorting.
+
+    Args:
+        idx (FlyteDirectory): A FlyteDirectory object representing the Bowtie 2 index.
+        fs (Reads): A Reads object containing one shard of a sample.
+        sort (bool): Coordinate sort the shard's alignment.
+
+    Returns:
+        Alignment: An Alignment of the shard with its Bowtie 2 report.
+    """
+    idx.download()
+    ldir = Path(current_context().working_directory)
+
+    alignment = Alignment(fs.sample, "bowtie2", "bam", sorted=sort, lane=fs.lane)
+    al = ldir.joinpath(alignment.get_alignment_fname())
+    rep = ldir.joinpath(alignment.get_report_fname())
+
+    if sort:
+        # samtools sort mostly works once bowtie2 is done, so both get every CPU
+        aligner_threads = tool_threads("bowtie2")
+        out = [
+            "|",
+            "samtools",
+            "sort",
+            "-@",
+            str(tool_threads("samtools")),
+            "-m",
+            samtools_sort_mem(),
+            "-T",
+            str(ldir.joinpath("sort_tmp")),
+            "-o",
+            str(al),
+            "-",
+        ]
+    else:
+        aligner_threads = tool_threads(
+            "bowtie2", cpus=max(1, task_cpus() - sam_output_threads("bam"))
+        )
+        out = sam_output_args("bam", al)
+    cmd = " ".join(
+        [
+            "set -o pipefail;",
+            "bowtie2",
+            "-p",
+            str(aligner_threads),
+            "-x",
+            f"{idx.path}/bt2_idx",
+            "-1",
+            fs.read1.download(),
+            "-2",
+            fs.read2.download(),
+            "2>",
+            str(rep),
+        ]
+        + out
+    )
     logger.debug(f"Running command: {cmd}")
+    subproc_execute(cmd, shell=True, executable="/bin/bash")
 
-    result = subproc_execute(cmd)
+    setattr(alignment, "alignment", FlyteFile(path=str(al)))
+    setattr(alignment, "alignment_report", FlyteFile(path=str(rep)))
+    setattr(alignment, "deduped", False)
 
+    return alignment
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu=bowtie2_cpu, mem="4Gi"),
+)
+def merge_alignments(
+    sample: str,
+    shards: List[Alignment],
+    fmt: str = "bam",
+    ref: Optional[FlyteFile] = None,
+    sort: bool = False,
+) -> Alignment:
+    """
+    Combine the alignments of the shards of one sample into a single alignment, along
+    with the aligner reports into the report a single run would have produced.
+
+    By default the shards are concatenated, and the result is unsorted, with the same name
+    and state as aligning the sample in one task. With `sort` set, coordinate-sorted
+    shards are merged into one sorted, indexed BAM or CRAM.
+
+    Args:
+        sample (str): The name of the sample the shards belong to.
+        shards (List[Alignment]): BAM alignments of each shard, all from the same aligner,
+            and coordinate sorted if `sort` is set.
+        fmt (str): The merged alignment format, one of "sam", "bam" or "cram". Sorted
+            alignments must be "bam" or "cram".
+        ref (FlyteFile, optional): The reference FASTA, required for CRAM.
+        sort (bool): Merge sorted shards into a sorted, indexed alignment.
+
+    Returns:
+        Alignment: An Alignment of the whole sample.
+    """
+    if sort and fmt not in ("bam", "cram"):
+        raise ValueError(f"Sorted alignments must be bam or cram, not {fmt}")
+    ldir = Path(current_context().working_directory)
+    alignment = Alignment(
+        sample, shards[0].aligner, fmt, sorted=sort, lane=shards[0].lane
+    )
+    al = ldir.joinpath(alignment.get_alignment_fname())
+    rep = ldir.joinpath(alignment.get_report_fname())
+
+    inputs = [s.alignment.download() for s in shards]
+    if sort:
+        if fmt == "cram" and not ref:
+            raise ValueError("A reference is required to write CRAM")
+        threads = str(tool_threads("samtools"))
+        merge_cmd = ["samtools", "merge", "-@", threads, "-f", "-O", fmt.upper()]
+        if ref:
+            merge_cmd += ["--reference", ref.download()]
+        merge_cmd += ["-o", str(al)] + inputs
+        logger.debug(f"Running command: {merge_cmd}")
+        subproc_execute(merge_cmd)
+        al_idx = ldir.joinpath(alignment.get_alignment_idx_fname())
+        subproc_execute(
+            ["samtools", "index", "-@", threads, str(al), "-o", str(al_idx)]
+        )
+        setattr(alignment, "alignment_idx", FlyteFile(path=str(al_idx)))
+    else:
+        # Shards are BAMs with the same header, so they concatenate without decoding
+        cat_cmd = ["samtools", "cat", "-o"]
+        if fmt == "bam":
+            cmd = " ".join(cat_cmd + [str(al)] + inputs)
+        else:
+            if fmt == "sam":
+                out = ["|", "samtools", "view", "-h", "-o", str(al), "-"]
+            else:
+                out = sam_output_args(fmt, al, ref.download() if ref else None)
+            cmd = " ".join(["set -o pipefail;"] + cat_cmd + ["-"] + inputs + out)
+        logger.debug(f"Running command: {cmd}")
+        subproc_execute(cmd, shell=True, executable="/bin/bash")
+
+    reports = []
+    for s in shards:
+        with open(s.alignment_report.download()) as f:
+            reports.append(f.read())
     with open(rep, "w") as f:
-        f.write(result.error)
+        f.write(merge_alignment_summaries(reports))
 
     setattr(alignment, "alignment", FlyteFile(path=str(al)))
     setattr(alignment, "alignment_report", FlyteFile(path=str(rep)))
-    setattr(alignment, "sorted", False)
     setattr(alignment, "deduped", False)
 
     return alignment
 
 
 @dynamic(container_image=main_img_fqn)
-def bowtie2_align_samples(idx: FlyteDirectory, samples: List[Reads]) -> List[Alignment]:
+def bowtie2_align_sharded(
+    idx: FlyteDirectory,
+    fs: Reads,
+    n_shards: int,
+    fmt: str = "bam",
+    ref: Optional[FlyteFile] = None,
+    sort: bool = False,
+) -> Alignment:
+    """
+    Align a paired-end sample with Bowtie 2 by scattering it across nodes.
+
+    The sample is split into `n_shards` synchronized shards of read pairs, each shard is
+    aligned in its own task via a map task, and the results are combined into one
+    alignment with a combined aligner report.
+
+    By default the output is unsorted, matching `bowtie2_align_paired_reads`, so callers
+    needing coordinate order must sort it, e.g. with `sort_alignment`. Set `sort` to have
+    each shard sorted as it is aligned and the shards merged into a coordinate-sorted,
+    indexed BAM or CRAM instead, which avoids sorting the whole sample in one task.
+
+    Args:
+        idx (FlyteDirectory): A FlyteDirectory object representing the Bowtie 2 index.
+        fs (Reads): A Reads object containing filtered sample data to be aligned.
+        n_shards (int): The number of shards to align in parallel.
+        fmt (str): The merged alignment format, one of "sam", "bam" or "cram". Sorted
+            output must be "bam" or "cram".
+        ref (FlyteFile, optional): The reference FASTA, required for CRAM.
+        sort (bool): Produce a coordinate-sorted, indexed alignment.
+
+    Returns:
+        Alignment: An Alignment object representing the merged alignment result.
+    """
+    shards = split_reads(fs=fs, n_shards=n_shards)
+    aligned = map_task(partial(bowtie2_align_shard, idx=idx, sort=sort))(fs=shards)
+    return merge_alignments(
+        sample=fs.sample, shards=aligned, fmt=fmt, ref=ref, sort=sort
+    )
+
+
+@dynamic(container_image=main_img_fqn)
+def bowtie2_align_samples(
+    idx: FlyteDirectory,
+    samples: List[Reads],
+    n_shards: int = 1,
+    fmt: str = "bam",
+    ref: Optional[FlyteFile] = None,
+) -> List[Alignment]:
     """
     Process samples through bowtie2.
 
@@ -99,10 +487,18 @@ def bowtie2_align_samples(idx: FlyteDirectory, samples: List[Reads]) -> List[Ali
     Reads objects containing filtered sample data. It performs paired-end alignment
     using bowtie2. It then returns a list of Alignment objects representing the alignment results.
 
+    Alignments are unsorted whether or not samples are sharded, so callers needing
+    coordinate order must sort them, e.g. with `sort_alignment`.
+
     Args:
         bt2_idx (FlyteDirectory): The FlyteDirectory object representing the bowtie2 index.
         samples (List[Reads]): A list of Reads objects containing sample data
             to be processed.
+        n_shards (int): The number of shards to scatter each sample's alignment across.
+            Samples are aligned in a single task when this is 1.
+        fmt (str): The alignment format to write, one of "sam", "bam" or "cram".
+        ref (FlyteFile, optional): The reference FASTA the index was built from, required
+            for CRAM.
 
     Returns:
         List[List[Alignment]]: A list of lists, where each inner list contains alignment
@@ -110,6 +506,11 @@ def bowtie2_align_samples(idx: FlyteDirectory, samples: List[Reads]) -> List[Ali
     """
     sams = []
     for sample in samples:
-        sam = bowtie2_align_paired_reads(idx=idx, fs=sample)
+        if n_shards > 1:
+            sam = bowtie2_align_sharded(
+                idx=idx, fs=sample, n_shards=n_shards, fmt=fmt, ref=ref
+            )
+        else:
+            sam = bowtie2_align_paired_reads(idx=idx, fs=sample, fmt=fmt, ref=ref)
         sams.append(sam)
     return sams
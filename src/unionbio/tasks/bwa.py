@@ -1,36 +1,48 @@
 import shutil
 from pathlib import Path
-from flytekit import kwtypes, task, Resources, current_context, TaskMetadata
-from flytekit.extras.tasks.shell import OutputLocation, ShellTask, subproc_execute
-from flytekit.types.file import FlyteFile
+from flytekit import task, Resources, current_context, FlyteContextManager
 from flytekit.types.directory import FlyteDirectory
 
-from unionbio.config import ref_hash, main_img_fqn
+from unionbio.config import ref_hash, main_img_fqn, index_registry
 from unionbio.datatypes.reference import Reference
+from unionbio.tasks.index_registry import lookup_or_build
 
 
+# bwa index and samtools faidx are single-threaded, so extra CPUs would sit idle
 @task(
     container_image=main_img_fqn,
-    requests=Resources(cpu="4", mem="10Gi"),
+    requests=Resources(cpu="1", mem="10Gi"),
     cache=True,
     cache_version=ref_hash,
 )
-def bwa_index(ref_obj: Reference) -> Reference:
+def bwa_index(ref_obj: Reference, registry: str = index_registry) -> Reference:
     """Indexes a reference genome using BWA.
 
+    The index is fetched from the index registry when this reference has been indexed
+    with the same bwa version before, and built and registered otherwise. The output
+    directory holds the reference's FASTA, .fai and .dict with the bwa index on top, and
+    leaves out other aligners' indices sitting in the input directory.
+
     Args:
         ref_obj (Reference): The reference object containing the reference genome.
+        registry (str): The root of the index registry.
 
     Returns:
         Reference: The updated reference object with associated index and metadata.
     """
-    ref_obj.ref_dir.download()
-    sam_idx = ["samtools", "faidx", str(ref_obj.get_ref_path())]
-    sam_result = subproc_execute(sam_idx, cwd=ref_obj.ref_dir.path)
-
-    bwa_idx = ["bwa", "index", str(ref_obj.get_ref_path())]
-    bwa_result = subproc_execute(bwa_idx, cwd=ref_obj.ref_dir.path)
-
+    ref_obj.download("gatk")
+    loc = lookup_or_build(ref_obj.get_ref_path(), "bwa", registry)
+
+    src_dir = Path(ref_obj.ref_dir.path)
+    merged = Path(current_context().working_directory).joinpath("bwa_ref")
+    for src in ref_obj.local_files("gatk"):
+        dst = merged.joinpath(src.relative_to(src_dir))
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, dst)
+    file_access = FlyteContextManager.current_context().file_access
+    file_access.get_data(loc, str(merged), is_multipart=True)
+
+    setattr(ref_obj, "ref_dir", FlyteDirectory(path=str(merged)))
     setattr(ref_obj, "index_name", ref_obj.ref_name)
     setattr(ref_obj, "indexed_with", "bwa")
 
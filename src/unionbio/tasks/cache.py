@@ -0,0 +1,162 @@
+import os
+import fcntl
+import shutil
+import hashlib
+import json
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable
+
+from unionbio.config import logger, dl_cache_dir, dl_cache_budget
+
+# Linux ioctl to share extents between files on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def cache_key(url: str, validators: dict) -> str:
+    """
+    Derive a content-addressed cache key from a URL and the validators describing the
+    version of the object behind it (e.g. ETag, Last-Modified, size or checksum).
+
+    Args:
+        url (str): The URL of the remote object.
+        validators (dict): Version identifiers reported by the server or supplied by the caller.
+
+    Returns:
+        str: A hex digest uniquely identifying this version of the object.
+    """
+    payload = json.dumps({"url": url, **validators}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@contextmanager
+def _locked(lock_path: Path, blocking: bool = True):
+    """
+    Hold an exclusive advisory lock on `lock_path` for the duration of the context. Yields
+    whether the lock was acquired, which is always True when blocking.
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def reflink_or_copy(src: Path, dst: Path):
+    """
+    Materialize `src` at `dst` as a writable file of its own: a reflink if the filesystem
+    supports it, otherwise a full copy. Hardlinks are never used, as callers renaming or
+    modifying their file in place would then alter the cached object.
+    """
+    dst.unlink(missing_ok=True)
+    try:
+        with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        logger.debug(f"Reflinked {src} to {dst}")
+        return
+    except OSError:
+        dst.unlink(missing_ok=True)
+    shutil.copyfile(src, dst)
+    logger.debug(f"Copied {src} to {dst}")
+
+
+def _cache_root(cache_dir: Path | None) -> Path:
+    cache_dir = cache_dir or dl_cache_dir
+    if not cache_dir:
+        raise ValueError("No download cache directory, set UNIONBIO_CACHE_DIR")
+    return Path(cache_dir)
+
+
+def _entry_size(entry: Path) -> int:
+    return sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+
+
+def evict(cache_dir: Path | None = None, budget: int = dl_cache_budget):
+    """
+    Evict least recently used entries until the cache fits within `budget` bytes. Entries
+    locked by another process are skipped.
+
+    Args:
+        cache_dir (Path, optional): The root of the cache. Defaults to `dl_cache_dir`.
+        budget (int): The maximum size of the cache in bytes.
+    """
+    cache_dir = _cache_root(cache_dir)
+    with _locked(cache_dir.joinpath("evict.lock")):
+        entries = [
+            (entry.stat().st_mtime, _entry_size(entry), entry)
+            for entry in cache_dir.glob("objects/*/*")
+            if entry.is_dir() and not entry.name.endswith(".tmp")
+        ]
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= budget:
+                break
+            with _locked(
+                cache_dir.joinpath("locks", f"{entry.name}.lock"), False
+            ) as ok:
+                if not ok:
+                    continue
+                logger.info(f"Evicting {entry} ({size} bytes) from download cache")
+                shutil.rmtree(entry)
+                total -= size
+
+
+def fetch_cached(
+    key: str,
+    fname: str,
+    local_dir: Path,
+    fill: Callable[[Path], None],
+    cache_dir: Path | None = None,
+    budget: int = dl_cache_budget,
+) -> Path:
+    """
+    Hand out a cached object into `local_dir`, filling the cache first on a miss.
+
+    Entries are filled under a per-key lock, so concurrent processes requesting the same
+    object wait for a single download rather than racing. Each fill happens in a temporary
+    directory that is renamed into place once complete. Cached files are read-only and
+    handed out as reflinks or copies, so callers own a writable file they may rename or
+    modify without touching the cache.
+
+    Args:
+        key (str): The cache key, see `cache_key`.
+        fname (str): The file name of the object.
+        local_dir (Path): The directory the object should be made available in.
+        fill (Callable[[Path], None]): Called with a directory to download `fname` into on a miss.
+        cache_dir (Path, optional): The root of the cache. Defaults to `dl_cache_dir`.
+        budget (int): The maximum size of the cache in bytes.
+
+    Returns:
+        Path: The local path to the file.
+    """
+    cache_dir = _cache_root(cache_dir)
+    entry = cache_dir.joinpath("objects", key[:2], key)
+    obj = entry.joinpath(fname)
+    dst = Path(local_dir).joinpath(fname)
+    missed = False
+
+    with _locked(cache_dir.joinpath("locks", f"{key}.lock")):
+        if obj.exists():
+            logger.info(f"Download cache hit for {fname} ({key})")
+        else:
+            logger.info(f"Download cache miss for {fname} ({key})")
+            missed = True
+            # Left in place on failure so partial downloads can resume
+            tmp = entry.with_name(f"{key}.tmp")
+            tmp.mkdir(parents=True, exist_ok=True)
+            fill(tmp)
+            tmp.joinpath(fname).chmod(0o444)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        os.utime(entry)
+        reflink_or_copy(obj, dst)
+
+    if missed:
+        evict(cache_dir, budget)
+    return dst
@@ -0,0 +1,373 @@
+import json
+import shutil
+from pathlib import Path
+from typing import List, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from flytekit import task, current_context, Resources
+from flytekit.types.directory import FlyteDirectory
+
+from unionbio.config import main_img_fqn, logger, dl_concurrency
+from unionbio.datatypes.variants import VCF
+from unionbio.tasks.resources import task_cpus
+from unionbio.tasks.variant_table import read_contig, read_header, read_tbi
+
+MANIFEST = "cohort.json"
+SUMMARY = "summary.parquet"
+SITE_KEYS = pa.schema(
+    [
+        ("CHROM", pa.string()),
+        ("POS", pa.int32()),
+        ("REF", pa.string()),
+        ("ALT", pa.string()),
+    ]
+)
+# Dosage of a missing genotype
+MISSING = -1
+PLOIDY = 2
+# Genotypes held in memory at once while summarizing
+SUMMARY_BYTES = 256 * 1024 * 1024
+
+
+def gt_dosages(gt: pa.Array) -> np.ndarray:
+    """
+    Count the non-reference alleles in each genotype, e.g. 0/1 -> 1 and 1|2 -> 2, with
+    MISSING for genotypes that are absent or have a missing allele.
+    """
+    alleles = pc.split_pattern_regex(gt, r"[/|]")
+    parents = pc.list_parent_indices(alleles).to_numpy()
+    flat = alleles.flatten()
+    alt = pc.not_equal(flat, "0").to_numpy(zero_copy_only=False)
+    missing = pc.equal(flat, ".").to_numpy(zero_copy_only=False)
+    dosages = np.bincount(parents, weights=alt, minlength=len(gt)).astype(np.int8)
+    missing = np.bincount(parents, weights=missing, minlength=len(gt)) > 0
+    dosages[missing | gt.is_null().to_numpy(zero_copy_only=False)] = MISSING
+    return dosages
+
+
+def read_genotypes(
+    vcf: Path, name: str | None = None
+) -> tuple[pa.Table, np.ndarray, list[str]]:
+    """
+    Read the sites of an indexed VCF and the dosages of each of its samples.
+
+    Args:
+        vcf (Path): The bgzipped VCF, with its .tbi alongside.
+        name (str, optional): Name to use for the sample of a single sample VCF instead
+            of the one in its header.
+
+    Returns:
+        tuple[pa.Table, np.ndarray, list[str]]: The sites, keyed as in SITE_KEYS, a
+            sites x samples array of dosages and the sample names.
+    """
+    header = read_header(vcf)
+    if "GT" not in header.format or not header.samples:
+        raise ValueError(f"{vcf} has no genotypes")
+    samples = [name] if name and len(header.samples) == 1 else header.samples
+
+    sites, dosages = [], []
+    for contig, span in read_tbi(vcf.with_name(f"{vcf.name}.tbi")).items():
+        for table in read_contig(vcf, span, header, [], ["GT"]):
+            alt = pc.fill_null(pc.binary_join(table["ALT"], ","), ".")
+            sites.append(
+                pa.table(
+                    [
+                        pa.repeat(contig, table.num_rows),
+                        table["POS"],
+                        table["REF"],
+                        alt,
+                    ],
+                    schema=SITE_KEYS,
+                )
+            )
+            gts = [
+                gt_dosages(table[f"{s}_GT"].combine_chunks()) for s in header.samples
+            ]
+            dosages.append(np.stack(gts, axis=1))
+    sites = pa.concat_tables(sites) if sites else SITE_KEYS.empty_table()
+    dosages = (
+        np.concatenate(dosages) if dosages else np.empty((0, len(samples)), np.int8)
+    )
+
+    # Keep the first of any records that share a site
+    rows = pa.array(np.arange(sites.num_rows))
+    first = (
+        sites.append_column("row", rows)
+        .group_by(SITE_KEYS.names)
+        .aggregate([("row", "min")])["row_min"]
+    )
+    if len(first) < sites.num_rows:
+        logger.warning(
+            f"Dropping {sites.num_rows - len(first)} duplicate sites in {vcf}"
+        )
+        keep = np.sort(first.to_numpy())
+        sites, dosages = sites.take(keep), dosages[keep]
+    return sites, dosages, samples
+
+
+class CohortMatrix:
+    """
+    An on-disk sites x samples matrix of genotype dosages (int8 counts of non-reference
+    alleles, MISSING where not called), grown by appending batches of samples.
+
+    The store is a directory holding:
+        - cohort.json: the samples and files of each batch, and the number of sites
+        - sites/part-NNNNN.parquet: the site index, where row i of the parts in order
+          describes site i
+        - gt-NNNNN.i8: a memory-mapped sites x samples array for each batch
+
+    Appending never rewrites earlier batches. Sites first seen in a later batch lie past
+    the end of earlier batches' arrays and read as `absent` for their samples, which is
+    homozygous reference by default, since single sample VCFs only list variant sites.
+
+    Args:
+        path (Path): The store's directory, created on the first append if missing.
+        absent (int): Dosage of sites missing from a sample's VCF, for a new store.
+    """
+
+    def __init__(self, path: Path, absent: int = 0):
+        self.path = Path(path)
+        manifest = self.path.joinpath(MANIFEST)
+        if manifest.exists():
+            self.meta = json.loads(manifest.read_text())
+        else:
+            self.meta = {
+                "absent": absent,
+                "n_sites": 0,
+                "site_parts": [],
+                "batches": [],
+            }
+
+    @property
+    def samples(self) -> list[str]:
+        return [s for batch in self.meta["batches"] for s in batch["samples"]]
+
+    @property
+    def n_sites(self) -> int:
+        return self.meta["n_sites"]
+
+    def sites(self) -> pa.Table:
+        """
+        The site index, with each site's row number in the matrix as "site_id".
+        """
+        parts = [pq.read_table(self.path.joinpath(p)) for p in self.meta["site_parts"]]
+        if not parts:
+            return SITE_KEYS.append(pa.field("site_id", pa.int64())).empty_table()
+        return pa.concat_tables(parts)
+
+    def _batch(self, batch: dict) -> np.memmap:
+        shape = (batch["n_sites"], len(batch["samples"]))
+        return np.memmap(
+            self.path.joinpath(batch["file"]), dtype=np.int8, mode="r", shape=shape
+        )
+
+    def genotypes(self, start: int = 0, end: int | None = None) -> np.ndarray:
+        """
+        Dosages of sites [start, end) for every sample, in the order of `samples`.
+        """
+        end = self.n_sites if end is None else min(end, self.n_sites)
+        out = np.full(
+            (end - start, len(self.samples)), self.meta["absent"], dtype=np.int8
+        )
+        col = 0
+        for batch in self.meta["batches"]:
+            width = len(batch["samples"])
+            stop = min(end, batch["n_sites"])
+            if stop > start:
+                out[: stop - start, col : col + width] = self._batch(batch)[start:stop]
+            col += width
+        return out
+
+    def summary(self) -> pa.Table:
+        """
+        The site index with each site's alternate allele frequency among called
+        genotypes ("AF", assuming diploid samples) and the share of samples called
+        ("call_rate"). Sites are summarized in blocks to bound memory use.
+        """
+        rows = max(1, SUMMARY_BYTES // max(1, len(self.samples)))
+        af, call_rate = [], []
+        for start in range(0, self.n_sites, rows):
+            gts = self.genotypes(start, start + rows)
+            called = gts != MISSING
+            n_called = called.sum(axis=1)
+            alt = np.where(called, gts, 0).sum(axis=1, dtype=np.int64)
+            with np.errstate(invalid="ignore"):
+                af.append(alt / (PLOIDY * n_called))
+            call_rate.append(n_called / len(self.samples))
+
+        def column(parts: list[np.ndarray]) -> pa.Array:
+            values = np.concatenate(parts) if parts else np.empty(0)
+            return pa.array(values.astype(np.float32), from_pandas=True)
+
+        return (
+            self.sites()
+            .append_column("AF", column(af))
+            .append_column("call_rate", column(call_rate))
+        )
+
+    def _assign_ids(
+        self, sites: pa.Table, index: pa.Table
+    ) -> tuple[np.ndarray, pa.Table]:
+        """
+        Look up the id of each site in `index`, numbering sites not found from the end
+        of the index. Returns the ids and the new sites.
+        """
+        rows = pa.array(np.arange(sites.num_rows))
+        joined = (
+            sites.append_column("row", rows)
+            .join(index, keys=SITE_KEYS.names, join_type="left outer")
+            .sort_by("row")
+        )
+        ids = np.array(pc.fill_null(joined["site_id"], -1))
+        is_new = ids < 0
+        ids[is_new] = np.arange(len(index), len(index) + is_new.sum())
+        new = joined.filter(pa.array(is_new)).select(SITE_KEYS.names)
+        new = new.append_column("site_id", pa.array(ids[is_new], pa.int64()))
+        return ids, new
+
+    def append(
+        self,
+        vcfs: list[Path],
+        names: list[str | None] | None = None,
+        threads: int | None = None,
+        batch_size: int = dl_concurrency,
+    ):
+        """
+        Add the samples of indexed VCFs to the matrix, as one batch per `batch_size` VCFs.
+
+        The VCFs of a batch are parsed concurrently, their sites are matched against the
+        site index and new sites are added to it, and the batch's array is filled in
+        before the next batch is parsed, so memory use is bounded by the batch rather
+        than the whole append. The manifest is written last, so an interrupted append
+        leaves the store as it was.
+
+        Args:
+            vcfs (list[Path]): Bgzipped VCFs with their .tbi alongside.
+            names (list[str | None], optional): A name for each VCF's sample, used in
+                place of its header's when the VCF holds a single sample.
+            threads (int, optional): VCFs parsed at once. Defaults to the task's CPUs.
+            batch_size (int): VCFs parsed and held in memory per batch.
+        """
+        if not vcfs:
+            logger.info(f"No VCFs to add to the cohort at {self.path}")
+            return
+        names = names or [None] * len(vcfs)
+        meta = json.loads(json.dumps(self.meta))
+        index = self.sites()
+        seen = self.samples
+        self.path.mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=threads or task_cpus()) as pool:
+            for start in range(0, len(vcfs), batch_size):
+                end = start + batch_size
+                parsed = list(
+                    pool.map(read_genotypes, vcfs[start:end], names[start:end])
+                )
+                index = self._write_batch(parsed, index, seen, meta)
+                seen = seen + meta["batches"][-1]["samples"]
+
+        meta["n_sites"] = len(index)
+        tmp = self.path.joinpath(f"{MANIFEST}.tmp")
+        tmp.write_text(json.dumps(meta, indent=2))
+        tmp.rename(self.path.joinpath(MANIFEST))
+        logger.info(
+            f"Added {len(seen) - len(self.samples)} samples and "
+            f"{len(index) - self.n_sites} new sites to the cohort at {self.path}"
+        )
+        self.meta = meta
+
+    def _write_batch(
+        self,
+        parsed: list[tuple[pa.Table, np.ndarray, list[str]]],
+        index: pa.Table,
+        seen: list[str],
+        meta: dict,
+    ) -> pa.Table:
+        """
+        Write parsed VCFs as a new batch, recording it and any new site part in `meta`,
+        and return the grown site index.
+        """
+        samples = [s for _, _, vcf_samples in parsed for s in vcf_samples]
+        dupes = [s for s, n in Counter(seen + samples).items() if n > 1]
+        if dupes:
+            raise ValueError(
+                f"Samples {dupes} are already in the cohort at {self.path}"
+            )
+
+        ids = []
+        new_parts = []
+        for sites, _, _ in parsed:
+            vcf_ids, new = self._assign_ids(sites, index)
+            ids.append(vcf_ids)
+            if new.num_rows:
+                index = pa.concat_tables([index, new])
+                new_parts.append(new)
+
+        batch = {
+            "file": f"gt-{len(meta['batches']):05}.i8",
+            "samples": samples,
+            "n_sites": len(index),
+        }
+        gts = np.memmap(
+            self.path.joinpath(batch["file"]),
+            dtype=np.int8,
+            mode="w+",
+            shape=(len(index), len(samples)),
+        )
+        gts[:] = meta["absent"]
+        col = 0
+        for vcf_ids, (_, dosages, vcf_samples) in zip(ids, parsed):
+            gts[vcf_ids, col : col + len(vcf_samples)] = dosages
+            col += len(vcf_samples)
+        gts.flush()
+        del gts
+
+        if new_parts:
+            part = f"sites/part-{len(meta['site_parts']):05}.parquet"
+            self.path.joinpath("sites").mkdir(exist_ok=True)
+            pq.write_table(pa.concat_tables(new_parts), self.path.joinpath(part))
+            meta["site_parts"].append(part)
+        meta["batches"].append(batch)
+        return index
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu="4", mem="8Gi"),
+)
+def build_cohort(
+    vcfs: List[VCF], cohort: Optional[FlyteDirectory] = None
+) -> FlyteDirectory:
+    """
+    Add the samples of per-sample VCFs to a cohort genotype matrix, starting a new one if
+    no existing cohort is given, and summarize the cohort's allele frequency and call
+    rate per site into summary.parquet.
+
+    Args:
+        vcfs (List[VCF]): Bgzipped VCF objects with their tabix indices. Single sample
+            VCFs take their sample name from the object.
+        cohort (FlyteDirectory, optional): A cohort built by an earlier run to add to.
+
+    Returns:
+        FlyteDirectory: The cohort, laid out as `CohortMatrix` describes.
+
+    Note:
+        While `CohortMatrix.append` never rewrites earlier batches, a task output can't
+        refer back to the files of its input, so appending to an existing cohort copies
+        it in full and uploads the copy. The cost of an append grows with the cohort.
+    """
+    wd = Path(current_context().working_directory)
+    out = wd.joinpath("cohort")
+    if cohort is not None:
+        shutil.copytree(cohort.download(), out)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(vcfs), dl_concurrency))) as pool:
+        list(pool.map(lambda v: v.dl_all(workdir=wd), vcfs))
+
+    out.mkdir(exist_ok=True)
+    matrix = CohortMatrix(out)
+    matrix.append([Path(v.vcf.path) for v in vcfs], names=[v.sample for v in vcfs])
+    pq.write_table(matrix.summary(), out.joinpath(SUMMARY))
+    return FlyteDirectory(path=str(out))
@@ -0,0 +1,113 @@
+import mmap
+import struct
+from bisect import bisect_right
+from functools import lru_cache
+from pathlib import Path
+
+from unionbio.tasks.helpers import is_bgzf, inflate_bgzf_block
+
+# Inflated BGZF blocks kept per reader, at most 64KiB each
+BGZF_BLOCK_CACHE = 256
+
+
+def read_fai(fai: Path) -> dict[str, tuple[int, int, int, int]]:
+    """
+    Read the length, byte offset, bases per line and bytes per line of each contig from a
+    FASTA index.
+    """
+    entries = {}
+    with open(fai) as f:
+        for line in f:
+            if line.strip():
+                name, *fields = line.split("\t")[:5]
+                entries[name] = tuple(int(x) for x in fields)
+    return entries
+
+
+class FastaReader:
+    """
+    Random access to subsequences of an indexed FASTA without reading the whole file.
+
+    Plain FASTAs are memory-mapped and sliced using the layout recorded in their .fai.
+    Bgzipped FASTAs additionally need the .gzi written by `bgzip -i` or `samtools faidx`,
+    which maps uncompressed offsets to the compressed BGZF blocks that hold them, so only
+    the blocks overlapping a request are inflated.
+
+    Args:
+        path (Path): The FASTA, with its .fai (and .gzi if bgzipped) alongside.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.index = read_fai(self.path.with_name(f"{self.path.name}.fai"))
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._bgzf = self.path.suffix == ".gz"
+        if self._bgzf:
+            if not is_bgzf(self.path):
+                raise ValueError(
+                    f"{self.path} is gzipped but not BGZF, recompress it with bgzip"
+                )
+            self._read_gzi(self.path.with_name(f"{self.path.name}.gzi"))
+            self._block = lru_cache(maxsize=BGZF_BLOCK_CACHE)(self._inflate)
+
+    def _read_gzi(self, gzi: Path):
+        data = gzi.read_bytes()
+        (n,) = struct.unpack_from("<Q", data)
+        pairs = struct.unpack_from(f"<{2 * n}Q", data, 8)
+        # The first block starts at 0 in both files and isn't listed
+        self._coffsets = [0, *pairs[0::2]]
+        self._uoffsets = [0, *pairs[1::2]]
+
+    def _inflate(self, coffset: int) -> bytes:
+        bsize = struct.unpack_from("<H", self._mm, coffset + 16)[0] + 1
+        return inflate_bgzf_block(self._mm[coffset : coffset + bsize])
+
+    def _read(self, start: int, end: int) -> bytes:
+        """
+        Read the uncompressed bytes [start, end) of the file.
+        """
+        if not self._bgzf:
+            return self._mm[start:end]
+        i = bisect_right(self._uoffsets, start) - 1
+        coffset, uoffset = self._coffsets[i], self._uoffsets[i]
+        chunks = []
+        while uoffset < end and coffset < len(self._mm):
+            block = self._block(coffset)
+            chunks.append(block[max(0, start - uoffset) : end - uoffset])
+            bsize = struct.unpack_from("<H", self._mm, coffset + 16)[0] + 1
+            coffset += bsize
+            uoffset += len(block)
+        return b"".join(chunks)
+
+    def contigs(self) -> dict[str, int]:
+        return {name: entry[0] for name, entry in self.index.items()}
+
+    def fetch(self, contig: str, start: int = 0, end: int | None = None) -> str:
+        """
+        Fetch the sequence of `contig` between 0-based, half-open coordinates `start` and
+        `end`, clipped to the contig's length.
+        """
+        if contig not in self.index:
+            raise KeyError(f"Contig {contig} is not in {self.path}")
+        length, offset, line_bases, line_bytes = self.index[contig]
+        end = length if end is None else min(end, length)
+        if start < 0 or start > end:
+            raise ValueError(f"Invalid range {start}-{end} for {contig}")
+
+        def pos(base: int) -> int:
+            return offset + base // line_bases * line_bytes + base % line_bases
+
+        return self._read(pos(start), pos(end)).translate(None, b"\r\n").decode()
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+@lru_cache(maxsize=16)
+def open_fasta(path: str) -> FastaReader:
+    """
+    Open a FastaReader, reusing the one already open for `path`.
+    """
+    return FastaReader(Path(path))
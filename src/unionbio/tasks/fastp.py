@@ -4,6 +4,7 @@ from flytekit.types.file import FlyteFile
 from flytekit.extras.tasks.shell import subproc_execute
 from unionbio.config import main_img_fqn, logger, fastp_cpu
 from unionbio.datatypes.reads import Reads
+from unionbio.tasks.resources import tool_threads
 
 
 @task(
@@ -25,7 +26,7 @@ def pyfastp(rs: Reads) -> Reads:
         FiltSample: A FiltSample object representing the filtered and preprocessed data.
     """
     ldir = Path(current_context().working_directory)
-    samp = Reads(rs.sample)
+    samp = Reads(rs.sample, lane=rs.lane)
     samp.filtered = True
     o1, o2 = samp.get_read_fnames()
     rep = samp.get_report_fname()
@@ -41,7 +42,7 @@ def pyfastp(rs: Reads) -> Reads:
         "-I",
         rs.read2,
         "--thread",
-        str(int(fastp_cpu) * 2),
+        str(tool_threads("fastp")),
         "-o",
         o1p,
         "-O",
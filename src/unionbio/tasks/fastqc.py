@@ -1,8 +1,14 @@
-from flytekit import kwtypes, TaskMetadata
-from flytekit.extras.tasks.shell import OutputLocation, ShellTask
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+from flytekit import kwtypes, task, Resources, TaskMetadata, current_context
+from flytekit.extras.tasks.shell import OutputLocation, ShellTask, subproc_execute
 from flytekit.types.directory import FlyteDirectory
 
-from unionbio.config import main_img_fqn
+from unionbio.config import main_img_fqn, logger, fastqc_cpu, dl_concurrency
+from unionbio.datatypes.reads import Reads
+from unionbio.tasks.resources import tool_threads
 
 """
 Perform quality control using FastQC.
@@ -29,3 +35,74 @@ fastqc = ShellTask(
     output_locs=[OutputLocation(var="qc", var_type=FlyteDirectory, location="/tmp/qc")],
     container_image=main_img_fqn,
 )
+
+
+@task(
+    requests=Resources(cpu=fastqc_cpu, mem="2Gi"),
+    container_image=main_img_fqn,
+    cache=True,
+    cache_version="1",
+)
+def fastqc_reads(rs: Reads) -> FlyteDirectory:
+    """
+    Perform quality control on a single sample's reads using FastQC.
+
+    Only the sample's own read files are downloaded, and FastQC processes them
+    concurrently, one thread per file, so mapping this over samples keeps QC time flat as
+    the number of samples grows.
+
+    Args:
+        rs (Reads): A Reads object containing the raw sequencing data to be processed.
+
+    Returns:
+        qc (FlyteDirectory): A directory containing the sample's fastqc report output.
+    """
+    out_dir = Path(current_context().working_directory).joinpath(f"{rs.sample}-qc")
+    out_dir.mkdir(exist_ok=True)
+    reads = [f for f in (rs.read1, rs.read2, rs.uread) if f]
+    for f in reads:
+        f.download()
+
+    cmd = [
+        "fastqc",
+        "--threads",
+        str(tool_threads("fastqc")),
+        "--outdir",
+        str(out_dir),
+        *[f.path for f in reads],
+    ]
+    logger.debug(f"Running command: {cmd}")
+    subproc_execute(cmd)
+
+    return FlyteDirectory(path=str(out_dir))
+
+
+@task(container_image=main_img_fqn)
+def gather_fastqc(reports: List[FlyteDirectory]) -> FlyteDirectory:
+    """
+    Gather per-sample FastQC output into a single flat directory of reports, laid out as
+    `fastqc` writes them for `render_multiqc` and `check_fastqc_reports`.
+
+    Args:
+        reports (List[FlyteDirectory]): The output directories of `fastqc_reads`.
+
+    Returns:
+        qc (FlyteDirectory): A directory containing all the fastqc report output.
+    """
+    out_dir = Path(current_context().working_directory).joinpath("qc")
+    out_dir.mkdir(exist_ok=True)
+
+    def fetch(rep_dir: FlyteDirectory) -> list[Path]:
+        rep_dir.download()
+        return [p for p in Path(rep_dir.path).iterdir() if p.is_file()]
+
+    with ThreadPoolExecutor(max_workers=dl_concurrency) as pool:
+        for files in pool.map(fetch, reports):
+            for f in files:
+                dest = out_dir.joinpath(f.name)
+                if dest.exists():
+                    raise ValueError(f"More than one FastQC report named {f.name}")
+                shutil.copyfile(f, dest)
+    logger.info(f"Gathered {len(reports)} FastQC outputs into {out_dir}")
+
+    return FlyteDirectory(path=str(out_dir))
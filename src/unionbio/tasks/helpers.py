@@ -1,12 +1,110 @@
+import os
+import re
+import atexit
 import gzip
+import zlib
+import shutil
+import struct
+import json
+import time
+import base64
 import ftplib
+import hashlib
+import itertools
+import threading
+import tarfile
+import tempfile
+import subprocess
 import requests
-from pathlib import Path
+from fnmatch import fnmatch
+from pathlib import Path, PurePosixPath
+from contextlib import contextmanager
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+    TimeoutError as FutureTimeoutError,
+)
+from requests.adapters import HTTPAdapter
 from flytekit.remote import FlyteRemote
 from flytekit.configuration import Config
 
+from unionbio.config import (
+    logger,
+    dl_connections,
+    dl_concurrency,
+    dl_host_concurrency,
+    dl_host_rate,
+    dl_part_size,
+    io_chunk_size,
+    dl_retries,
+    dl_cache_dir,
+)
+from unionbio.tasks.cache import cache_key, fetch_cached
+from unionbio.tasks.resources import task_cpus
 
-def gunzip_file(gzip_file: Path) -> Path:
+
+def is_bgzf(gzip_file: Path) -> bool:
+    """
+    Check whether a gzip file is BGZF, i.e. a series of independent gzip members that
+    each record their compressed size in a "BC" extra subfield.
+    """
+    with open(gzip_file, "rb") as f:
+        header = f.read(18)
+    return (
+        len(header) == 18
+        and header[:4] == b"\x1f\x8b\x08\x04"
+        and header[12:14] == b"BC"
+        and struct.unpack("<H", header[14:16])[0] == 2
+    )
+
+
+def inflate_bgzf_block(block: bytes) -> bytes:
+    xlen = struct.unpack("<H", block[10:12])[0]
+    crc, isize = struct.unpack("<II", block[-8:])
+    data = zlib.decompress(block[12 + xlen : -8], -15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise IOError("BGZF block failed CRC check")
+    return data
+
+
+def _read_bgzf_blocks(f, budget: int) -> list[bytes]:
+    """
+    Read whole BGZF blocks from `f` until roughly `budget` compressed bytes are buffered.
+    """
+    blocks = []
+    total = 0
+    while total < budget:
+        header = f.read(18)
+        if not header:
+            break
+        if len(header) < 18 or header[12:14] != b"BC":
+            raise IOError(
+                f"Malformed BGZF block header at offset {f.tell() - len(header)}"
+            )
+        bsize = struct.unpack("<H", header[16:18])[0] + 1
+        blocks.append(header + f.read(bsize - 18))
+        total += bsize
+    return blocks
+
+
+def gunzip_file(gzip_file: Path, threads: int | None = None) -> Path:
+    """
+    Decompress a gzip file alongside the original, dropping the .gz extension.
+
+    Decompression streams in bounded chunks. BGZF files, such as those written by bgzip, are
+    made of independent blocks which are inflated in parallel across `threads`. Other gzip
+    files, including multi-member ones, are streamed serially. Output is written to a temporary
+    file and moved into place, and decompression is skipped entirely when an output newer than
+    the input already exists.
+
+    Args:
+        gzip_file (Path): The gzip file to decompress.
+        threads (int, optional): Number of threads used to inflate BGZF blocks. Defaults to the
+            number of CPUs.
+
+    Returns:
+        Path: The path to the decompressed file.
+    """
     # Ensure the input file exists
     if not gzip_file.exists():
         raise FileNotFoundError(f"{gzip_file} not found")
@@ -17,15 +115,116 @@ def gunzip_file(gzip_file: Path) -> Path:
 
     # Define the output file path
     output_file = gzip_file.with_suffix("")
+    if (
+        output_file.exists()
+        and output_file.stat().st_mtime >= gzip_file.stat().st_mtime
+    ):
+        logger.debug(f"{output_file} is up to date with {gzip_file}, skipping")
+        return output_file
 
-    # Open input and output files
-    with gzip.open(gzip_file, "rb") as f_in, open(output_file, "wb") as f_out:
-        # Decompress and write to output file
-        f_out.write(f_in.read())
+    tmp_file = output_file.with_name(output_file.name + ".tmp")
+    threads = threads or os.cpu_count()
+    try:
+        if is_bgzf(gzip_file):
+            logger.debug(f"Inflating BGZF blocks of {gzip_file} with {threads} threads")
+            with open(gzip_file, "rb") as f_in, open(
+                tmp_file, "wb"
+            ) as f_out, ThreadPoolExecutor(max_workers=threads) as pool:
+                while blocks := _read_bgzf_blocks(f_in, threads * io_chunk_size):
+                    for data in pool.map(inflate_bgzf_block, blocks):
+                        f_out.write(data)
+        else:
+            with gzip.open(gzip_file, "rb") as f_in, open(tmp_file, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, length=io_chunk_size)
+        os.replace(tmp_file, output_file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
 
     return output_file
 
 
+def _decompress_cmd(path: Path, threads: int) -> list[str]:
+    """
+    Command streaming the decompressed contents of `path` to stdout, using the fastest
+    decompressor available.
+    """
+    if shutil.which("pigz"):
+        return ["pigz", "-dc", "-p", str(threads), str(path)]
+    if shutil.which("bgzip"):
+        return ["bgzip", "-dc", "-@", str(threads), str(path)]
+    return ["gzip", "-dc", str(path)]
+
+
+def _feed_fifo(cmd: list[str], fifo: Path) -> subprocess.Popen:
+    """
+    Start `cmd` with its stdout on `fifo` once a consumer opens the FIFO for reading.
+    Opening a FIFO for writing blocks until then, and a writer that exits before the
+    consumer arrives would take its buffered output with it.
+    """
+    with open(fifo, "wb") as f:
+        return subprocess.Popen(cmd, stdout=f)
+
+
+def _stop_feed(fifo: Path, feed) -> int:
+    """
+    Kill the decompressor behind `fifo`, returning its exit code.
+    """
+    # Briefly opening the read end releases a feeder still waiting for a consumer
+    os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+    proc = feed.result()
+    proc.kill()
+    return proc.wait()
+
+
+@contextmanager
+def decompressed_fifos(paths: list[Path], threads: int = 2):
+    """
+    Expose gzipped files to a consumer as named pipes, fed by one decompressor process per
+    file, so decompression overlaps with the consumer and no uncompressed copy is written
+    to disk. Files that aren't gzipped are passed through untouched.
+
+    Decompressors are waited on when the context exits, and an error is raised if any of
+    them failed, since the consumer would otherwise have silently read truncated input.
+
+    Args:
+        paths (list[Path]): The files to decompress.
+        threads (int): Number of threads given to each decompressor.
+
+    Yields:
+        list[Path]: Paths to read the decompressed contents from, in the order of `paths`.
+    """
+    with tempfile.TemporaryDirectory() as fifo_dir:
+        fifos, feeds = [], []
+        pool = ThreadPoolExecutor(max_workers=max(1, len(paths)))
+        try:
+            for i, path in enumerate(map(Path, paths)):
+                if path.suffix != ".gz":
+                    fifos.append(path)
+                    continue
+                fifo = Path(fifo_dir).joinpath(f"{i}_{path.with_suffix('').name}")
+                os.mkfifo(fifo)
+                cmd = _decompress_cmd(path, threads)
+                logger.debug(f"Streaming {path} through {fifo}")
+                feeds.append((path, fifo, pool.submit(_feed_fifo, cmd, fifo)))
+                fifos.append(fifo)
+            yield fifos
+        except BaseException:
+            for _, fifo, feed in feeds:
+                _stop_feed(fifo, feed)
+            raise
+        finally:
+            pool.shutdown(wait=False)
+
+        for path, fifo, feed in feeds:
+            try:
+                rc = feed.result(timeout=60).wait(timeout=60)
+            except (FutureTimeoutError, subprocess.TimeoutExpired):
+                # The consumer finished without opening or draining the pipe
+                rc = _stop_feed(fifo, feed)
+            if rc != 0:
+                raise RuntimeError(f"Decompressing {path} failed with exit code {rc}")
+
+
 def get_remote(local=None, config_file=None):
     """
     Get remote configuration settings and return a remote object.
@@ -48,9 +247,11 @@ def get_remote(local=None, config_file=None):
             config_file=(
                 None
                 if local
-                else config_file
-                if config_file is not None
-                else str(Path.home() / ".flyte" / "config-sandbox.yaml")
+                else (
+                    config_file
+                    if config_file is not None
+                    else str(Path.home() / ".flyte" / "config-sandbox.yaml")
+                )
             )
         ),
         default_project="flytesnacks",
@@ -58,40 +259,689 @@ def get_remote(local=None, config_file=None):
     )
 
 
-def fetch_file(url: str, local_dir: str) -> Path:
+# Per-host connection pools shared by all downloads in the process
+_pool_lock = threading.Lock()
+_sessions: dict[str, requests.Session] = {}
+_ftp_pools: dict[str, list[ftplib.FTP]] = {}
+_host_slots: dict[str, threading.Semaphore] = {}
+_host_next_request: dict[str, float] = {}
+
+
+def _session(host: str) -> requests.Session:
     """
-    Downloads a file from the specified URL.
+    Return the pooled session for `host`, so that requests to the same host reuse
+    connections instead of paying for a new TCP and TLS handshake each time.
+    """
+    with _pool_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=dl_host_concurrency * dl_connections
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            # Bodies are written as sent, so ask for them unencoded to keep byte ranges
+            # and Content-Length meaningful
+            session.headers["Accept-Encoding"] = "identity"
+            _sessions[host] = session
+        return _sessions[host]
 
-    Args:
-        url (str): The URL of the tar.gz file to download.
-        local_dir (Path): The directory where you would like this file saved.
 
-    Returns:
-        Path: The local path to the file.
+@atexit.register
+def close_pools():
+    """
+    Close the pooled HTTP sessions and FTP control connections.
+    """
+    with _pool_lock:
+        for session in _sessions.values():
+            session.close()
+        for ftp in itertools.chain.from_iterable(_ftp_pools.values()):
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+        _sessions.clear()
+        _ftp_pools.clear()
 
-    Raises:
-        requests.HTTPError: If an HTTP error occurs while downloading the file.
+
+def _throttle(host: str):
+    """
+    Block until another request to `host` is allowed under the per-host rate limit.
+    """
+    with _pool_lock:
+        now = time.monotonic()
+        slot = max(now, _host_next_request.get(host, now))
+        _host_next_request[host] = slot + 1 / dl_host_rate
+    time.sleep(slot - now)
+
+
+@contextmanager
+def _host_slot(host: str):
+    """
+    Limit the number of files downloaded concurrently from `host`.
+    """
+    with _pool_lock:
+        slot = _host_slots.setdefault(host, threading.Semaphore(dl_host_concurrency))
+    with slot:
+        yield
+
+
+@contextmanager
+def _ftp_session(host: str):
+    """
+    Borrow a logged-in FTP control connection to `host` from the pool, opening one if none
+    are idle. Connections are returned to the pool after use unless an error occurred.
+    """
+    with _pool_lock:
+        pool = _ftp_pools.setdefault(host, [])
+        ftp = pool.pop() if pool else None
+    if ftp is not None:
+        try:
+            ftp.voidcmd("NOOP")
+        except ftplib.all_errors:
+            ftp.close()
+            ftp = None
+    if ftp is None:
+        _throttle(host)
+        ftp = ftplib.FTP(host)
+        ftp.login()
+        ftp.voidcmd("TYPE I")
+    try:
+        yield ftp
+    except BaseException:
+        ftp.close()
+        raise
+    with _pool_lock:
+        _ftp_pools[host].append(ftp)
+
+
+def _plan_ranges(size: int, part_size: int) -> list[tuple[int, int]]:
+    """
+    Split an object of `size` bytes into inclusive (start, end) byte ranges.
+    """
+    return [
+        (start, min(start + part_size, size) - 1) for start in range(0, size, part_size)
+    ]
+
+
+def _load_state(state_path: Path, validator: dict) -> set[int]:
+    """
+    Return the indices of completed parts recorded for a partial download, or an empty set
+    if there is no state or it was recorded against a different version of the object.
     """
+    if state_path.exists():
+        state = json.loads(state_path.read_text())
+        if state.get("validator") == validator:
+            return set(state["done"])
+    return set()
+
+
+def _save_state(state_path: Path, validator: dict, done: set[int]):
+    tmp = state_path.with_name(state_path.name + ".tmp")
+    tmp.write_text(json.dumps({"validator": validator, "done": sorted(done)}))
+    os.replace(tmp, state_path)
+
+
+def _expected_checksum(headers: dict, checksum: str | None) -> tuple[str, str] | None:
+    """
+    Resolve the checksum to verify a download against as an (algorithm, hexdigest) tuple.
+    An explicit "<algorithm>:<hexdigest>" string takes precedence, otherwise the MD5 advertised
+    by GCS in the x-goog-hash header is used when present.
+    """
+    if checksum:
+        algo, digest = checksum.split(":", 1)
+        return algo.lower(), digest.lower()
+    for part in headers.get("x-goog-hash", "").split(","):
+        key, _, val = part.strip().partition("=")
+        if key == "md5":
+            return "md5", base64.b64decode(val).hex()
+    return None
+
+
+def file_digest(path: Path, algo: str = "sha256") -> str:
+    """
+    Hex digest of a file's contents, read in bounded chunks.
+    """
+    h = hashlib.new(algo)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(io_chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _verify_download(
+    part_path: Path, url: str, size: int | None, expected: tuple[str, str] | None
+):
+    actual_size = part_path.stat().st_size
+    if size is not None and actual_size != size:
+        raise IOError(f"Downloaded {actual_size} bytes from {url}, expected {size}")
+    if expected is not None:
+        algo, digest = expected
+        actual = file_digest(part_path, algo)
+        if actual != digest:
+            part_path.unlink()
+            part_path.with_suffix(".state").unlink(missing_ok=True)
+            raise IOError(f"{algo} mismatch for {url}: expected {digest}, got {actual}")
+        logger.debug(f"Verified {algo} checksum of {url}")
+
+
+def _content_encoding(headers: dict) -> str | None:
+    """
+    The Content-Encoding of a response, or None if the body is sent as is.
+    """
+    encoding = headers.get("Content-Encoding", "identity").lower()
+    return None if encoding == "identity" else encoding
+
+
+def _fetch_range(url: str, part_path: Path, start: int, end: int):
+    """
+    Stream the inclusive byte range [start, end] of `url` into the same offsets of `part_path`,
+    retrying the range on transient errors.
+    """
+    host = url.split("/")[2]
+    for attempt in range(dl_retries + 1):
+        _throttle(host)
+        try:
+            with _session(host).get(
+                url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=60
+            ) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError(f"Server ignored range request for {url}")
+                if _content_encoding(r.headers):
+                    raise IOError(f"Server sent an encoded range of {url}")
+                written = 0
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    for chunk in r.raw.stream(io_chunk_size, decode_content=False):
+                        f.write(chunk)
+                        written += len(chunk)
+            if written != end - start + 1:
+                raise IOError(
+                    f"Short read of bytes {start}-{end} of {url}: got {written}"
+                )
+            return
+        except (requests.RequestException, IOError) as e:
+            if attempt == dl_retries:
+                raise
+            logger.warning(f"Retrying bytes {start}-{end} of {url} after error: {e}")
+            time.sleep(2**attempt)
+
+
+def _fetch_http(
+    url: str,
+    local_path: Path,
+    connections: int,
+    part_size: int,
+    checksum: str | None,
+):
+    part_path = local_path.with_name(local_path.name + ".part")
+    state_path = local_path.with_name(local_path.name + ".state")
+    host = url.split("/")[2]
+    session = _session(host)
+
+    _throttle(host)
+    head = session.head(url, allow_redirects=True, timeout=60)
+    headers = head.headers if head.ok else {}
+    # The length and ranges of an encoded body don't describe the file itself
+    encoded = _content_encoding(headers)
+    size = (
+        int(headers["Content-Length"])
+        if "Content-Length" in headers and not encoded
+        else None
+    )
+    ranged = headers.get("Accept-Ranges", "").lower() == "bytes"
+
+    if size is None or not ranged:
+        logger.info(f"Server does not support ranged requests, streaming {url}")
+        _throttle(host)
+        with session.get(url, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            headers = r.headers
+            encoded = _content_encoding(headers)
+            if encoded:
+                logger.warning(f"{url} was sent with {encoded} encoding, decoding it")
+                size = None
+            elif size is None:
+                size = int(headers.get("Content-Length", 0)) or None
+            with open(part_path, "wb") as f:
+                for chunk in r.raw.stream(io_chunk_size, decode_content=bool(encoded)):
+                    f.write(chunk)
+            # Check the encoded body arrived whole, as the decoded length is unknown
+            sent = headers.get("Content-Length")
+            if encoded and sent is not None and r.raw.tell() != int(sent):
+                raise IOError(
+                    f"Received {r.raw.tell()} encoded bytes of {url}, expected {sent}"
+                )
+    else:
+        validator = {
+            "size": size,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        ranges = _plan_ranges(size, part_size)
+        done = _load_state(state_path, validator)
+        if not done or not part_path.exists() or part_path.stat().st_size != size:
+            done = set()
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+        todo = [i for i in range(len(ranges)) if i not in done]
+        logger.info(
+            f"Fetching {len(todo)} of {len(ranges)} parts of {url} over {connections} connections"
+        )
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            futures = {
+                pool.submit(_fetch_range, url, part_path, *ranges[i]): i for i in todo
+            }
+            for fut in as_completed(futures):
+                if fut.exception() is not None:
+                    errors.append(fut.exception())
+                    continue
+                done.add(futures[fut])
+                _save_state(state_path, validator, done)
+        if errors:
+            raise errors[0]
+
+    _verify_download(part_path, url, size, _expected_checksum(headers, checksum))
+    os.replace(part_path, local_path)
+    state_path.unlink(missing_ok=True)
+
+
+def _fetch_ftp(url: str, local_path: Path, checksum: str | None):
     url_parts = url.split("/")
     host = url_parts[2]
-    prot = url_parts[0]
     fname = url_parts[-1]
     remote_dir = "/".join(url_parts[3:-1])
-    local_path = Path(local_dir).joinpath(fname)
+    part_path = local_path.with_name(local_path.name + ".part")
+
+    size = None
+    for attempt in range(dl_retries + 1):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        try:
+            with _ftp_session(host) as ftp:
+                ftp.cwd(f"/{remote_dir}")
+                try:
+                    size = ftp.size(fname)
+                except ftplib.error_perm:
+                    size = None
+                if size is not None and offset > size:
+                    offset = 0
+                if offset:
+                    logger.info(f"Resuming {url} from byte {offset}")
+                with open(part_path, "ab" if offset else "wb") as f:
+                    if size is None or offset < size:
+                        ftp.retrbinary(
+                            f"RETR {fname}",
+                            f.write,
+                            blocksize=io_chunk_size,
+                            rest=offset or None,
+                        )
+            break
+        except ftplib.all_errors as e:
+            if attempt == dl_retries:
+                raise
+            logger.warning(f"Retrying {url} after error: {e}")
+            time.sleep(2**attempt)
+
+    _verify_download(part_path, url, size, _expected_checksum({}, checksum))
+    os.replace(part_path, local_path)
+
+
+def _remote_validators(url: str, checksum: str | None) -> dict:
+    """
+    Collect identifiers for the current version of a remote object without downloading it:
+    ETag, Last-Modified and size for HTTP(S), modification time and size for FTP, plus any
+    caller-supplied checksum. Returns an empty dict if the version can't be determined.
+    """
+    validators = {}
+    prot = url.split("/")[0]
+    if prot == "ftp:":
+        url_parts = url.split("/")
+        try:
+            with _ftp_session(url_parts[2]) as ftp:
+                ftp.cwd("/" + "/".join(url_parts[3:-1]))
+                validators["size"] = ftp.size(url_parts[-1])
+                validators["last_modified"] = ftp.sendcmd(f"MDTM {url_parts[-1]}")[4:]
+        except ftplib.all_errors as e:
+            logger.warning(f"Unable to determine version of {url}: {e}")
+            validators = {}
+    elif prot == "http:" or prot == "https:":
+        host = url.split("/")[2]
+        _throttle(host)
+        head = _session(host).head(url, allow_redirects=True, timeout=60)
+        if head.ok:
+            for key, header in [
+                ("etag", "ETag"),
+                ("last_modified", "Last-Modified"),
+                ("goog_hash", "x-goog-hash"),
+            ]:
+                if header in head.headers:
+                    validators[key] = head.headers[header]
+            if validators and "Content-Length" in head.headers:
+                validators["size"] = head.headers["Content-Length"]
+    if checksum:
+        validators["checksum"] = checksum
+    return validators
+
 
+def _download(
+    url: str,
+    local_path: Path,
+    connections: int,
+    part_size: int,
+    checksum: str | None,
+):
+    prot = url.split("/")[0]
     if prot == "ftp:":  # FTP
-        ftp = ftplib.FTP(host)
-        ftp.login()
-        ftp.cwd(remote_dir)
-        with open(local_path, "wb") as file:
-            ftp.retrbinary(f"RETR {fname}", file.write)
-        ftp.quit()
+        _fetch_ftp(url, local_path, checksum)
     elif prot == "http:" or prot == "https:":  # HTTP
         try:
-            response = requests.get(url)
-            with open(local_path, "wb") as file:
-                file.write(response.content)
+            _fetch_http(url, local_path, connections, part_size, checksum)
         except requests.HTTPError as e:
-            print(f"HTTP error: {e}")
+            logger.error(f"HTTP error: {e}")
             raise e
+
+
+def fetch_file(
+    url: str,
+    local_dir: str,
+    connections: int = dl_connections,
+    part_size: int = dl_part_size,
+    checksum: str | None = None,
+    cache: bool = True,
+) -> Path:
+    """
+    Downloads a file from the specified URL.
+
+    Files are streamed to disk so memory use stays constant regardless of file size. HTTP(S)
+    objects served with byte-range support are split into parts that are fetched concurrently,
+    with completed parts recorded in a sidecar state file so a retried download only fetches
+    what it is missing. FTP downloads resume from the end of the partial file. Downloads are
+    verified against the advertised length and, when one is known, a checksum before being
+    moved into place.
+
+    When caching is enabled and UNIONBIO_CACHE_DIR is set, objects are stored in the
+    node-local download cache keyed by their URL and version, and handed out as reflinks
+    or copies on later requests. Objects whose version can't be determined bypass the
+    cache.
+
+    Args:
+        url (str): The URL of the file to download.
+        local_dir (Path): The directory where you would like this file saved.
+        connections (int): The number of concurrent range requests for HTTP(S) downloads.
+        part_size (int): The size in bytes of each HTTP(S) range request.
+        checksum (str, optional): The expected checksum as "<algorithm>:<hexdigest>". Defaults
+            to the MD5 advertised by the server, if any.
+        cache (bool): Whether to use the node-local download cache, if one is configured.
+
+    Returns:
+        Path: The local path to the file.
+
+    Raises:
+        requests.HTTPError: If an HTTP error occurs while downloading the file.
+        IOError: If the downloaded file fails length or checksum verification.
+    """
+    fname = url.split("/")[-1]
+    local_path = Path(local_dir).joinpath(fname)
+
+    if cache and dl_cache_dir:
+        validators = _remote_validators(url, checksum)
+        if validators:
+            return fetch_cached(
+                cache_key(url, validators),
+                fname,
+                Path(local_dir),
+                lambda d: _download(
+                    url, d.joinpath(fname), connections, part_size, checksum
+                ),
+            )
+        logger.warning(f"Unable to determine version of {url}, bypassing cache")
+
+    _download(url, local_path, connections, part_size, checksum)
     return local_path
+
+
+def fetch_all(
+    urls: list[str], local_dir: str, concurrency: int = dl_concurrency, **kwargs
+) -> list[Path]:
+    """
+    Downloads several files concurrently.
+
+    Files are fetched over a shared thread pool, with at most `dl_host_concurrency` files in
+    flight per host. Requests to the same host share a pooled HTTP session or FTP control
+    connection and are rate limited per host, so a batch of small files doesn't pay for a
+    handshake or login per file.
+
+    Args:
+        urls (list[str]): The URLs of the files to download.
+        local_dir (Path): The directory where you would like the files saved.
+        concurrency (int): The maximum number of files downloaded at once across all hosts.
+        **kwargs: Passed through to `fetch_file`.
+
+    Returns:
+        list[Path]: The local paths to the files, in the same order as `urls`.
+    """
+
+    def fetch_one(url: str) -> Path:
+        with _host_slot(url.split("/")[2]):
+            return fetch_file(url, local_dir, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(fetch_one, urls))
+
+
+def _tar_member_selected(name: str, include: list[str]) -> bool:
+    # A member is selected if it or any of its parent directories matches a pattern
+    parts = PurePosixPath(name).parts
+    return any(
+        fnmatch("/".join(parts[: i + 1]), pat)
+        for pat in include
+        for i in range(len(parts))
+    )
+
+
+def extract_tar_stream(
+    fileobj, out_dir: Path, include: list[str] | None = None
+) -> Path:
+    """
+    Extract a gzipped tar archive from a non-seekable stream in a single pass.
+
+    Members are written out as they are read, so memory use is constant and the archive
+    itself never touches disk. Members not selected by `include` are skipped over, and
+    the "data" extraction filter rejects members that would land outside `out_dir`.
+
+    Args:
+        fileobj: A readable binary stream of a .tar.gz archive, e.g. a raw HTTP response.
+        out_dir (Path): The directory to extract into.
+        include (list[str], optional): Glob patterns of member paths to extract. A pattern
+            matching a directory selects everything beneath it. Defaults to all members.
+
+    Returns:
+        Path: The directory the archive was extracted into.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(fileobj=fileobj, mode="r|gz", bufsize=io_chunk_size) as tarf:
+        for member in tarf:
+            if include and not _tar_member_selected(member.name, include):
+                continue
+            logger.debug(f"Extracting {member.name}")
+            tarf.extract(member, out_dir, filter="data")
+    return out_dir
+
+
+def _read_name(header: bytes) -> bytes:
+    name = header.split()[0]
+    return name[:-2] if name.endswith((b"/1", b"/2")) else name
+
+
+def shard_paired_fastq(
+    r1: Path,
+    r2: Path,
+    out_dir: Path,
+    prefix: str,
+    n_shards: int,
+    batch_size: int = 100000,
+) -> list[tuple[Path, Path]]:
+    """
+    Split a pair of gzipped FASTQ files into `n_shards` pairs of smaller files.
+
+    Both files are streamed in lockstep and dealt out round-robin in batches of
+    `batch_size` records, so mates stay synchronized across every shard and shards are
+    balanced without first counting the reads. Shards are written with fast compression
+    since they are short-lived.
+
+    Args:
+        r1 (Path): The R1 FASTQ file.
+        r2 (Path): The R2 FASTQ file.
+        out_dir (Path): The directory to write shards into.
+        prefix (str): The file name prefix of each shard.
+        n_shards (int): The number of shards to produce.
+        batch_size (int): The number of read pairs dealt to a shard at a time.
+
+    Returns:
+        list[tuple[Path, Path]]: The R1 and R2 paths of each non-empty shard.
+
+    Raises:
+        ValueError: If the two files have different numbers of reads or mismatched read names.
+    """
+    paths = [
+        (
+            out_dir.joinpath(f"{prefix}{i}_1.fastq.gz"),
+            out_dir.joinpath(f"{prefix}{i}_2.fastq.gz"),
+        )
+        for i in range(n_shards)
+    ]
+    outs = [
+        (gzip.open(p1, "wb", compresslevel=1), gzip.open(p2, "wb", compresslevel=1))
+        for p1, p2 in paths
+    ]
+    written = [0] * n_shards
+    try:
+        with gzip.open(r1, "rb") as f1, gzip.open(r2, "rb") as f2:
+            shard = 0
+            while True:
+                b1 = list(itertools.islice(f1, 4 * batch_size))
+                b2 = list(itertools.islice(f2, 4 * batch_size))
+                if len(b1) != len(b2):
+                    raise ValueError(f"{r1} and {r2} have different numbers of reads")
+                if not b1:
+                    break
+                if _read_name(b1[0]) != _read_name(b2[0]) or _read_name(
+                    b1[-4]
+                ) != _read_name(b2[-4]):
+                    raise ValueError(
+                        f"Reads in {r1} and {r2} are not in the same order"
+                    )
+                outs[shard][0].write(b"".join(b1))
+                outs[shard][1].write(b"".join(b2))
+                written[shard] += len(b1) // 4
+                shard = (shard + 1) % n_shards
+    finally:
+        for o1, o2 in outs:
+            o1.close()
+            o2.close()
+
+    logger.info(f"Split {sum(written)} read pairs into shards of {written}")
+    for (p1, p2), n in zip(paths, written):
+        if not n:
+            p1.unlink()
+            p2.unlink()
+    return [p for p, n in zip(paths, written) if n]
+
+
+def _pct(num: int, den: int) -> str:
+    return f"{100 * num / den if den else 0:.2f}%"
+
+
+def merge_alignment_summaries(reports: list[str]) -> str:
+    """
+    Combine bowtie2/hisat2 alignment summaries from shards of one sample into the summary
+    a single run over the whole sample would have produced.
+
+    Counts are summed line by line. Each percentage is recomputed against the nearest
+    preceding line with less indentation, which holds the total it is reported against, and
+    the overall alignment rate is recomputed from the summed mate counts.
+
+    Args:
+        reports (list[str]): The summaries of each shard, all with the same layout.
+
+    Returns:
+        str: The combined summary.
+    """
+    shards = [r.rstrip("\n").split("\n") for r in reports]
+    merged = []
+    for shard_lines in zip(*shards):
+        text = shard_lines[0]
+        match = re.match(r"^(\s*)\d+ ", text)
+        if match:
+            count = sum(int(line.split()[0]) for line in shard_lines)
+            merged.append((len(match.group(1)), count, text))
+        else:
+            merged.append((None, None, text))
+
+    def count_of(suffix: str) -> int:
+        return sum(c for _, c, t in merged if c is not None and t.endswith(suffix))
+
+    mates = 2 * count_of("were paired; of these:") + count_of(
+        "were unpaired; of these:"
+    )
+    unaligned = count_of(") aligned 0 times")
+
+    out = []
+    for i, (indent, count, text) in enumerate(merged):
+        if count is not None:
+            text = re.sub(r"^(\s*)\d+", rf"\g<1>{count}", text)
+            if "%)" in text:
+                parent = next(
+                    c
+                    for ind, c, _ in reversed(merged[:i])
+                    if ind is not None and ind < indent
+                )
+                text = re.sub(r"\([\d.]+%\)", f"({_pct(count, parent)})", text)
+        elif text.endswith("overall alignment rate"):
+            text = f"{_pct(mates - unaligned, mates)} overall alignment rate"
+        out.append(text)
+    return "\n".join(out) + "\n"
+
+
+def sam_output_threads(fmt: str, cpus: int | None = None) -> int:
+    """
+    The threads `sam_output_args` gives samtools to compress `fmt` by default: none for
+    SAM and a quarter of the CPUs otherwise. Aligners piping into it should be given the
+    remaining CPUs, so the two together fit the task.
+    """
+    if fmt == "sam":
+        return 0
+    return max(1, (cpus or task_cpus()) // 4)
+
+
+def sam_output_args(
+    fmt: str, out: Path, ref: str | None = None, threads: int | None = None
+) -> list[str]:
+    """
+    Shell arguments that write the SAM an aligner prints to stdout as `fmt`. BAM and CRAM
+    are compressed by samtools as the aligner runs, so uncompressed SAM never touches disk.
+
+    Args:
+        fmt (str): The output format, one of "sam", "bam" or "cram".
+        out (Path): The path to write the alignment to.
+        ref (str, optional): The reference FASTA, required for CRAM.
+        threads (int, optional): Compression threads. Defaults to `sam_output_threads`,
+            leaving the rest of the task's CPUs to the aligner.
+
+    Returns:
+        list[str]: Arguments to append to the aligner's command.
+    """
+    if fmt == "sam":
+        return [">", str(out)]
+    threads = threads or sam_output_threads(fmt)
+    view = ["|", "samtools", "view", "-@", str(threads - 1), "-o", str(out)]
+    if fmt == "bam":
+        return view + ["-b", "-"]
+    if fmt == "cram":
+        if not ref:
+            raise ValueError("A reference is required to write CRAM")
+        return view + ["-C", "-T", str(ref), "-"]
+    raise ValueError(f"Unsupported alignment format {fmt}, expected sam, bam or cram")
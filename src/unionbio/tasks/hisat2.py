@@ -1,6 +1,5 @@
-import gzip
-import shutil
 from pathlib import Path
+from typing import Optional
 from flytekit import kwtypes, task, Resources, current_context, TaskMetadata
 from flytekit.extras.tasks.shell import OutputLocation, ShellTask, subproc_execute
 from flytekit.types.file import FlyteFile
@@ -9,6 +8,12 @@ from flytekit.types.directory import FlyteDirectory
 from unionbio.config import ref_hash, main_img_fqn, logger
 from unionbio.datatypes.alignment import Alignment
 from unionbio.datatypes.reads import Reads
+from unionbio.tasks.helpers import (
+    decompressed_fifos,
+    sam_output_args,
+    sam_output_threads,
+)
+from unionbio.tasks.resources import task_cpus, tool_threads
 
 """
 Generate Hisat2 index files from a reference genome.
@@ -40,53 +45,60 @@ hisat2_index = ShellTask(
     container_image=main_img_fqn,
     requests=Resources(cpu="4", mem="10Gi"),
 )
-def hisat2_align_paired_reads(idx: FlyteDirectory, fs: Reads) -> Alignment:
+def hisat2_align_paired_reads(
+    idx: FlyteDirectory, fs: Reads, fmt: str = "bam", ref: Optional[FlyteFile] = None
+) -> Alignment:
     """
     Perform paired-end alignment using Hisat 2 on a filtered sample.
 
     This function takes a FlyteDirectory object representing the Hisat 2 index and a
     Reads object containing filtered sample data. It performs paired-end alignment
     using Hisat 2 and returns a Alignment object representing the resulting alignment.
+    Output is streamed straight into the requested format.
 
     Args:
         idx (FlyteDirectory): A FlyteDirectory object representing the Hisat 2 index.
         fs (Reads): A Reads object containing filtered sample data to be aligned.
+        fmt (str): The alignment format to write, one of "sam", "bam" or "cram".
+        ref (FlyteFile, optional): The reference FASTA the index was built from, required
+            for CRAM.
 
     Returns:
         Alignment: An Alignment object representing the alignment result.
     """
     idx.download()
     ldir = Path(current_context().working_directory)
-    alignment = Alignment(fs.sample, "hisat2", "sam")
+    alignment = Alignment(fs.sample, "hisat2", fmt, lane=fs.lane)
     al = ldir.joinpath(alignment.get_alignment_fname())
     rep = ldir.joinpath(alignment.get_report_fname())
     logger.debug(f"Writing alignment to {al} and report to {rep}")
 
-    unc_r1 = ldir.joinpath(f"{fs.sample}_1.fq")
-    unc_r2 = ldir.joinpath(f"{fs.sample}_2.fq")
-
-    with gzip.open(fs.read1, "rb") as gz_file, open(unc_r1, "wb") as out_file:
-        shutil.copyfileobj(gz_file, out_file)
-    with gzip.open(fs.read2, "rb") as gz_file, open(unc_r2, "wb") as out_file:
-        shutil.copyfileobj(gz_file, out_file)
-    logger.debug(f"Uncompressed reads to {unc_r1} and {unc_r2}")
-
-    cmd = [
-        "hisat2",
-        "-x",
-        f"{idx.path}/hs2_idx",
-        "-1",
-        unc_r1,
-        "-2",
-        unc_r2,
-        "-S",
-        al,
-        "--summary-file",
-        rep,
-    ]
-    logger.debug(f"Running command: {cmd}")
+    # samtools compresses the output alongside, so hisat2 gets the remaining CPUs
+    aligner_threads = tool_threads(
+        "hisat2", cpus=max(1, task_cpus() - sam_output_threads(fmt))
+    )
+    # Reads are decompressed into named pipes as hisat2 consumes them, never to disk
+    with decompressed_fifos([fs.read1.download(), fs.read2.download()]) as (r1, r2):
+        cmd = " ".join(
+            [
+                "set -o pipefail;",
+                "hisat2",
+                "-p",
+                str(aligner_threads),
+                "-x",
+                f"{idx.path}/hs2_idx",
+                "-1",
+                str(r1),
+                "-2",
+                str(r2),
+                "--summary-file",
+                str(rep),
+            ]
+            + sam_output_args(fmt, al, ref.download() if ref else None)
+        )
+        logger.debug(f"Running command: {cmd}")
 
-    result = subproc_execute(cmd)
+        result = subproc_execute(cmd, shell=True, executable="/bin/bash")
     logger.info(
         f"Hisat exited with code {result.returncode}, output: {result.output}, error: {result.error}"
     )
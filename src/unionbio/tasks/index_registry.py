@@ -0,0 +1,177 @@
+import re
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from flytekit import task, Resources, current_context, FlyteContextManager
+from flytekit.extras.tasks.shell import subproc_execute
+from flytekit.types.file import FlyteFile
+from flytekit.types.directory import FlyteDirectory
+
+from unionbio.config import ref_hash, main_img_fqn, logger, index_registry
+from unionbio.tasks.helpers import file_digest
+from unionbio.tasks.resources import tool_threads
+
+# Written last, so a bundle is only visible once every index file has been uploaded
+COMPLETE_MARKER = "_complete.json"
+
+# Commands whose output includes each tool's version
+VERSION_CMDS = {
+    "bowtie2": ["bowtie2-build", "--version"],
+    "hisat2": ["hisat2-build", "--version"],
+    "bwa": ["bwa"],
+    "faidx": ["samtools", "--version"],
+    "dict": ["samtools", "--version"],
+}
+
+
+def tool_version(tool: str) -> str:
+    """
+    The version of the tool that builds `tool` indices, parsed from its version output.
+    """
+    if tool not in VERSION_CMDS:
+        raise ValueError(
+            f"No index builder for {tool}, expected one of {list(VERSION_CMDS)}"
+        )
+    # bwa prints its version in the usage text and exits non-zero
+    result = subproc_execute(VERSION_CMDS[tool], check=False)
+    text = f"{result.output}\n{result.error}"
+    # "bowtie2-build version 2.5.1", "Version: 0.7.17-r1188" or "samtools 1.19"
+    for pattern in (r"[Vv]ersion:?\s+(\d[\w.\-]*)", r"^\S+ (\d[\w.\-]*)"):
+        if match := re.search(pattern, text, re.M):
+            return match.group(1)
+    raise RuntimeError(f"Could not determine the version of the {tool} index builder")
+
+
+def index_key(ref_digest: str, ref_name: str, tool: str, version: str) -> str:
+    """
+    Registry key for an index bundle. It covers the reference's contents and file name,
+    which some tools bake into their index files, and the tool and its version.
+    """
+    payload = json.dumps(
+        {"sha256": ref_digest, "name": ref_name, "tool": tool, "version": version},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def build_index(ref_path: Path, tool: str, out_dir: Path):
+    """
+    Build a `tool` index bundle for a reference FASTA into `out_dir`.
+
+    Bundles contain:
+        - bowtie2: bt2_idx.* files
+        - hisat2: hs2_idx.* files
+        - bwa: the FASTA, its .fai and bwa index files
+        - faidx: the FASTA and its .fai
+        - dict: the FASTA's .dict
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    local_ref = out_dir.joinpath(ref_path.name)
+    if tool in ("bwa", "faidx"):
+        shutil.copyfile(ref_path, local_ref)
+
+    if tool == "bowtie2":
+        threads = str(tool_threads("bowtie2"))
+        cmds = [
+            [
+                "bowtie2-build",
+                "--threads",
+                threads,
+                ref_path,
+                out_dir.joinpath("bt2_idx"),
+            ]
+        ]
+    elif tool == "hisat2":
+        threads = str(tool_threads("hisat2"))
+        cmds = [["hisat2-build", "-p", threads, ref_path, out_dir.joinpath("hs2_idx")]]
+    elif tool == "bwa":
+        cmds = [["samtools", "faidx", local_ref], ["bwa", "index", local_ref]]
+    elif tool == "faidx":
+        cmds = [["samtools", "faidx", local_ref]]
+    elif tool == "dict":
+        cmds = [
+            [
+                "samtools",
+                "dict",
+                "-o",
+                out_dir.joinpath(f"{ref_path.stem}.dict"),
+                ref_path,
+            ]
+        ]
+    else:
+        raise ValueError(
+            f"No index builder for {tool}, expected one of {list(VERSION_CMDS)}"
+        )
+
+    for cmd in cmds:
+        cmd = [str(c) for c in cmd]
+        logger.debug(f"Running command: {cmd}")
+        subproc_execute(cmd)
+
+
+def lookup_or_build(ref_path: Path, tool: str, registry: str = index_registry) -> str:
+    """
+    Return the registry location of the `tool` index bundle for a reference, building and
+    registering it first if it isn't there yet.
+
+    Args:
+        ref_path (Path): The local reference FASTA.
+        tool (str): One of "bowtie2", "hisat2", "bwa", "faidx" or "dict".
+        registry (str): The root of the registry, locally or in blob storage.
+
+    Returns:
+        str: The location of the bundle's directory.
+    """
+    file_access = FlyteContextManager.current_context().file_access
+    version = tool_version(tool)
+    key = index_key(file_digest(ref_path), ref_path.name, tool, version)
+    loc = f"{registry.rstrip('/')}/{tool}/{key}"
+    if file_access.exists(f"{loc}/{COMPLETE_MARKER}"):
+        logger.info(
+            f"Index registry hit for {tool} {version} index of {ref_path.name}: {loc}"
+        )
+        return loc
+
+    logger.info(
+        f"Index registry miss for {tool} {version} index of {ref_path.name}, building"
+    )
+    out_dir = Path(current_context().working_directory).joinpath(f"{tool}_{key}")
+    build_index(ref_path, tool, out_dir)
+    file_access.put_data(str(out_dir), loc, is_multipart=True)
+
+    marker = out_dir.with_name(COMPLETE_MARKER)
+    marker.write_text(
+        json.dumps({"tool": tool, "version": version, "ref": ref_path.name})
+    )
+    file_access.put_data(str(marker), f"{loc}/{COMPLETE_MARKER}")
+    logger.info(f"Registered {tool} {version} index of {ref_path.name} at {loc}")
+    return loc
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu="4", mem="10Gi"),
+    cache=True,
+    cache_version=ref_hash,
+)
+def registered_index(
+    ref: FlyteFile, tool: str, registry: str = index_registry
+) -> FlyteDirectory:
+    """
+    Fetch the index of a reference from the index registry, building it on a miss.
+
+    Indices are keyed by a digest of the reference's contents along with the tool and its
+    version, so a reference is only ever indexed once per tool version regardless of where
+    it is stored or how often workflows are registered.
+
+    Args:
+        ref (FlyteFile): The reference FASTA.
+        tool (str): One of "bowtie2", "hisat2", "bwa", "faidx" or "dict".
+        registry (str): The root of the registry, locally or in blob storage.
+
+    Returns:
+        FlyteDirectory: The index bundle, laid out as `build_index` describes.
+    """
+    loc = lookup_or_build(Path(ref.download()), tool, registry)
+    return FlyteDirectory(path=loc)
@@ -0,0 +1,231 @@
+import re
+import heapq
+from pathlib import Path
+from typing import NamedTuple
+
+from unionbio.config import logger
+from unionbio.tasks.fasta import FastaReader
+
+# Bases of a contig held in memory at once while scanning a FASTA
+FASTA_SCAN_WINDOW = 1 << 20
+
+
+def read_contig_lengths(path: Path) -> dict[str, int]:
+    """
+    Read contig names and lengths, in reference order, from a FASTA index (.fai) or a
+    sequence dictionary (.dict).
+
+    Args:
+        path (Path): The .fai or .dict file.
+
+    Returns:
+        dict[str, int]: Contig lengths keyed by contig name.
+    """
+    lengths = {}
+    with open(path) as f:
+        for line in f:
+            if Path(path).suffix == ".dict":
+                if not line.startswith("@SQ"):
+                    continue
+                tags = dict(t.split(":", 1) for t in line.rstrip("\n").split("\t")[1:])
+                lengths[tags["SN"]] = int(tags["LN"])
+            elif line.strip():
+                name, length = line.split("\t")[:2]
+                lengths[name] = int(length)
+    return lengths
+
+
+def sequence_dict(ref_path: Path) -> Path:
+    """
+    The sequence dictionary of a reference FASTA, e.g. ref.dict for ref.fa or ref.fa.gz.
+    """
+    ref_path = Path(ref_path)
+    return ref_path.with_name(f"{Path(ref_path.name.removesuffix('.gz')).stem}.dict")
+
+
+def reference_lengths(ref_path: Path) -> dict[str, int]:
+    """
+    Read contig lengths for a reference FASTA from its .fai, or its .dict if it has no .fai.
+    """
+    fai = ref_path.with_name(f"{ref_path.name}.fai")
+    return read_contig_lengths(fai if fai.exists() else sequence_dict(ref_path))
+
+
+class Interval(NamedTuple):
+    """
+    A genomic interval in 0-based, half-open coordinates, as in BED.
+    """
+
+    contig: str
+    start: int
+    end: int
+
+    def __len__(self):
+        return self.end - self.start
+
+    def to_region(self) -> str:
+        """
+        The interval as a 1-based, inclusive region string, e.g. "chr1:1-1000".
+        """
+        return f"{self.contig}:{self.start + 1}-{self.end}"
+
+
+def find_n_gaps(fasta: Path, min_gap: int = 1000) -> list[Interval]:
+    """
+    Find runs of N bases in an indexed FASTA, plain or bgzipped, reading each contig in
+    windows of FASTA_SCAN_WINDOW bases so memory use doesn't grow with contig length.
+
+    Args:
+        fasta (Path): The FASTA file, with its .fai (and .gzi if bgzipped) alongside.
+        min_gap (int): The shortest run of Ns to report.
+
+    Returns:
+        list[Interval]: The gaps, in reference order.
+    """
+    reader = FastaReader(Path(fasta))
+    gaps = []
+    pattern = re.compile(r"[Nn]+")
+    try:
+        for name, length in reader.contigs().items():
+            run = None
+            for start in range(0, length, FASTA_SCAN_WINDOW):
+                seq = reader.fetch(name, start, start + FASTA_SCAN_WINDOW)
+                for m in pattern.finditer(seq):
+                    gap = Interval(name, start + m.start(), start + m.end())
+                    # Join runs that continue across a window boundary
+                    if run and run.end == gap.start:
+                        run = Interval(name, run.start, gap.end)
+                        continue
+                    if run and len(run) >= min_gap:
+                        gaps.append(run)
+                    run = gap
+            if run and len(run) >= min_gap:
+                gaps.append(run)
+    finally:
+        reader.close()
+    logger.debug(f"Found {len(gaps)} N-gaps of at least {min_gap} bases in {fasta}")
+    return gaps
+
+
+def subtract(
+    lengths: dict[str, int], gaps: list[Interval] | None = None
+) -> list[Interval]:
+    """
+    The regions of each contig not covered by `gaps`, in reference order.
+    """
+    by_contig = {}
+    for gap in sorted(gaps or []):
+        by_contig.setdefault(gap.contig, []).append(gap)
+
+    regions = []
+    for name, length in lengths.items():
+        pos = 0
+        for gap in by_contig.get(name, []):
+            if gap.start > pos:
+                regions.append(Interval(name, pos, gap.start))
+            pos = max(pos, gap.end)
+        if pos < length:
+            regions.append(Interval(name, pos, length))
+    return regions
+
+
+def plan_intervals(
+    lengths: dict[str, int],
+    n: int,
+    gaps: list[Interval] | None = None,
+    split_contigs: bool = True,
+) -> list[list[Interval]]:
+    """
+    Split a genome into `n` shards of near equal size. Regions are taken in reference
+    order and cut wherever a shard reaches its share of the genome, so each shard is a run
+    of consecutive, non-overlapping intervals that never cross a contig boundary.
+
+    With `split_contigs` unset, contigs are kept whole instead, as in GATK's best practices
+    pipeline, and assigned longest first to the lightest of at most `n` shards. Contigs
+    keep reference order within each shard, and shards are ordered by their first contig.
+
+    Args:
+        lengths (dict[str, int]): Contig lengths keyed by contig name, in reference order.
+        n (int): The number of shards.
+        gaps (list[Interval], optional): Regions to leave out of every shard, such as
+            N-gaps from `find_n_gaps`.
+        split_contigs (bool): Whether shards may divide a contig.
+
+    Returns:
+        list[list[Interval]]: The intervals of each shard.
+    """
+    regions = subtract(lengths, gaps)
+    if not split_contigs:
+        return _balance_regions(regions, n)
+    total = sum(len(r) for r in regions)
+    shards = [[] for _ in range(min(n, total))]
+    filled = 0
+    for region in regions:
+        start = region.start
+        while start < region.end:
+            # The shard this base falls in, and where that shard ends
+            idx = filled * len(shards) // total
+            bound = -(-(idx + 1) * total // len(shards))
+            end = min(region.end, start + bound - filled)
+            shards[idx].append(Interval(region.contig, start, end))
+            filled += end - start
+            start = end
+    logger.debug(f"Planned {len(shards)} shards over {total} bases")
+    return shards
+
+
+def _balance_regions(regions: list[Interval], n: int) -> list[list[Interval]]:
+    by_contig = {}
+    for region in regions:
+        by_contig.setdefault(region.contig, []).append(region)
+
+    heap = [(0, i, []) for i in range(min(n, len(by_contig)))]
+    sizes = {c: sum(len(r) for r in rs) for c, rs in by_contig.items()}
+    for name, size in sorted(sizes.items(), key=lambda c: -c[1]):
+        total, i, group = heapq.heappop(heap)
+        group.append(name)
+        heapq.heappush(heap, (total + size, i, group))
+
+    order = {name: i for i, name in enumerate(by_contig)}
+    groups = [sorted(g, key=order.get) for _, _, g in heap]
+    groups.sort(key=lambda g: order[g[0]])
+    logger.debug(f"Balanced {len(by_contig)} contigs into {len(groups)} groups")
+    return [[r for name in g for r in by_contig[name]] for g in groups]
+
+
+def balance_contigs(lengths: dict[str, int], n: int) -> list[list[str]]:
+    """
+    Group whole contigs into at most `n` groups of roughly equal total length, as
+    `plan_intervals` does with `split_contigs=False`.
+
+    Args:
+        lengths (dict[str, int]): Contig lengths keyed by contig name.
+        n (int): The number of groups to aim for.
+
+    Returns:
+        list[list[str]]: Contig names in each group.
+    """
+    shards = plan_intervals(lengths, n, split_contigs=False)
+    return [[i.contig for i in shard] for shard in shards]
+
+
+def write_bed(intervals: list[Interval], path: Path) -> Path:
+    """
+    Write intervals to a BED file.
+    """
+    with open(path, "w") as f:
+        f.writelines(f"{i.contig}\t{i.start}\t{i.end}\n" for i in intervals)
+    return Path(path)
+
+
+def write_interval_list(intervals: list[Interval], seq_dict: Path, path: Path) -> Path:
+    """
+    Write intervals to a Picard interval_list, using the header of the reference's
+    sequence dictionary.
+    """
+    with open(seq_dict) as f:
+        header = [line for line in f if line.startswith("@")]
+    with open(path, "w") as f:
+        f.writelines(header)
+        f.writelines(f"{i.contig}\t{i.start + 1}\t{i.end}\t+\t.\n" for i in intervals)
+    return Path(path)
@@ -1,11 +1,26 @@
-from typing import List
+from dataclasses import replace
+from pathlib import Path
+from typing import List, Optional
 
-from flytekit import TaskMetadata, dynamic, kwtypes
-from flytekit.extras.tasks.shell import OutputLocation, ShellTask
+from flytekit import (
+    TaskMetadata,
+    dynamic,
+    kwtypes,
+    task,
+    Resources,
+    current_context,
+)
+from flytekit.extras.tasks.shell import OutputLocation, ShellTask, subproc_execute
 from flytekit.types.file import FlyteFile
 
 from unionbio.datatypes.alignment import Alignment
-from unionbio.config import main_img_fqn
+from unionbio.config import main_img_fqn, logger, dedup_cpu
+from unionbio.tasks.resources import (
+    task_cpus,
+    tool_threads,
+    samtools_sort_mem,
+    PIPED_SORT_MEM_FRACTION,
+)
 
 """
 Identify and remove duplicates from an alignment file using GATK's MarkDuplicates tool.
@@ -29,7 +44,9 @@ mark_dups = ShellTask(
     script="""
     mkdir /tmp/dedup
     "gatk" \
+    --java-options "$(python -m unionbio.tasks.resources java-opts)" \
     "MarkDuplicates" \
+    --MAX_RECORDS_IN_RAM $(python -m unionbio.tasks.resources max-records) \
     -I {inputs.al} \
     -O {outputs.dal} \
     -M {outputs.m} \
@@ -47,13 +64,96 @@ mark_dups = ShellTask(
 )
 
 
-@dynamic
-def mark_dups_samples(sams: List[Alignment]) -> List[Alignment]:
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu=dedup_cpu, mem="16Gi"),
+)
+def mark_dups_alignment(al: Alignment, ref: Optional[FlyteFile] = None) -> Alignment:
+    """
+    Mark duplicate reads in an alignment with samtools markdup.
+
+    Reads are grouped by name with samtools collate, given mate scores by fixmate, coordinate
+    sorted and then marked, all streamed between multi-threaded samtools processes without
+    intermediate files. @PG records and the command line are left out of the outputs so that
+    they only depend on the input.
+
+    Args:
+        al (Alignment): The alignment to deduplicate, in any sort order.
+        ref (FlyteFile, optional): The reference FASTA, required for CRAM.
+
+    Returns:
+        Alignment: The sorted, duplicate-marked alignment with its index and metrics.
+    """
+    ldir = Path(current_context().working_directory)
+    fmt = al.format if al.format == "cram" else "bam"
+    deduped = replace(al, format=fmt, sorted=True, deduped=True)
+    out = ldir.joinpath(deduped.get_alignment_fname())
+    out_idx = ldir.joinpath(deduped.get_alignment_idx_fname())
+    metrics = ldir.joinpath(deduped.get_metrics_fname())
+    tmp = ldir.joinpath(f"{al.sample}_dedup_tmp")
+
+    # collate and fixmate do little per read, so they get a CPU each and the rest go to
+    # sort, then to markdup, which mostly runs once sort has consumed its input
+    light = str(tool_threads("samtools", cpus=1))
+    heavy = tool_threads("samtools", cpus=max(1, task_cpus() - 2))
+    ref_args = ["--reference", ref.download()] if ref else []
+    stages = [
+        ["samtools", "collate", "-@", light, "-O", "-u", "--no-PG"]
+        + ref_args
+        + [al.alignment.download(), f"{tmp}_collate"],
+        ["samtools", "fixmate", "-@", light, "-m", "-u", "--no-PG", "-", "-"],
+        [
+            "samtools",
+            "sort",
+            "-@",
+            str(heavy),
+            "-m",
+            samtools_sort_mem(heavy, fraction=PIPED_SORT_MEM_FRACTION),
+            "-T",
+            f"{tmp}_sort",
+            "-u",
+            "--no-PG",
+            "-",
+        ],
+        ["samtools", "markdup", "-@", str(heavy), "-f", str(metrics), "--no-PG"]
+        + ["-O", fmt.upper(), "--write-index"]
+        + ref_args
+        + ["-", f"{out}##idx##{out_idx}"],
+    ]
+    cmd = " ".join(["set -o pipefail;"] + stages[0])
+    for stage in stages[1:]:
+        cmd += " | " + " ".join(stage)
+    logger.debug(f"Running command: {cmd}")
+    subproc_execute(cmd, shell=True, executable="/bin/bash")
+
+    # Drop the command line markdup records, which embeds task-specific paths
+    lines = metrics.read_text().splitlines(keepends=True)
+    metrics.write_text(
+        "".join(line for line in lines if not line.startswith("COMMAND:"))
+    )
+
+    setattr(deduped, "alignment", FlyteFile(path=str(out)))
+    setattr(deduped, "alignment_idx", FlyteFile(path=str(out_idx)))
+    setattr(deduped, "dedup_metrics", FlyteFile(path=str(metrics)))
+
+    return deduped
+
+
+@dynamic(container_image=main_img_fqn)
+def mark_dups_samples(
+    sams: List[Alignment], ref: Optional[FlyteFile] = None
+) -> List[Alignment]:
+    """
+    Mark duplicates in a list of alignments in parallel, one task per alignment.
+
+    Args:
+        sams (List[Alignment]): The alignments to deduplicate.
+        ref (FlyteFile, optional): The reference FASTA, required for CRAM.
+
+    Returns:
+        List[Alignment]: The deduplicated alignments with their metrics.
+    """
     deduped = []
     for i in sams:
-        i.deduped = True
-        deduped.append(
-            mark_dups(
-                oafn=i.get_alignment_fname(), omfn=i.get_metrics_fname(), al=i.sam
-            )
-        )
+        deduped.append(mark_dups_alignment(al=i, ref=ref))
+    return deduped
@@ -10,9 +10,18 @@ from unionbio.datatypes.reference import Reference
 from unionbio.datatypes.reads import Reads
 from unionbio.datatypes.variants import VCF
 from unionbio.config import parabricks_img_fqn
-
-
-@task(requests=Resources(gpu="1", mem="32Gi", cpu="32"), container_image=parabricks_img_fqn)
+from unionbio.tasks.resources import (
+    tool_threads,
+    java_opts,
+    max_records_in_ram,
+    SHARED_JAVA_HEAP_FRACTION,
+)
+
+
+@task(
+    requests=Resources(gpu="1", mem="32Gi", cpu="32"),
+    container_image=parabricks_img_fqn,
+)
 def pb_fq2bam(reads: Reads, sites: VCF, ref: Reference) -> Alignment:
     """
     Takes an input directory containing paired-end FASTQ files and an indexed reference genome and
@@ -31,9 +40,11 @@ def pb_fq2bam(reads: Reads, sites: VCF, ref: Reference) -> Alignment:
     reads.read2.download()
     sites.vcf.download()
     sites.vcf_idx.download()
-    ref.ref_dir.download()
+    ref.download("parabricks")
 
-    al_out = Alignment(sample=reads.sample, aligner="pbrun_fq2bam")
+    al_out = Alignment(
+        sample=reads.sample, aligner="pbrun_fq2bam", format="bam", lane=reads.lane
+    )
 
     bam_out = al_out.get_alignment_fname()
     bam_idx_out = al_out.get_alignment_idx_fname()
@@ -65,7 +76,10 @@ def pb_fq2bam(reads: Reads, sites: VCF, ref: Reference) -> Alignment:
     return FlyteFile(path=bam_out), FlyteFile(path=recal_out)
 
 
-@task(requests=Resources(gpu="1", mem="32Gi", cpu="32"), container_image=parabricks_img_fqn)
+@task(
+    requests=Resources(gpu="1", mem="32Gi", cpu="32"),
+    container_image=parabricks_img_fqn,
+)
 def basic_align(indir: FlyteDirectory) -> Tuple[FlyteFile, str]:
     """
     Aligns paired-end sequencing reads using BWA-MEM and GATK tools, and returns the path to the processed BAM file
@@ -90,7 +104,7 @@ def basic_align(indir: FlyteDirectory) -> Tuple[FlyteFile, str]:
             "bwa",
             "mem",
             "-t",
-            "32",
+            str(tool_threads("bwa")),
             "-K",
             "10000000",
             "-R",
@@ -100,11 +114,12 @@ def basic_align(indir: FlyteDirectory) -> Tuple[FlyteFile, str]:
             str(r2),
             "|",
             "java",
+            java_opts(SHARED_JAVA_HEAP_FRACTION),
             "-jar",
             "/usr/local/bin/gatk",
             "SortSam",
             "--MAX_RECORDS_IN_RAM",
-            "5000000",
+            str(max_records_in_ram(SHARED_JAVA_HEAP_FRACTION)),
             "-I",
             "/dev/stdin",
             "-O",
@@ -120,9 +135,12 @@ def basic_align(indir: FlyteDirectory) -> Tuple[FlyteFile, str]:
     out2, err2 = subproc_execute(
         [
             "java",
+            java_opts(),
             "-jar",
             "/usr/local/bin/gatk",
             "MarkDuplicates",
+            "--MAX_RECORDS_IN_RAM",
+            str(max_records_in_ram()),
             "-I",
             bampath,
             "-O",
@@ -136,6 +154,7 @@ def basic_align(indir: FlyteDirectory) -> Tuple[FlyteFile, str]:
     out3, err3 = subproc_execute(
         [
             "java",
+            java_opts(),
             "-jar",
             "/usr/local/bin/gatk",
             "BaseRecalibrator",
@@ -153,7 +172,10 @@ def basic_align(indir: FlyteDirectory) -> Tuple[FlyteFile, str]:
     return FlyteFile(path=dup_bam)
 
 
-@task(requests=Resources(gpu="1", mem="32Gi", cpu="32"), container_image=parabricks_img_fqn)
+@task(
+    requests=Resources(gpu="1", mem="32Gi", cpu="32"),
+    container_image=parabricks_img_fqn,
+)
 def pb_deepvar(al: Alignment, ref: Reference) -> VCF:
     """
     Takes an input directory containing BAM files and an indexed reference genome and
@@ -164,7 +186,7 @@ def pb_deepvar(al: Alignment, ref: Reference) -> VCF:
     Returns:
 
     """
-    ref.ref_dir.download()
+    ref.download("gatk")
     al.alignment.download()
     al.alignment_idx.download()
 
@@ -192,7 +214,10 @@ def pb_deepvar(al: Alignment, ref: Reference) -> VCF:
     return deepvar_dir
 
 
-@task(requests=Resources(gpu="1", mem="32Gi", cpu="32"), container_image=parabricks_img_fqn)
+@task(
+    requests=Resources(gpu="1", mem="32Gi", cpu="32"),
+    container_image=parabricks_img_fqn,
+)
 def pb_haplocall(al: Alignment, ref: Reference) -> VCF:
     """
     Takes an input directory containing BAM files and an indexed reference genome and
@@ -203,7 +228,7 @@ def pb_haplocall(al: Alignment, ref: Reference) -> VCF:
     Returns:
 
     """
-    ref.ref_dir.download()
+    ref.download("gatk")
     al.alignment.download()
     al.alignment_idx.download()
     al.bqsr_report.download()
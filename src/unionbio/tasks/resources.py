@@ -0,0 +1,164 @@
+import os
+import sys
+import math
+from pathlib import Path
+
+from unionbio.config import logger
+
+CGROUP_RT = Path("/sys/fs/cgroup")
+
+# Tools whose thread flag counts threads in addition to the main thread
+ADDITIONAL_THREAD_TOOLS = {"samtools"}
+# Tools that don't scale past a fixed number of worker threads
+TOOL_MAX_THREADS = {"fastp": 16}
+
+# Share of the memory limit given to the JVM heap, leaving room for off-heap and native use
+JAVA_HEAP_FRACTION = 0.8
+# Heap share for a JVM piped to or from another memory-hungry tool in the same task
+SHARED_JAVA_HEAP_FRACTION = 0.4
+# Picard's guidance for how many records fit in a GiB of heap
+RECORDS_PER_HEAP_GIB = 250000
+# Share of the memory limit samtools sort may use for its in-memory buffers
+SORT_MEM_FRACTION = 0.75
+# Sort memory share when other memory-hungry samtools stages run in the same pipeline
+PIPED_SORT_MEM_FRACTION = 0.5
+
+
+def _read(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def task_cpus() -> int:
+    """
+    The number of CPUs this task can actually use, taken from the cgroup CPU quota (v2 or v1)
+    and the CPU affinity mask, whichever is smaller.
+    """
+    cpus = len(os.sched_getaffinity(0))
+    quota, period = None, None
+    if cpu_max := _read(CGROUP_RT.joinpath("cpu.max")):
+        q, p = cpu_max.split()
+        quota, period = (None if q == "max" else int(q)), int(p)
+    elif cfs_quota := _read(CGROUP_RT.joinpath("cpu", "cpu.cfs_quota_us")):
+        quota = int(cfs_quota) if int(cfs_quota) > 0 else None
+        period = int(_read(CGROUP_RT.joinpath("cpu", "cpu.cfs_period_us")))
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota / period)))
+    return cpus
+
+
+def task_mem() -> int:
+    """
+    The memory in bytes available to this task, taken from the cgroup memory limit (v2 or
+    v1) and falling back to the physical memory of the node when unlimited.
+    """
+    phys = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    limit = _read(CGROUP_RT.joinpath("memory.max")) or _read(
+        CGROUP_RT.joinpath("memory", "memory.limit_in_bytes")
+    )
+    if limit and limit != "max":
+        return min(phys, int(limit))
+    return phys
+
+
+def report_subscription(tool: str, threads: int, cpus: int | None = None):
+    """
+    Log a warning when a tool is set to run more threads than the task has CPUs, or fewer
+    than it could use.
+    """
+    cpus = cpus or task_cpus()
+    if tool in ADDITIONAL_THREAD_TOOLS:
+        threads += 1
+    cap = TOOL_MAX_THREADS.get(tool, cpus)
+    if threads > cpus:
+        logger.warning(f"{tool} is oversubscribed: {threads} threads on {cpus} CPUs")
+    elif threads < min(cpus, cap):
+        logger.warning(f"{tool} is undersubscribed: {threads} threads on {cpus} CPUs")
+    else:
+        logger.debug(f"{tool} running {threads} threads on {cpus} CPUs")
+
+
+def tool_threads(tool: str, cpus: int | None = None) -> int:
+    """
+    The value to pass to a tool's thread flag (e.g. fastp --thread, bowtie2 -p, bwa mem -t,
+    samtools -@) to make full use of the task's CPUs.
+
+    Args:
+        tool (str): The name of the tool.
+        cpus (int, optional): The number of CPUs to size for. Defaults to `task_cpus()`.
+
+    Returns:
+        int: The thread count for the tool.
+    """
+    cpus = cpus or task_cpus()
+    threads = min(cpus, TOOL_MAX_THREADS.get(tool, cpus))
+    if tool in ADDITIONAL_THREAD_TOOLS:
+        threads -= 1
+    report_subscription(tool, threads, cpus)
+    return threads
+
+
+def parse_mem(mem: str) -> int:
+    """
+    Convert a memory quantity in Kubernetes notation (e.g. "512Mi", "8Gi", "2G") to bytes.
+    """
+    units = {"": 1, "K": 10**3, "M": 10**6, "G": 10**9, "T": 10**12}
+    units.update({f"{u}i": 1024 ** (i + 1) for i, u in enumerate("KMGT")})
+    num = mem.rstrip("KMGTi")
+    try:
+        return int(float(num) * units[mem[len(num) :]])
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid memory quantity {mem}")
+
+
+def samtools_sort_mem(
+    threads: int | None = None,
+    budget: int | None = None,
+    fraction: float = SORT_MEM_FRACTION,
+) -> str:
+    """
+    The per-thread memory for samtools sort's -m flag, splitting a memory budget across
+    the sort threads. The budget defaults to a `fraction` of the task's memory.
+    """
+    threads = threads if threads is not None else tool_threads("samtools")
+    budget = budget or task_mem() * fraction
+    return f"{max(1, int(budget / (threads + 1)) // 2**20)}M"
+
+
+def java_heap_mb(fraction: float = JAVA_HEAP_FRACTION) -> int:
+    return int(task_mem() * fraction) // 2**20
+
+
+def java_opts(fraction: float = JAVA_HEAP_FRACTION) -> str:
+    """
+    JVM options sizing the heap to a share of the task's memory limit. Pass a smaller
+    `fraction`, e.g. SHARED_JAVA_HEAP_FRACTION, when the JVM shares the task with
+    another process.
+    """
+    return f"-Xmx{java_heap_mb(fraction)}m"
+
+
+def max_records_in_ram(fraction: float = JAVA_HEAP_FRACTION) -> int:
+    """
+    The value for Picard/GATK's --MAX_RECORDS_IN_RAM that fits the heap from `java_opts`
+    called with the same `fraction`.
+    """
+    heap_mb = java_heap_mb(fraction)
+    return max(RECORDS_PER_HEAP_GIB // 2, heap_mb * RECORDS_PER_HEAP_GIB // 1024)
+
+
+if __name__ == "__main__":
+    # Expose the sizing to ShellTask scripts, e.g. $(python -m unionbio.tasks.resources java-opts)
+    cmd, *args = sys.argv[1:]
+    if cmd == "threads":
+        print(tool_threads(args[0]))
+    elif cmd == "java-opts":
+        print(java_opts())
+    elif cmd == "max-records":
+        print(max_records_in_ram())
+    elif cmd == "sort-mem":
+        print(samtools_sort_mem())
+    else:
+        sys.exit(f"Unknown command {cmd}")
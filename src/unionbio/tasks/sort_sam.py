@@ -1,11 +1,21 @@
-from typing import List
+from dataclasses import replace
+from pathlib import Path
+from typing import List, Optional
 
-from flytekit import TaskMetadata, dynamic, kwtypes
-from flytekit.extras.tasks.shell import OutputLocation, ShellTask
+from flytekit import (
+    TaskMetadata,
+    dynamic,
+    kwtypes,
+    task,
+    Resources,
+    current_context,
+)
+from flytekit.extras.tasks.shell import OutputLocation, ShellTask, subproc_execute
 from flytekit.types.file import FlyteFile
 
 from unionbio.datatypes.alignment import Alignment
-from unionbio.config import main_img_fqn
+from unionbio.config import main_img_fqn, logger, sort_cpu
+from unionbio.tasks.resources import tool_threads, samtools_sort_mem, parse_mem
 
 """
 Sort SAM file based on coordinate.
@@ -24,7 +34,9 @@ sort_sam = ShellTask(
     script="""
     mkdir /tmp/sort_sam
     "gatk" \
+    --java-options "$(python -m unionbio.tasks.resources java-opts)" \
     "SortSam" \
+    --MAX_RECORDS_IN_RAM $(python -m unionbio.tasks.resources max-records) \
     -I {inputs.sam} \
     -O {outputs.o} \
     --SORT_ORDER coordinate \
@@ -39,10 +51,91 @@ sort_sam = ShellTask(
 )
 
 
-@dynamic
-def sort_samples(sams: List[Alignment]) -> List[Alignment]:
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu=sort_cpu, mem="16Gi"),
+)
+def sort_alignment(
+    al: Alignment,
+    mem_budget: Optional[str] = None,
+    spill_dir: Optional[str] = None,
+    ref: Optional[FlyteFile] = None,
+) -> Alignment:
+    """
+    Coordinate sort an alignment into an indexed BAM with samtools sort.
+
+    samtools sort is an external merge sort: reads are sorted in memory-bounded batches
+    across all of the task's cores, spilled to temporary files and merged. The index is
+    written during the merge rather than in a separate pass.
+
+    Args:
+        al (Alignment): The alignment to sort, in SAM, BAM or CRAM format.
+        mem_budget (str, optional): Total memory for sort buffers across all threads, e.g.
+            "8Gi". Defaults to most of the task's memory.
+        spill_dir (str, optional): Directory for temporary sort files. Defaults to the
+            task's working directory.
+        ref (FlyteFile, optional): The reference FASTA, required to read CRAM.
+
+    Returns:
+        Alignment: The sorted alignment in BAM format, with its index.
+    """
+    ldir = Path(current_context().working_directory)
+    sorted_al = replace(al, format="bam", sorted=True)
+    out = ldir.joinpath(sorted_al.get_alignment_fname())
+    out_idx = ldir.joinpath(sorted_al.get_alignment_idx_fname())
+    spill = Path(spill_dir or ldir).joinpath(f"{al.sample}_sort_tmp")
+
+    threads = tool_threads("samtools")
+    budget = parse_mem(mem_budget) if mem_budget else None
+    cmd = [
+        "samtools",
+        "sort",
+        "-@",
+        str(threads),
+        "-m",
+        samtools_sort_mem(threads, budget),
+        "-T",
+        str(spill),
+        "-O",
+        "BAM",
+        "--write-index",
+        "-o",
+        f"{out}##idx##{out_idx}",
+    ]
+    if ref:
+        cmd += ["--reference", ref.download()]
+    cmd.append(al.alignment.download())
+    logger.debug(f"Running command: {cmd}")
+    subproc_execute(cmd)
+
+    setattr(sorted_al, "alignment", FlyteFile(path=str(out)))
+    setattr(sorted_al, "alignment_idx", FlyteFile(path=str(out_idx)))
+
+    return sorted_al
+
+
+@dynamic(container_image=main_img_fqn)
+def sort_samples(
+    sams: List[Alignment],
+    mem_budget: Optional[str] = None,
+    spill_dir: Optional[str] = None,
+    ref: Optional[FlyteFile] = None,
+) -> List[Alignment]:
+    """
+    Coordinate sort a list of alignments in parallel, one task per alignment.
+
+    Args:
+        sams (List[Alignment]): The alignments to sort.
+        mem_budget (str, optional): Total memory for sort buffers in each task, e.g. "8Gi".
+        spill_dir (str, optional): Directory for temporary sort files.
+        ref (FlyteFile, optional): The reference FASTA, required to read CRAM.
+
+    Returns:
+        List[Alignment]: The sorted, indexed alignments in BAM format.
+    """
     sorted = []
     for i in sams:
-        i.sorted = True
-        fname, rep = i.make_filenames()
-        sorted.append(sort_sam(out_fname=fname, sam=i.sam))
+        sorted.append(
+            sort_alignment(al=i, mem_budget=mem_budget, spill_dir=spill_dir, ref=ref)
+        )
+    return sorted
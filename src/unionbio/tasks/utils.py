@@ -1,19 +1,38 @@
 import os
+import re
 import zipfile
 import requests
-import tarfile
-from pathlib import Path
-from typing import List
-from flytekit import task, current_context
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, NamedTuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from flytekit import task, current_context, Resources, FlyteContextManager
 from flytekit.types.directory import FlyteDirectory
 from flytekit.types.file import FlyteFile
 from flytekit.extras.tasks.shell import subproc_execute
 
-from unionbio.config import main_img_fqn, logger, parabricks_img_fqn
+from unionbio.config import main_img_fqn, logger, parabricks_img_fqn, dl_concurrency
 from unionbio.datatypes.reads import Reads
 from unionbio.datatypes.reference import Reference
 from unionbio.datatypes.variants import VCF
-from unionbio.tasks.helpers import fetch_file
+from unionbio.tasks.helpers import fetch_file, fetch_all, extract_tar_stream
+from unionbio.tasks.resources import tool_threads
+from unionbio.tasks.intervals import (
+    reference_lengths,
+    find_n_gaps,
+    plan_intervals,
+    sequence_dict,
+    write_bed,
+    write_interval_list,
+)
+
+QCResults = NamedTuple(
+    "QCResults",
+    [
+        ("passed", List[Reads]),
+        ("quarantined", List[Reads]),
+        ("verdicts", Dict[str, Dict[str, str]]),
+    ],
+)
 
 
 @task(
@@ -23,8 +42,10 @@ def prepare_raw_samples(seq_dir: FlyteDirectory) -> List[Reads]:
     """
     Prepare and process raw sequencing data to create a list of RawSample objects.
 
-    This function processes raw sequencing data located in the specified input directory
-    and prepares it to create a list of RawSample objects.
+    This function lists the raw sequencing data located in the specified input directory
+    and prepares it to create a list of RawSample objects. Only the directory listing is
+    fetched; the returned objects reference the reads in place so they are downloaded
+    once, by the tasks that consume them.
 
     Args:
         seq_dir (FlyteDirectory): The input directory containing raw sequencing data.
@@ -32,8 +53,31 @@ def prepare_raw_samples(seq_dir: FlyteDirectory) -> List[Reads]:
     Returns:
         List[Reads]: A list of Reads objects representing the processed sequencing data.
     """
-    seq_dir.download()
-    return Reads.make_all(Path(seq_dir))
+    paths = [f"{base.rstrip('/')}/{rel}" for base, rel in seq_dir.crawl()]
+    logger.info(
+        f"Found {len(paths)} files under {seq_dir.remote_source or seq_dir.path}"
+    )
+    return Reads.from_paths(paths)
+
+
+@task(
+    container_image=main_img_fqn,
+)
+def prepare_sheet_samples(sheet: FlyteFile) -> List[Reads]:
+    """
+    Create a list of Reads objects from a sample sheet.
+
+    The sheet is a CSV, TSV or Parquet file with one row per sample and lane, see
+    `Reads.from_sheet`. It is validated in full up front, so missing mates or duplicate
+    samples fail here rather than partway through the workflow.
+
+    Args:
+        sheet (FlyteFile): The sample sheet.
+
+    Returns:
+        List[Reads]: A list of Reads objects, one per row of the sheet.
+    """
+    return Reads.from_sheet(sheet.download())
 
 
 @task(cache=True, cache_version="1.0")
@@ -54,44 +98,48 @@ def fetch_remote_reads(urls: List[str]) -> Reads:
 
     """
     workdir = current_context().working_directory
-    for url in urls:
-        fetch_file(url, workdir)
+    fetch_all(urls, workdir)
     return Reads.make_all(Path(workdir))[0]
 
 
 @task(cache=True, cache_version="1.0")
 def fetch_remote_sites(sites: str, idx: str) -> VCF:
     """
-    Fetches remote known sites from a URL and returns a Sites object.
+    Fetches remote known sites and their index and returns a VCF object.
 
     Args:
+        sites (str): The URL of the known sites VCF.
+        idx (str): The URL of the VCF's index.
 
     Returns:
-
+        VCF: The known sites, named after the VCF file with "known" as the caller.
     """
     workdir = current_context().working_directory
-    sites_path = fetch_file(sites, workdir)
-    idx_path = fetch_file(idx, workdir)
-    return VCF(sites=FlyteFile(path=sites_path), idx=FlyteFile(path=idx_path))
+    sites_path, idx_path = fetch_all([sites, idx], workdir)
+    return VCF(
+        sample=re.sub(r"\.vcf(\.gz)?$", "", sites_path.name),
+        caller="known",
+        vcf=FlyteFile(path=str(sites_path)),
+        vcf_idx=FlyteFile(path=str(idx_path)),
+    )
 
 
 @task
 def fetch_files(urls: List[str]) -> List[FlyteFile]:
-    outfiles = []
     workdir = current_context().working_directory
-    for url in urls:
-        lpath = fetch_file(url, workdir)
-        outfiles.append(FlyteFile(path=lpath))
-    return outfiles
+    return [FlyteFile(path=lpath) for lpath in fetch_all(urls, workdir)]
 
 
 @task
-def fetch_tarfile(url: str) -> FlyteDirectory:
+def fetch_tarfile(url: str, include: Optional[List[str]] = None) -> FlyteDirectory:
     """
-    Downloads a tar.gz file from the specified URL, extracts its contents, and returns a FlyteDirectory object.
+    Streams a tar.gz file from the specified URL, extracting its contents as it downloads, and
+    returns a FlyteDirectory object.
 
     Args:
         url (str): The URL of the tar.gz file to download.
+        include (List[str], optional): Glob patterns of archive members to extract, e.g.
+            ["*/Ref"] to skip everything outside the Ref directory. Defaults to all members.
 
     Returns:
         FlyteDirectory: A FlyteDirectory object representing the directory where the contents of the tar.gz file were extracted.
@@ -99,52 +147,144 @@ def fetch_tarfile(url: str) -> FlyteDirectory:
     Raises:
         requests.HTTPError: If an HTTP error occurs while downloading the file.
     """
+    tar_name = url.split("/")[-1]
+    working_dir = current_context().working_directory
+    out_dir = Path(os.path.join(working_dir, tar_name))
+
     try:
-        response = requests.get(url)
-        tar_name = url.split("/")[-1]
-        with open(tar_name, "wb") as file:
-            file.write(response.content)
+        with requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            extract_tar_stream(response.raw, out_dir, include)
     except requests.HTTPError as e:
-        print(f"HTTP error: {e}")
+        logger.error(f"HTTP error: {e}")
         raise e
 
-    working_dir = current_context().working_directory
-    out_dir = Path(os.path.join(working_dir, tar_name))
-    with tarfile.open(tar_name, "r:gz") as tarf:
-        tarf.extractall(out_dir)
-
     return FlyteDirectory(path=out_dir)
 
 
+@task(container_image=main_img_fqn)
+def scatter_intervals(
+    ref: Reference,
+    n: int,
+    exclude_gaps: bool = False,
+    fmt: str = "interval_list",
+) -> List[FlyteFile]:
+    """
+    Plan `n` balanced, non-overlapping shards of a reference for scattering per-region
+    work, such as GATK, bcftools or variant calling stages, across tasks.
+
+    Shards are cut along the genome in reference order and never cross a contig boundary.
+    Runs of 1kb or more of Ns, which no reads align to, can be left out so that shards
+    balance on callable bases.
+
+    Args:
+        ref (Reference): The reference, with its .fai (required to exclude gaps) or .dict.
+        n (int): The number of shards.
+        exclude_gaps (bool): Leave N-gaps out of the shards.
+        fmt (str): The file format to write, either "bed" or "interval_list". Interval
+            lists require the reference's .dict.
+
+    Returns:
+        List[FlyteFile]: One file of intervals per shard.
+    """
+    if fmt not in ("bed", "interval_list"):
+        raise ValueError(f"Unsupported interval format {fmt}")
+    ref.download("gatk" if exclude_gaps else "seq_index")
+    # Gaps are found through the .gzi of a bgzipped reference, so it stays compressed
+    ref_path = ref.get_ref_path(unzip=False)
+    gaps = find_n_gaps(ref_path) if exclude_gaps else None
+    shards = plan_intervals(reference_lengths(ref_path), n, gaps)
+
+    ldir = Path(current_context().working_directory)
+    out = []
+    for i, shard in enumerate(shards):
+        path = ldir.joinpath(f"shard_{i:04}.{fmt}")
+        if fmt == "bed":
+            write_bed(shard, path)
+        else:
+            write_interval_list(shard, sequence_dict(ref_path), path)
+        out.append(FlyteFile(path=str(path)))
+    logger.info(f"Wrote {len(out)} {fmt} shards of {ref.ref_name}")
+    return out
+
+
+def read_fastqc_summary(report: Path) -> tuple[str, dict[str, str]]:
+    """
+    Read the status of each module from a FastQC report archive.
+
+    Returns:
+        tuple[str, dict[str, str]]: The name of the file the report is for, and the PASS,
+            WARN or FAIL status of each module keyed by module name.
+    """
+    with zipfile.ZipFile(report, "r") as zip_file:
+        with zip_file.open(f"{Path(zip_file.filename).stem}/summary.txt") as summary:
+            contents = summary.read().decode("utf-8")
+    statuses = {}
+    fname = None
+    for line in contents.splitlines():
+        status, module, fname = line.split("\t")
+        statuses[module] = status
+    return fname, statuses
+
+
 @task
-def check_fastqc_reports(rep_dir: FlyteDirectory) -> str:
+def check_fastqc_reports(rep_dir: FlyteDirectory, samples: List[Reads]) -> QCResults:
     """
-    Check FastQC reports for errors.
+    Check FastQC reports for errors, one sample at a time.
 
-    This function checks FastQC reports for errors and raises an exception if any are found.
+    Report archives are fetched and read in parallel and parsed into the status of every
+    module for each read file. Samples with a failed module in any of their read files,
+    or with a read file that has no report, are quarantined so the remaining samples can
+    carry on.
 
     Args:
         rep_dir (FlyteDirectory): The input directory containing FastQC reports.
-    """
-    rep_dir.download()
-    all_zips = list(Path(rep_dir.path).rglob("*fastqc.zip*"))
+        samples (List[Reads]): The samples the reports were generated for.
 
-    for p in all_zips:
-        logger.debug(f"Checking {p}")
-        with zipfile.ZipFile(p, "r") as zip_file:
-            logger.debug(f"{zip_file.filename}")
-            logger.debug(f"Archive contains {zip_file.namelist()}")
-            with zip_file.open(
-                f"{Path(zip_file.filename).stem}/summary.txt"
-            ) as summary:
-                contents = summary.read().decode("utf-8")
-                logger.debug(f"Contents of summary.txt: {contents}")
-                if "FAIL" in contents:
-                    return "FAIL"
-                elif "WARN" in contents:
-                    return "WARN"
+    Returns:
+        QCResults: The samples that passed and those quarantined, and the status of each
+            module keyed by read file name.
+    """
+    local_dir = Path(rep_dir.path)
+    remote = rep_dir.remote_source
+    reports = [rel for _, rel in rep_dir.crawl() if rel.endswith("fastqc.zip")]
+    file_access = FlyteContextManager.current_context().file_access
+
+    def scan(rel: str) -> tuple[str, dict[str, str]]:
+        report = local_dir.joinpath(rel)
+        if remote and not report.exists():
+            report.parent.mkdir(parents=True, exist_ok=True)
+            file_access.get_data(f"{remote.rstrip('/')}/{rel}", str(report))
+        logger.debug(f"Checking {report}")
+        return read_fastqc_summary(report)
+
+    with ThreadPoolExecutor(max_workers=dl_concurrency) as pool:
+        verdicts = dict(pool.map(scan, reports))
+    logger.info(f"Read {len(verdicts)} FastQC reports from {remote or local_dir}")
+
+    passed, quarantined = [], []
+    for rs in samples:
+        fnames = [
+            PurePosixPath(f.path).name for f in (rs.read1, rs.read2, rs.uread) if f
+        ]
+        missing = [f for f in fnames if f not in verdicts]
+        failed = [
+            f"{f}: {m}"
+            for f in fnames
+            for m, status in verdicts.get(f, {}).items()
+            if status == "FAIL"
+        ]
+        if missing or failed:
+            reasons = failed + [f"{f}: no FastQC report" for f in missing]
+            logger.warning(f"Quarantining {rs.sample}, failed QC on {reasons}")
+            quarantined.append(rs)
+        else:
+            passed.append(rs)
 
-    return "PASS"
+    if not passed:
+        raise RuntimeError(f"All {len(samples)} samples failed QC")
+    logger.info(f"{len(passed)} samples passed QC, {len(quarantined)} quarantined")
+    return QCResults(passed=passed, quarantined=quarantined, verdicts=verdicts)
 
 
 @task(container_image=parabricks_img_fqn)
@@ -183,44 +323,74 @@ def compare_bams(in1: FlyteFile, in2: FlyteFile) -> bool:
     return no_out
 
 
+def _vcf_contigs(vcf: str) -> list[str]:
+    """
+    Contigs with at least one record in an indexed VCF, in index order.
+    """
+    result = subproc_execute(["bcftools", "index", "--stats", vcf])
+    return [line.split("\t")[0] for line in result.output.splitlines() if line]
+
+
 @task(
     container_image=main_img_fqn,
+    requests=Resources(cpu="4", mem="4Gi"),
 )
-def intersect_vcfs(vcf1: VCF, vcf2: VCF) -> VCF:
+def intersect_vcfs(vcf1: VCF, vcf2: VCF, extra_vcfs: Optional[List[VCF]] = None) -> VCF:
     """
-    Takes the intersection of 2 VCF files and returns a new VCF file to increase
+    Takes the intersection of 2 or more VCF files and returns a new VCF file to increase
     calling sensitivity.
 
+    Inputs are downloaded concurrently. The intersection is computed per contig across a
+    pool of bcftools processes, using the inputs' indices to read only that contig, and
+    the pieces are concatenated in order and indexed.
+
     Args:
         vcf1 (VCF): The first input VCF object.
         vcf2 (VCF): The second input VCF object.
+        extra_vcfs (List[VCF], optional): Further VCFs to intersect with.
 
     Returns:
-        VCF: Intersected and zipped VCF object.
+        VCF: Intersected, bgzipped and indexed VCF object.
     """
     wd = Path(current_context().working_directory)
-    vcf1.dl_all(workdir=wd)
-    vcf2.dl_all(workdir=wd)
-    isec_out = VCF(sample=vcf1.sample, caller=f"{vcf1.caller}_{vcf2.caller}_isec")
-    fname_out = isec_out.get_vcf_fname()
-
-    cmd = " ".join(
-        [
-            "bcftools",
-            "isec",
-            "-n=2",
-            "-O",
-            "z",
-            "-w",
-            "1",
-            vcf1.vcf.path,
-            vcf2.vcf.path,
-            "-o",
-            fname_out,
-        ]
-    )
+    vcfs = [vcf1, vcf2, *(extra_vcfs or [])]
+    with ThreadPoolExecutor(max_workers=len(vcfs)) as pool:
+        list(pool.map(lambda v: v.dl_all(workdir=wd), vcfs))
+    paths = [v.vcf.path for v in vcfs]
 
-    subproc_execute(cmd, shell=True)
-    setattr(isec_out, "vcf", FlyteFile(path=fname_out))
+    isec_out = VCF(
+        sample=vcf1.sample, caller=f"{'_'.join(v.caller for v in vcfs)}_isec"
+    )
+    fname_out = wd.joinpath(isec_out.get_vcf_fname())
+    idx_out = wd.joinpath(isec_out.get_vcf_idx_fname())
+
+    # Only contigs with records in every input can hold shared sites
+    shared = [set(_vcf_contigs(p)) for p in paths]
+    contigs = [c for c in _vcf_contigs(paths[0]) if all(c in s for s in shared)]
+
+    # --no-version keeps headers identical across pieces so they concatenate as-is
+    isec = ["bcftools", "isec", f"-n={len(vcfs)}", "-w", "1", "--no-version", "-O", "z"]
+
+    def intersect(i: int, contig: str | None) -> Path:
+        piece = wd.joinpath(f"isec_{i:05}.vcf.gz")
+        region = ["-r", contig] if contig else []
+        subproc_execute(isec + region + ["-o", str(piece)] + paths)
+        return piece
+
+    if contigs:
+        logger.info(f"Intersecting {len(vcfs)} VCFs over {len(contigs)} contigs")
+        with ThreadPoolExecutor(max_workers=tool_threads("bcftools")) as pool:
+            pieces = list(pool.map(intersect, range(len(contigs)), contigs))
+        subproc_execute(
+            ["bcftools", "concat", "--naive", "--no-version", "-o", str(fname_out)]
+            + [str(p) for p in pieces]
+        )
+    else:
+        logger.info("No contig has records in every VCF, writing an empty intersection")
+        intersect(0, None).rename(fname_out)
+    subproc_execute(["bcftools", "index", "--tbi", "-o", str(idx_out), str(fname_out)])
+
+    setattr(isec_out, "vcf", FlyteFile(path=str(fname_out)))
+    setattr(isec_out, "vcf_idx", FlyteFile(path=str(idx_out)))
 
     return isec_out
@@ -0,0 +1,379 @@
+import io
+import re
+import gzip
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from flytekit import task, current_context, Resources
+from flytekit.types.directory import FlyteDirectory
+
+from unionbio.config import main_img_fqn, logger
+from unionbio.datatypes.variants import VCF
+from unionbio.tasks.helpers import inflate_bgzf_block
+from unionbio.tasks.resources import task_cpus
+
+# Bytes of VCF text parsed into each record batch
+BATCH_BYTES = 16 * 1024 * 1024
+# Tabix pseudo-bin holding per-contig metadata rather than chunks
+TBI_PSEUDO_BIN = 37450
+
+VCF_TYPES = {
+    "Integer": pa.int32(),
+    "Float": pa.float32(),
+    "String": pa.string(),
+    "Character": pa.string(),
+    "Flag": pa.bool_(),
+}
+SITE_SCHEMA = [
+    ("POS", pa.int32()),
+    ("ID", pa.string()),
+    ("REF", pa.string()),
+    ("ALT", pa.list_(pa.string())),
+    ("QUAL", pa.float32()),
+    ("FILTER", pa.list_(pa.string())),
+]
+
+
+class VcfHeader(NamedTuple):
+    """
+    The parts of a VCF header needed to type its records.
+    """
+
+    info: dict[str, tuple[str, str]]
+    format: dict[str, tuple[str, str]]
+    columns: list[str]
+
+    @property
+    def samples(self) -> list[str]:
+        return self.columns[9:]
+
+
+def parse_header(lines: Iterable[str]) -> VcfHeader:
+    """
+    Read the Number and Type of each INFO and FORMAT field, and the column names, from the
+    header lines of a VCF.
+    """
+    meta = {"INFO": {}, "FORMAT": {}}
+    columns = []
+    for line in lines:
+        if m := re.match(r"##(INFO|FORMAT)=<(.*)>", line):
+            attrs = dict(re.findall(r'(\w+)=("[^"]*"|[^,]*)', m.group(2)))
+            meta[m.group(1)][attrs["ID"]] = (attrs["Number"], attrs["Type"])
+        elif line.startswith("#CHROM"):
+            columns = line.lstrip("#").rstrip("\n").split("\t")
+            break
+    return VcfHeader(meta["INFO"], meta["FORMAT"], columns)
+
+
+def read_header(vcf: Path) -> VcfHeader:
+    with gzip.open(vcf, "rt") as f:
+        return parse_header(f)
+
+
+def field_type(number: str, vcf_type: str) -> pa.DataType:
+    arrow_type = VCF_TYPES[vcf_type]
+    return arrow_type if number in ("0", "1") else pa.list_(arrow_type)
+
+
+def _missing_to_null(values: pa.Array) -> pa.Array:
+    return pc.if_else(pc.equal(values, "."), pa.scalar(None, pa.string()), values)
+
+
+def _typed(values: pa.Array, number: str, vcf_type: str) -> pa.Array:
+    """
+    Convert the text of a field to its declared type, splitting lists on commas and
+    reading "." as missing.
+    """
+    values = _missing_to_null(values)
+    if number in ("0", "1"):
+        return values.cast(VCF_TYPES[vcf_type])
+    lists = pc.split_pattern(values, ",")
+    offsets = pc.subtract(lists.offsets, lists.offsets[0])
+    items = _missing_to_null(lists.flatten()).cast(VCF_TYPES[vcf_type])
+    return pa.ListArray.from_arrays(offsets, items, mask=lists.is_null())
+
+
+def _info_field(info: pa.Array, key: str, number: str, vcf_type: str) -> pa.Array:
+    key = re.escape(key)
+    if vcf_type == "Flag":
+        return pc.fill_null(
+            pc.match_substring_regex(info, f"(?:^|;){key}(?:;|$)"), False
+        )
+    values = pc.struct_field(pc.extract_regex(info, f"(?:^|;){key}=(?P<v>[^;]*)"), "v")
+    return _typed(values, number, vcf_type)
+
+
+def _format_field(fmt: pa.Array, sample: pa.Array, key: str) -> pa.Array:
+    """
+    Pick one key's values out of a sample column. FORMAT can differ between records, so
+    each distinct FORMAT is matched separately, which is a handful of passes in practice.
+    """
+    values = pa.nulls(len(sample), pa.string())
+    for layout in pc.unique(fmt).drop_null().to_pylist():
+        keys = layout.split(":")
+        if key not in keys:
+            continue
+        pattern = "^" + "(?:[^:]*:)" * keys.index(key) + "(?P<v>[^:]*)"
+        found = pc.struct_field(pc.extract_regex(sample, pattern), "v")
+        values = pc.if_else(pc.equal(fmt, layout), found, values)
+    return values
+
+
+def sites_schema(
+    header: VcfHeader, info_fields: list[str], format_fields: list[str]
+) -> pa.Schema:
+    fields = SITE_SCHEMA.copy()
+    fields += [(f"INFO_{k}", field_type(*header.info[k])) for k in info_fields]
+    fields += [
+        (f"{s}_{k}", field_type(*header.format[k]))
+        for s in header.samples
+        for k in format_fields
+    ]
+    return pa.schema(fields)
+
+
+def records_to_table(
+    records: pa.Table,
+    header: VcfHeader,
+    info_fields: list[str],
+    format_fields: list[str],
+) -> pa.Table:
+    """
+    Type the columns of raw VCF records and unpack the selected INFO and FORMAT fields
+    into columns of their own, named INFO_<key> and <sample>_<key>.
+    """
+    records = records.combine_chunks()
+    columns = {
+        "POS": records["POS"],
+        "ID": records["ID"],
+        "REF": records["REF"],
+        "ALT": pc.split_pattern(records["ALT"], ","),
+        "QUAL": records["QUAL"],
+        "FILTER": pc.split_pattern(records["FILTER"], ";"),
+    }
+    for key in info_fields:
+        columns[f"INFO_{key}"] = _info_field(
+            records["INFO"].chunk(0), key, *header.info[key]
+        )
+    for sample in header.samples:
+        for key in format_fields:
+            text = _format_field(
+                records["FORMAT"].chunk(0), records[sample].chunk(0), key
+            )
+            columns[f"{sample}_{key}"] = _typed(text, *header.format[key])
+    schema = sites_schema(header, info_fields, format_fields)
+    return pa.table(columns).cast(schema)
+
+
+def parse_records(
+    stream,
+    header: VcfHeader,
+    info_fields: list[str],
+    format_fields: list[str],
+    batch_bytes: int = BATCH_BYTES,
+) -> Iterator[pa.Table]:
+    """
+    Parse a binary stream of VCF record lines, without the header, into typed tables of
+    roughly `batch_bytes` of text each.
+    """
+    reader = pacsv.open_csv(
+        stream,
+        read_options=pacsv.ReadOptions(
+            column_names=header.columns, block_size=batch_bytes
+        ),
+        parse_options=pacsv.ParseOptions(delimiter="\t", quote_char=False),
+        convert_options=pacsv.ConvertOptions(
+            column_types={
+                c: (pa.int32() if c == "POS" else pa.string()) for c in header.columns
+            },
+            null_values=["."],
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        yield records_to_table(
+            pa.Table.from_batches([batch]), header, info_fields, format_fields
+        )
+
+
+def read_tbi(tbi: Path) -> dict[str, tuple[int, int]]:
+    """
+    Read the virtual offsets spanning each contig's records from a tabix index.
+
+    Returns:
+        dict[str, tuple[int, int]]: Start and end virtual offsets keyed by contig name,
+            in index order, for contigs with records.
+    """
+    data = gzip.decompress(Path(tbi).read_bytes())
+    magic, n_ref, *_, l_nm = struct.unpack_from("<4s8i", data)
+    if magic != b"TBI\x01":
+        raise ValueError(f"{tbi} is not a tabix index")
+    names = data[36 : 36 + l_nm].split(b"\0")[:n_ref]
+    pos = 36 + l_nm
+    spans = {}
+    for name in names:
+        (n_bin,) = struct.unpack_from("<i", data, pos)
+        pos += 4
+        chunks = []
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, pos)
+            pos += 8
+            if bin_id != TBI_PSEUDO_BIN:
+                chunks += struct.unpack_from(f"<{2 * n_chunk}Q", data, pos)
+            pos += 16 * n_chunk
+        (n_intv,) = struct.unpack_from("<i", data, pos)
+        pos += 4 + 8 * n_intv
+        if chunks:
+            spans[name.decode()] = (min(chunks[0::2]), max(chunks[1::2]))
+    return spans
+
+
+def read_bgzf_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    """
+    Stream the uncompressed bytes of a BGZF file between two virtual offsets.
+    """
+    coffset, uoffset = start >> 16, start & 0xFFFF
+    end_coffset, end_uoffset = end >> 16, end & 0xFFFF
+    with open(path, "rb") as f:
+        f.seek(coffset)
+        while coffset <= end_coffset:
+            head = f.read(18)
+            if len(head) < 18:
+                break
+            bsize = struct.unpack("<H", head[16:18])[0] + 1
+            data = inflate_bgzf_block(head + f.read(bsize - 18))
+            yield data[uoffset : end_uoffset if coffset == end_coffset else None]
+            coffset += bsize
+            uoffset = 0
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    A readable file over an iterator of byte chunks.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf:
+            self._buf = next(self._chunks, None)
+            if self._buf is None:
+                self._buf = b""
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def read_contig(
+    vcf: Path,
+    span: tuple[int, int],
+    header: VcfHeader,
+    info_fields: list[str],
+    format_fields: list[str],
+) -> Iterator[pa.Table]:
+    """
+    Stream one contig's records, located by their span in `read_tbi`, as typed tables.
+    """
+    stream = io.BufferedReader(_ChunkStream(read_bgzf_range(vcf, *span)))
+    return parse_records(stream, header, info_fields, format_fields)
+
+
+def vcf_to_parquet(
+    vcf: Path,
+    out_dir: Path,
+    info_fields: list[str] | None = None,
+    format_fields: list[str] | None = None,
+    threads: int | None = None,
+) -> Path:
+    """
+    Convert a bgzipped, tabix-indexed VCF into a Parquet dataset partitioned by contig.
+
+    The index locates each contig's records, so contigs are read and converted
+    concurrently, each streaming through bounded batches into its own
+    CHROM=<contig>/part-0.parquet.
+
+    Args:
+        vcf (Path): The VCF, with its .tbi alongside.
+        out_dir (Path): Directory to write the dataset to.
+        info_fields (list[str], optional): INFO keys to unpack. Defaults to all of them.
+        format_fields (list[str], optional): FORMAT keys to unpack for every sample.
+            Defaults to all of them.
+        threads (int, optional): Contigs converted at once. Defaults to the task's CPUs.
+
+    Returns:
+        Path: The dataset directory.
+    """
+    header = read_header(vcf)
+    info_fields = list(header.info) if info_fields is None else info_fields
+    format_fields = list(header.format) if format_fields is None else format_fields
+    unknown = [f"INFO/{k}" for k in info_fields if k not in header.info]
+    unknown += [f"FORMAT/{k}" for k in format_fields if k not in header.format]
+    if unknown:
+        raise ValueError(f"Fields {unknown} are not defined in the header of {vcf}")
+
+    spans = read_tbi(vcf.with_name(f"{vcf.name}.tbi"))
+    schema = sites_schema(header, info_fields, format_fields)
+
+    def convert(contig: str) -> int:
+        part = out_dir.joinpath(f"CHROM={quote(contig, safe='')}", "part-0.parquet")
+        part.parent.mkdir(parents=True, exist_ok=True)
+        tables = read_contig(vcf, spans[contig], header, info_fields, format_fields)
+        rows = 0
+        with pq.ParquetWriter(part, schema) as writer:
+            for table in tables:
+                writer.write_table(table)
+                rows += table.num_rows
+        return rows
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=threads or task_cpus()) as pool:
+        rows = sum(pool.map(convert, spans))
+    logger.info(f"Wrote {rows} sites over {len(spans)} contigs from {vcf} to {out_dir}")
+    return out_dir
+
+
+@task(
+    container_image=main_img_fqn,
+    requests=Resources(cpu="4", mem="8Gi"),
+)
+def export_vcf_sites(
+    vcf: VCF,
+    info_fields: Optional[List[str]] = None,
+    format_fields: Optional[List[str]] = None,
+) -> VCF:
+    """
+    Export a VCF's sites to a Parquet dataset partitioned by contig, so they can be
+    filtered and summarized in a vectorized way instead of re-parsing the VCF text.
+
+    Columns are POS, ID, REF, ALT, QUAL and FILTER, plus INFO_<key> for each selected INFO
+    field and <sample>_<key> for each selected FORMAT field, typed as declared in the
+    header. CHROM is the partition key.
+
+    Args:
+        vcf (VCF): A bgzipped VCF object with its tabix index.
+        info_fields (List[str], optional): INFO keys to export. Defaults to all of them.
+        format_fields (List[str], optional): FORMAT keys to export. Defaults to all of
+            them.
+
+    Returns:
+        VCF: The input VCF object with `sites` set to the dataset.
+    """
+    wd = Path(current_context().working_directory)
+    vcf.dl_all(workdir=wd)
+    out_dir = wd.joinpath(vcf.get_sites_dname())
+    vcf_to_parquet(Path(vcf.vcf.path), out_dir, info_fields, format_fields)
+    setattr(vcf, "sites", FlyteDirectory(path=str(out_dir)))
+    return vcf
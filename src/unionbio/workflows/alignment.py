@@ -1,14 +1,15 @@
 from datetime import timedelta
-from flytekit import workflow, approve, conditional
+from flytekit import workflow, approve
 from flytekit.types.directory import FlyteDirectory
 from flytekit.types.file import FlyteFile
 from flytekit import map_task
 
 from unionbio.config import ref_loc, seq_dir_pth
-from unionbio.tasks.fastqc import fastqc
+from unionbio.tasks.fastqc import fastqc_reads, gather_fastqc
 from unionbio.tasks.fastp import pyfastp
 from unionbio.tasks.utils import prepare_raw_samples, check_fastqc_reports
-from unionbio.tasks.bowtie2 import bowtie2_align_samples, bowtie2_index
+from unionbio.tasks.bowtie2 import bowtie2_align_samples
+from unionbio.tasks.index_registry import registered_index
 from unionbio.tasks.multiqc import render_multiqc
 
 
@@ -28,32 +29,22 @@ def alignment_wf(seq_dir: FlyteDirectory = seq_dir_pth) -> FlyteFile:
     Returns:
         FlyteFile: A FlyteFile object representing the output of the alignment workflow.
     """
-    # Generate FastQC reports and check for failures
-    fqc_dir = fastqc(seq_dir=seq_dir)
-    check = check_fastqc_reports(rep_dir=fqc_dir)
-
-    # If the FastQC summary is PASS or WARN then we can proceed with the workflow.
-    # If there is at least one FAIL, then the workflow fails.
-    samples = (
-        conditional("pass-qc")
-        .if_((check == "PASS") | (check == "WARN"))
-        .then(prepare_raw_samples(seq_dir=seq_dir))
-        .else_()
-        .fail("One or more samples failed QC.")
-    )
+    # Generate FastQC reports per sample and quarantine samples that failed QC
+    raw_samples = prepare_raw_samples(seq_dir=seq_dir)
+    fqc_dir = gather_fastqc(reports=map_task(fastqc_reads)(rs=raw_samples))
+    qc = check_fastqc_reports(rep_dir=fqc_dir, samples=raw_samples)
 
     # Map out filtering across all samples and generate indices
-    filtered_samples = map_task(pyfastp)(rs=samples)
+    filtered_samples = map_task(pyfastp)(rs=qc.passed)
     approve_filter = approve(
         render_multiqc(fqc=fqc_dir, filt_reps=filtered_samples, sams=[]),
         "filter-approval",
         timeout=timedelta(hours=2),
     )
 
-    bowtie2_idx = bowtie2_index(ref=ref_loc)
+    bowtie2_idx = registered_index(ref=ref_loc, tool="bowtie2")
 
-    # Require that samples pass QC before potentially expensive index generation
-    samples >> approve_filter
+    # Require approval of filtering before potentially expensive index generation
     approve_filter >> bowtie2_idx
 
     # Compare alignment results using two different aligners in a dynamic task
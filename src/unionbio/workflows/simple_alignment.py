@@ -4,10 +4,11 @@ from flytekit.types.file import FlyteFile
 from flytekit import map_task
 
 from unionbio.config import ref_loc, seq_dir
-from unionbio.tasks.fastqc import fastqc
+from unionbio.tasks.fastqc import fastqc_reads, gather_fastqc
 from unionbio.tasks.fastp import pyfastp
 from unionbio.tasks.utils import prepare_raw_samples
-from unionbio.tasks.bowtie2 import bowtie2_align_samples, bowtie2_index
+from unionbio.tasks.bowtie2 import bowtie2_align_samples
+from unionbio.tasks.index_registry import registered_index
 from unionbio.tasks.multiqc import render_multiqc
 
 
@@ -27,16 +28,16 @@ def simple_alignment_wf(seq_dir: FlyteDirectory = seq_dir) -> FlyteFile:
     Returns:
         FlyteFile: A FlyteFile object representing the output of the alignment workflow.
     """
-    # Generate FastQC reports and check for failures
-    fqc_out = fastqc(seq_dir=seq_dir)
+    # Generate FastQC reports per sample and check for failures
     samples = prepare_raw_samples(seq_dir=seq_dir)
+    fqc_out = gather_fastqc(reports=map_task(fastqc_reads)(rs=samples))
 
     # Map out filtering across all samples and generate indices
     filtered_samples = map_task(pyfastp)(rs=samples)
 
     fqc_out >> filtered_samples
 
-    bowtie2_idx = bowtie2_index(ref=ref_loc)
+    bowtie2_idx = registered_index(ref=ref_loc, tool="bowtie2")
 
     # Compare alignment results using two different aligners in a dynamic task
     sams = bowtie2_align_samples(idx=bowtie2_idx, samples=filtered_samples)
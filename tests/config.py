@@ -13,6 +13,7 @@ test_assets = {
     "pb_haplocall_dir": f"{test_dir}/assets/alignments/pb_haplocall",
     "sort_dir": f"{test_dir}/assets/alignments/sorted",
     "dedup_dir": f"{test_dir}/assets/alignments/deduped",
+    "dups_dir": f"{test_dir}/assets/alignments/duplicates",
     "ref_path": f"{test_dir}/assets/references/GRCh38_short.fasta",
     "ref_dir": f"{test_dir}/assets/references/",
     "ref_fn": "GRCh38_short.fasta",
@@ -4,7 +4,12 @@ from pathlib import Path
 from filecmp import cmp
 from flytekit.types.directory import FlyteDirectory
 from unionbio.tasks.hisat2 import hisat2_index, hisat2_align_paired_reads
-from unionbio.tasks.bowtie2 import bowtie2_index, bowtie2_align_paired_reads
+from unionbio.tasks.bowtie2 import (
+    bowtie2_index,
+    bowtie2_align_paired_reads,
+    bowtie2_align_sharded,
+    bowtie2_align_dedup,
+)
 from unionbio.tasks.bwa import bwa_index
 from unionbio.datatypes.alignment import Alignment
 from unionbio.datatypes.reads import Reads
@@ -34,7 +39,7 @@ def test_hisat2_index():
 def test_hisat2_align():
     idx_dir = FlyteDirectory(test_assets["hs2_idx_dir"])
     filt_samples = Reads.make_all(Path(test_assets["filt_seq_dir"]))
-    al = hisat2_align_paired_reads(idx=idx_dir, fs=filt_samples[0])
+    al = hisat2_align_paired_reads(idx=idx_dir, fs=filt_samples[0], fmt="sam")
     assert isinstance(al, Alignment)
     assert all(
         x in os.listdir(test_assets["hs2_sam_dir"])
@@ -64,7 +69,7 @@ def test_bowtie2_index():
 def test_bowtie2_align():
     idx_dir = FlyteDirectory(test_assets["bt2_idx_dir"])
     filt_samples = Reads.make_all(Path(test_assets["filt_seq_dir"]))
-    al = bowtie2_align_paired_reads(idx=idx_dir, fs=filt_samples[0])
+    al = bowtie2_align_paired_reads(idx=idx_dir, fs=filt_samples[0], fmt="sam")
     assert isinstance(al, Alignment)
     assert all(
         x in os.listdir(test_assets["bt2_sam_dir"])
@@ -72,13 +77,97 @@ def test_bowtie2_align():
     )
 
 
+def test_bowtie2_align_bam():
+    idx_dir = FlyteDirectory(test_assets["bt2_idx_dir"])
+    filt_samples = Reads.make_all(Path(test_assets["filt_seq_dir"]))
+    al = bowtie2_align_paired_reads(idx=idx_dir, fs=filt_samples[0])
+    assert al.format == "bam"
+    assert al.alignment.path.endswith("ERR250683-tiny_bowtie2_aligned.bam")
+    assert open(al.alignment.path, "rb").read(2) == b"\x1f\x8b"
+    assert cmp(
+        al.alignment_report.path,
+        Path(test_assets["bt2_sam_dir"]).joinpath(
+            "ERR250683-tiny_bowtie2_aligned_report.txt"
+        ),
+    )
+
+
+def test_bowtie2_align_sharded():
+    idx_dir = FlyteDirectory(test_assets["bt2_idx_dir"])
+    filt_samples = Reads.make_all(Path(test_assets["filt_seq_dir"]))
+    al = bowtie2_align_sharded(idx=idx_dir, fs=filt_samples[0], n_shards=2)
+    assert isinstance(al, Alignment)
+    assert al.sample == "ERR250683-tiny"
+    assert al.format == "bam"
+    assert not al.sorted
+    assert al.alignment.path.endswith("ERR250683-tiny_bowtie2_aligned.bam")
+    assert cmp(
+        al.alignment_report.path,
+        Path(test_assets["bt2_sam_dir"]).joinpath(
+            "ERR250683-tiny_bowtie2_aligned_report.txt"
+        ),
+    )
+
+
+def test_bowtie2_align_sharded_sorted():
+    idx_dir = FlyteDirectory(test_assets["bt2_idx_dir"])
+    filt_samples = Reads.make_all(Path(test_assets["filt_seq_dir"]))
+    al = bowtie2_align_sharded(idx=idx_dir, fs=filt_samples[0], n_shards=2, sort=True)
+    assert al.sorted and not al.deduped
+    assert al.alignment.path.endswith("ERR250683-tiny_bowtie2_sorted_aligned.bam")
+    assert al.alignment_idx.path.endswith(".bam.bai")
+
+
+def test_bowtie2_align_dedup():
+    idx_dir = FlyteDirectory(test_assets["bt2_idx_dir"])
+    filt_samples = Reads.make_all(Path(test_assets["filt_seq_dir"]))
+    al = bowtie2_align_dedup(idx=idx_dir, fs=filt_samples[0])
+    assert al.sorted and al.deduped
+    assert al.alignment.path.endswith(
+        "ERR250683-tiny_bowtie2_sorted_deduped_aligned.bam"
+    )
+    assert al.alignment_idx.path.endswith(".bam.bai")
+    assert os.path.getsize(al.dedup_metrics.path) > 0
+    assert al.intermediates is None
+    assert cmp(
+        al.alignment_report.path,
+        Path(test_assets["bt2_sam_dir"]).joinpath(
+            "ERR250683-tiny_bowtie2_aligned_report.txt"
+        ),
+    )
+
+
+def test_bowtie2_align_dedup_debug():
+    idx_dir = FlyteDirectory(test_assets["bt2_idx_dir"])
+    filt_samples = Reads.make_all(Path(test_assets["filt_seq_dir"]))
+    al = bowtie2_align_dedup(idx=idx_dir, fs=filt_samples[0], debug=True)
+    assert al.deduped
+    assert sorted(os.listdir(al.intermediates.path)) == [
+        "ERR250683-tiny_bowtie2_aligned.sam",
+        "ERR250683-tiny_bowtie2_fixmate.bam",
+        "ERR250683-tiny_bowtie2_sorted_aligned.bam",
+    ]
+
+
 def test_bwa_index(tmp_path):
-    shutil.copy(test_assets["ref_path"], tmp_path)
+    ref_dir = tmp_path.joinpath("ref")
+    ref_dir.mkdir()
+    shutil.copy(test_assets["ref_path"], ref_dir)
+    shutil.copy(Path(test_assets["ref_path"]).with_suffix(".dict"), ref_dir)
+    ref_dir.joinpath("bt2_idx.1.bt2").write_text("other aligner")
     ref_in = Reference(
         ref_name=test_assets["ref_fn"],
-        ref_dir=FlyteDirectory(path=tmp_path),
+        ref_dir=FlyteDirectory(path=ref_dir),
     )
-    ref_out = bwa_index(ref_obj=ref_in)
+    registry = tmp_path.joinpath("registry")
+    ref_out = bwa_index(ref_obj=ref_in, registry=str(registry))
     assert dir_contents_match(
         Path(test_assets["bwa_idx_dir"]), Path(ref_out.ref_dir.path)
     )
+    # The sequence dictionary is kept, other aligners' indices are left behind
+    out_dir = Path(ref_out.ref_dir.path)
+    assert out_dir.joinpath("GRCh38_short.dict").exists()
+    assert not out_dir.joinpath("bt2_idx.1.bt2").exists()
+    # The bundle is registered once and served from the registry afterwards
+    bwa_index(ref_obj=ref_in, registry=str(registry))
+    assert len(list(registry.glob("bwa/*"))) == 1
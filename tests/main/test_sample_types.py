@@ -1,6 +1,9 @@
 import os
+import shutil
+import pytest
 from pathlib import Path
 from tests.config import test_assets
+from tests.utils import bgzip
 from flytekit.types.directory import FlyteDirectory
 from flytekit.types.file import FlyteFile
 from unionbio.datatypes.alignment import Alignment
@@ -23,6 +26,54 @@ def test_raw_sample_make_all():
     assert "ERR250683-tiny_2.fastq.gz" in samps[0].read2.path
 
 
+def test_raw_sample_from_remote_paths():
+    samps = Reads.from_paths(
+        [
+            "s3://my-s3-bucket/my-data/sequences/ERR250683-tiny_1.fastq.gz",
+            "s3://my-s3-bucket/my-data/sequences/ERR250683-tiny_2.fastq.gz",
+        ]
+    )
+    assert len(samps) == 1
+    assert samps[0].sample == "ERR250683-tiny"
+    assert (
+        samps[0].read1.path
+        == "s3://my-s3-bucket/my-data/sequences/ERR250683-tiny_1.fastq.gz"
+    )
+    assert (
+        samps[0].read2.path
+        == "s3://my-s3-bucket/my-data/sequences/ERR250683-tiny_2.fastq.gz"
+    )
+
+
+def test_reads_from_sheet(tmp_path):
+    sheet = tmp_path.joinpath("samples.csv")
+    sheet.write_text(
+        "sample,lane,read1,read2\n"
+        "s1,001,s3://bucket/s1_L001_1.fastq.gz,s3://bucket/s1_L001_2.fastq.gz\n"
+        "s1,002,s3://bucket/s1_L002_1.fastq.gz,s3://bucket/s1_L002_2.fastq.gz\n"
+    )
+    samps = Reads.from_sheet(str(sheet))
+    assert len(samps) == 2
+    assert samps[0].sample == "s1"
+    assert samps[0].lane == "001"
+    assert samps[1].read2.path == "s3://bucket/s1_L002_2.fastq.gz"
+    assert samps[1].get_read_fnames()[0] == "s1-L002_1.fastq.gz"
+
+
+def test_reads_from_sheet_invalid(tmp_path):
+    sheet = tmp_path.joinpath("samples.tsv")
+    sheet.write_text(
+        "sample\tread1\tread2\n"
+        "s1\ts3://bucket/s1_1.fastq.gz\t\n"
+        "s2\ts3://bucket/s2_1.fastq.gz\ts3://bucket/s2_2.fastq.gz\n"
+        "s2\ts3://bucket/s2_1.fastq.gz\ts3://bucket/s2_2.fastq.gz\n"
+    )
+    with pytest.raises(ValueError) as e:
+        Reads.from_sheet(str(sheet))
+    assert "line 2 (s1): read1 has no read2 mate" in str(e.value)
+    assert "2 rows share" in str(e.value)
+
+
 def test_filt_sample_fname():
     filt_samp = Reads.make_all(Path(test_assets["filt_seq_dir"]))[0]
     o1, o2 = filt_samp.get_read_fnames()
@@ -46,6 +97,13 @@ def test_alignment_file_fname():
     assert al == "test_bowtie2_aligned.sam"
 
 
+def test_alignment_idx_fname():
+    bam = Alignment("test", "bowtie2", "bam", sorted=True)
+    assert bam.get_alignment_idx_fname() == "test_bowtie2_sorted_aligned.bam.bai"
+    cram = Alignment("test", "bowtie2", "cram", sorted=True)
+    assert cram.get_alignment_idx_fname() == "test_bowtie2_sorted_aligned.cram.crai"
+
+
 def test_alignment_file_make_all():
     sams = Alignment.make_all(Path(test_assets["bt2_sam_dir"]))
     assert len(sams) == 1
@@ -56,6 +114,34 @@ def test_alignment_file_make_all():
     assert "ERR250683-tiny_bowtie2_aligned_report.txt" in sams[0].alignment_report.path
 
 
+def test_alignment_lanes(tmp_path):
+    # Lanes of one sample get their own names, and are told apart when read back
+    for lane in ["1", "2"]:
+        al = Alignment("test", "bowtie2", "bam", sorted=True, lane=lane)
+        tmp_path.joinpath(al.get_alignment_fname()).touch()
+        tmp_path.joinpath(al.get_alignment_idx_fname()).touch()
+    assert sorted(p.name for p in tmp_path.iterdir())[:2] == [
+        "test-L1_bowtie2_sorted_aligned.bam",
+        "test-L1_bowtie2_sorted_aligned.bam.bai",
+    ]
+    als = sorted(Alignment.make_all(tmp_path), key=lambda al: al.lane)
+    assert [(al.sample, al.lane) for al in als] == [("test", "1"), ("test", "2")]
+    assert all(al.alignment and al.alignment_idx for al in als)
+
+
+def test_alignment_from_sheet(tmp_path):
+    sheet = tmp_path.joinpath("alignments.csv")
+    sheet.write_text(
+        "sample,aligner,alignment,sorted\n"
+        "sample,bowtie2,s3://bucket/sample_bowtie2_aligned.bam,true\n"
+    )
+    als = Alignment.from_sheet(str(sheet))
+    assert len(als) == 1
+    assert als[0].format == "bam"
+    assert als[0].sorted is True
+    assert als[0].deduped is None
+
+
 def test_reference():
     ref = Reference(test_assets["ref_fn"], FlyteDirectory(path=test_assets["ref_dir"]))
     assert isinstance(ref.ref_dir, FlyteDirectory)
@@ -65,6 +151,42 @@ def test_reference():
     )
 
 
+def test_reference_fetch(tmp_path):
+    ref = Reference(test_assets["ref_fn"], FlyteDirectory(path=test_assets["ref_dir"]))
+    lines = open(ref.get_ref_path()).read().splitlines()[1:]
+    seq = "".join(lines)
+    assert ref.fetch("chr1", 9995, 10005) == "NNNNNTAACC"
+    assert ref.fetch("chr1", 69, 141) == seq[69:141]
+    assert ref.fetch("chr1", 699900) == seq[699900:]
+    with pytest.raises(KeyError):
+        ref.fetch("chr2", 0, 10)
+
+    # Bgzipped references are read through their .gzi
+    bgzip(ref.get_ref_path(), tmp_path.joinpath(f"{ref.ref_name}.gz"))
+    shutil.copy(
+        f"{ref.get_ref_path()}.fai", tmp_path.joinpath(f"{ref.ref_name}.gz.fai")
+    )
+    gz_ref = Reference(f"{ref.ref_name}.gz", FlyteDirectory(path=str(tmp_path)))
+    assert gz_ref.fetch("chr1", 65000, 66000) == seq[65000:66000]
+    assert not tmp_path.joinpath(ref.ref_name).exists()
+
+
+def test_reference_download(tmp_path):
+    # A directory that has yet to be downloaded from its remote source
+    ref_dir = FlyteDirectory(path=str(tmp_path))
+    ref_dir._remote_source = test_assets["ref_dir"]
+    ref = Reference(test_assets["ref_fn"], ref_dir)
+    ref.download("seq_index")
+    assert sorted(p.name for p in tmp_path.rglob("*") if p.is_file()) == [
+        "GRCh38_short.dict",
+        "GRCh38_short.fasta.fai",
+    ]
+    assert [p.name for p in ref.local_files("gatk")] == [
+        "GRCh38_short.dict",
+        "GRCh38_short.fasta.fai",
+    ]
+
+
 def test_vcf():
     vcf = VCF(
         "test-sample",
@@ -92,6 +214,17 @@ def test_vcf_make_all():
     assert vcfs[0].get_vcf_idx_fname() == "test-sample-1_test-caller.vcf.gz.tbi"
 
 
+def test_vcf_from_sheet(tmp_path):
+    sheet = tmp_path.joinpath("vcfs.csv")
+    sheet.write_text(
+        "sample,caller,vcf,vcf_idx\n"
+        f"test-sample-1,test-caller,{test_assets['vcf_path']},{test_assets['vcf_idx_path']}\n"
+    )
+    vcfs = VCF.from_sheet(str(sheet))
+    assert vcfs[0].vcf.path == test_assets["vcf_path"]
+    assert vcfs[0].vcf_idx.path == test_assets["vcf_idx_path"]
+
+
 def test_protein():
     prot = Protein("test-protein", FlyteFile(path="test-path"))
     assert prot.name == "test-protein"
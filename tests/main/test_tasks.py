@@ -1,4 +1,7 @@
 import os
+import pytest
+import zipfile
+import numpy as np
 from filecmp import cmp
 from pathlib import Path
 from flytekit.types.directory import FlyteDirectory
@@ -6,10 +9,13 @@ from flytekit.types.file import FlyteFile
 from unionbio.datatypes.alignment import Alignment
 from unionbio.datatypes.reads import Reads
 from unionbio.tasks.fastp import pyfastp
-from unionbio.tasks.fastqc import fastqc
-from unionbio.tasks.mark_dups import mark_dups
-from unionbio.tasks.sort_sam import sort_sam
+from unionbio.tasks.fastqc import fastqc, fastqc_reads, gather_fastqc
+from unionbio.tasks.fastq_qc import pyfastqc, FastqStats
+from unionbio.tasks.mark_dups import mark_dups, mark_dups_alignment
+from unionbio.tasks.sort_sam import sort_sam, sort_alignment
+from unionbio.tasks.utils import read_fastqc_summary
 from tests.config import test_assets
+from tests.utils import bam_flags
 
 
 def test_fastqc():
@@ -20,6 +26,75 @@ def test_fastqc():
     )
 
 
+def test_fastqc_reads():
+    (rs,) = Reads.from_paths(
+        [str(p) for p in Path(test_assets["raw_seq_dir"]).iterdir()]
+    )
+    qc_samp = fastqc_reads(rs=rs)
+    assert isinstance(qc_samp, FlyteDirectory)
+    assert all(
+        i in os.listdir(test_assets["fastqc_dir"]) for i in os.listdir(qc_samp.path)
+    )
+
+
+def test_gather_fastqc(tmp_path):
+    reports = []
+    for m in (1, 2):
+        rep_dir = tmp_path.joinpath(f"mate{m}")
+        rep_dir.mkdir()
+        for ext in ("zip", "html"):
+            name = f"ERR250683-tiny_{m}_fastqc.{ext}"
+            rep_dir.joinpath(name).write_bytes(
+                Path(test_assets["fastqc_dir"], name).read_bytes()
+            )
+        reports.append(FlyteDirectory(path=str(rep_dir)))
+    qc = gather_fastqc(reports=reports)
+    assert sorted(os.listdir(qc.path)) == sorted(os.listdir(test_assets["fastqc_dir"]))
+
+
+def test_pyfastqc():
+    qc_samp = pyfastqc(seq_dir=test_assets["raw_seq_dir"])
+    reports = sorted(Path(qc_samp.path).glob("*_fastqc.zip"))
+    assert [r.name for r in reports] == [
+        "ERR250683-tiny_1_fastqc.zip",
+        "ERR250683-tiny_2_fastqc.zip",
+    ]
+    for report in reports:
+        fname, statuses = read_fastqc_summary(report)
+        # Modules shared with FastQC should agree with its reports
+        exp_fname, expected = read_fastqc_summary(
+            Path(test_assets["fastqc_dir"], report.name)
+        )
+        assert fname == exp_fname
+        assert statuses == {k: v for k, v in expected.items() if k in statuses}
+        with zipfile.ZipFile(report) as zf:
+            data = zf.read(f"{report.stem}/fastqc_data.txt").decode()
+        assert "Total Sequences\t250\n" in data
+
+
+def test_fastq_stats_mixed_lengths():
+    stats = FastqStats()
+    lengths = np.array([150, 70, 40, 70])
+    reads = [b"A" * 150, b"C" * 70, b"G" * 40, b"C" * 70]
+    seqs = np.frombuffer(b"".join(reads), np.uint8)
+    quals = np.full(len(seqs), ord("I"), np.uint8)
+    stats.update(seqs, quals, lengths)
+    assert stats.n_reads == 4
+    # Long reads are truncated to 50bp, shorter ones are tracked whole
+    assert stats.tracked == {b"A" * 50: 1, b"C" * 70: 2, b"G" * 40: 1}
+
+
+def test_fastq_stats_offset():
+    stats = FastqStats()
+    seqs = np.frombuffer(b"ACGT", np.uint8)
+    lengths = np.array([4])
+    stats.update(seqs, np.frombuffer(b"hhhh", np.uint8), lengths)
+    assert stats.encoding == "Illumina 1.5"
+    # A later read below "@" can't be Phred+64
+    with pytest.raises(ValueError, match="contradicts the Phred\\+64"):
+        stats.update(seqs, np.frombuffer(b"hh#h", np.uint8), lengths)
+
+
 def test_fastp():
     raw_samp = Reads.make_all(Path(test_assets["raw_seq_dir"]))[0]
     filt_samp = pyfastp(rs=raw_samp)
@@ -43,6 +118,21 @@ def test_sort_sam():
     )
 
 
+def test_sort_alignment(tmp_path):
+    alignment = Alignment.make_all(Path(test_assets["bt2_sam_dir"]))[0]
+    sorted_alignment = sort_alignment(
+        al=alignment, mem_budget="64Mi", spill_dir=str(tmp_path)
+    )
+    assert sorted_alignment.sorted
+    assert sorted_alignment.format == "bam"
+    assert sorted_alignment.alignment.path.endswith(
+        "ERR250683-tiny_bowtie2_sorted_aligned.bam"
+    )
+    assert sorted_alignment.alignment_idx.path.endswith(
+        "ERR250683-tiny_bowtie2_sorted_aligned.bam.bai"
+    )
+
+
 def test_mark_dups():
     alignment = Alignment.make_all(Path(test_assets["sort_dir"]))[0]
     alignment.deduped = True
@@ -60,3 +150,27 @@ def test_mark_dups():
             for x in [deduped.path, metrics.path]
         ]
     )
+
+
+def test_mark_dups_alignment():
+    # The dup pair shares orig's coordinates with lower base qualities
+    alignment = Alignment.make_all(Path(test_assets["dups_dir"]))[0]
+    deduped = mark_dups_alignment(al=alignment)
+    assert deduped.deduped and deduped.sorted
+    assert deduped.dedup_metrics.path.endswith(
+        "dups_bowtie2_sorted_deduped_metrics.txt"
+    )
+    metrics = dict(
+        line.rstrip("\n").split(": ", 1)
+        for line in open(deduped.dedup_metrics.path)
+        if ": " in line
+    )
+    assert metrics["DUPLICATE PAIR"] == "2"
+    assert metrics["DUPLICATE TOTAL"] == "2"
+    records = bam_flags(deduped.alignment.path)
+    assert len(records) == 6
+    assert sorted(name for name, flag in records if flag & 0x400) == ["dup", "dup"]
+    # Outputs only depend on the input, so reruns are byte identical
+    rerun = mark_dups_alignment(al=alignment)
+    assert cmp(deduped.alignment.path, rerun.alignment.path, shallow=False)
+    assert cmp(deduped.dedup_metrics.path, rerun.dedup_metrics.path, shallow=False)
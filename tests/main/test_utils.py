@@ -1,9 +1,64 @@
+import io
+import os
+import pytest
+import gzip
+import shutil
 import string
+import tarfile
+import zipfile
+from filecmp import cmp
 from pathlib import Path
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from flytekit.types.directory import FlyteDirectory
+from flytekit.types.file import FlyteFile
 from unionbio.datatypes.variants import VCF
-from unionbio.tasks.utils import fetch_file, intersect_vcfs
-from unionbio.tasks.helpers import gunzip_file
+from unionbio.datatypes.reference import Reference
+from unionbio.datatypes.reads import Reads
+from unionbio.tasks.utils import (
+    check_fastqc_reports,
+    fetch_file,
+    fetch_remote_sites,
+    intersect_vcfs,
+    prepare_raw_samples,
+    scatter_intervals,
+)
+from unionbio.tasks.helpers import (
+    gunzip_file,
+    decompressed_fifos,
+    extract_tar_stream,
+    fetch_all,
+    shard_paired_fastq,
+    merge_alignment_summaries,
+    sam_output_args,
+    sam_output_threads,
+)
+from unionbio.tasks.cache import fetch_cached
+from unionbio.tasks.index_registry import index_key
+from unionbio.tasks.variant_table import (
+    export_vcf_sites,
+    parse_header,
+    parse_records,
+)
+from unionbio.tasks.cohort import CohortMatrix, build_cohort
+from unionbio.tasks import intervals
+from unionbio.tasks.intervals import (
+    Interval,
+    read_contig_lengths,
+    balance_contigs,
+    find_n_gaps,
+    plan_intervals,
+)
+from unionbio.tasks.resources import (
+    tool_threads,
+    java_opts,
+    java_heap_mb,
+    parse_mem,
+    samtools_sort_mem,
+    SHARED_JAVA_HEAP_FRACTION,
+)
 from tests.config import test_assets
+from tests.utils import bgzip, bgzip_vcf, serve_dir
 
 
 def test_fetch_http_file(tmp_path):
@@ -16,6 +71,32 @@ def test_fetch_http_file(tmp_path):
     assert outpath.name == "Mills_and_1000G_gold_standard.indels.hg38.vcf.gz.tbi"
 
 
+def test_fetch_http_file_ranged(tmp_path):
+    # Test that a download split into many small ranges reassembles to the same file
+    src = tmp_path.joinpath("src")
+    src.mkdir()
+    src.joinpath("blob.bin").write_bytes(os.urandom(300 * 1024))
+    ranged_dir = tmp_path.joinpath("ranged")
+    ranged_dir.mkdir()
+    with serve_dir(src) as (base, _):
+        ranged = fetch_file(
+            f"{base}/blob.bin", ranged_dir, connections=4, part_size=64 * 1024
+        )
+    assert cmp(src.joinpath("blob.bin"), ranged)
+    assert [p.name for p in ranged_dir.iterdir()] == [ranged.name]
+
+
+def test_fetch_http_file_encoded(tmp_path):
+    # Test that bodies are requested unencoded, and decoded if a server encodes anyway
+    src = tmp_path.joinpath("src")
+    src.mkdir()
+    src.joinpath("report.txt").write_text("FastQC\n" * 1000)
+    with serve_dir(src, gzip_encoding=True) as (base, accept_encodings):
+        outpath = fetch_file(f"{base}/report.txt", tmp_path)
+    assert cmp(src.joinpath("report.txt"), outpath)
+    assert set(accept_encodings) == {"identity"}
+
+
 def test_fetch_ftp_file(tmp_path):
     # Test that fetch_file downloads a file
     url = "ftp://ftp.ncbi.nlm.nih.gov/tech-reports/tech-report.txt"
@@ -25,12 +106,60 @@ def test_fetch_ftp_file(tmp_path):
     assert outpath.name == "tech-report.txt"
 
 
+def test_fetch_all(tmp_path):
+    # Test that fetch_all downloads a batch of files and preserves order
+    src = Path(test_assets["vcf_dir"])
+    names = [Path(test_assets["vcf_idx_path"]).name, Path(test_assets["vcf_path"]).name]
+    with serve_dir(src) as (base, _):
+        outpaths = fetch_all([f"{base}/{n}" for n in names], tmp_path)
+    assert [p.name for p in outpaths] == names
+    assert all(cmp(p, src.joinpath(p.name)) for p in outpaths)
+
+
+def test_fetch_remote_sites():
+    with serve_dir(test_assets["vcf_dir"]) as (base, _):
+        sites = fetch_remote_sites(
+            sites=f"{base}/{Path(test_assets['vcf_path']).name}",
+            idx=f"{base}/{Path(test_assets['vcf_idx_path']).name}",
+        )
+    assert isinstance(sites, VCF)
+    assert sites.sample == "test-sample-1_test-caller"
+    assert sites.caller == "known"
+    assert cmp(sites.vcf.path, test_assets["vcf_path"])
+    assert cmp(sites.vcf_idx.path, test_assets["vcf_idx_path"])
+
+
+def test_prepare_raw_samples():
+    samps = prepare_raw_samples(seq_dir=FlyteDirectory(test_assets["raw_seq_dir"]))
+    assert len(samps) == 1
+    assert samps[0].sample == "ERR250683-tiny"
+    assert "ERR250683-tiny_1.fastq.gz" in samps[0].read1.path
+    assert "ERR250683-tiny_2.fastq.gz" in samps[0].read2.path
+
+
 def test_intersect_vcfs():
     vcfs = VCF.make_all(Path(test_assets["vcf_dir"]))
     # vcf2 = VCF.make_all(Path(test_assets["vcf_dir"]))[0]
     out = intersect_vcfs(vcf1=vcfs[0], vcf2=vcfs[1])
     print(out)
     assert isinstance(out, VCF)
+    assert Path(out.vcf_idx.path).exists()
+
+
+def test_intersect_vcfs_nway(tmp_path):
+    vcf_dir = Path(test_assets["vcf_dir"])
+    # A third caller that agrees with the first on every site
+    for f in vcf_dir.glob("test-sample-1_*"):
+        shutil.copy(f, tmp_path.joinpath(f.name.replace("test-caller", "copy-caller")))
+    vcfs = VCF.make_all(vcf_dir)
+    out = intersect_vcfs(vcf1=vcfs[0], vcf2=vcfs[1], extra_vcfs=VCF.make_all(tmp_path))
+    assert out.caller == "test-caller_test-caller_copy-caller_isec"
+
+    vcfs = VCF.make_all(vcf_dir)
+    two_way = intersect_vcfs(vcf1=vcfs[0], vcf2=vcfs[1])
+    with gzip.open(out.vcf.path, "rt") as a, gzip.open(two_way.vcf.path, "rt") as b:
+        records = [line for line in a if not line.startswith("#")]
+        assert records == [line for line in b if not line.startswith("#")]
 
 
 def test_gunzip():
@@ -38,3 +167,406 @@ def test_gunzip():
     unzipped = gunzip_file(Path(gzfile))
     assert unzipped.exists()
     assert all([c in string.printable for c in open(unzipped).readline().strip()])
+
+
+def test_gunzip_bgzf(tmp_path):
+    gzfile = Path(shutil.copy(test_assets["sites_path"], tmp_path))
+    unzipped = gunzip_file(gzfile, threads=4)
+    assert unzipped.read_bytes() == gzip.decompress(gzfile.read_bytes())
+    assert sorted(os.listdir(tmp_path)) == sorted([gzfile.name, unzipped.name])
+    mtime = unzipped.stat().st_mtime_ns
+    assert gunzip_file(gzfile) == unzipped
+    assert unzipped.stat().st_mtime_ns == mtime
+
+
+def test_decompressed_fifos():
+    raw = Path(test_assets["raw_seq_dir"])
+    gz = [raw.joinpath("ERR250683-tiny_1.fastq.gz"), test_assets["sites_path"]]
+    with decompressed_fifos(gz) as fifos:
+        assert not any(f.name.endswith(".gz") for f in fifos)
+        with open(fifos[0], "rb") as f1, open(fifos[1], "rb") as f2:
+            assert f1.read() == gzip.decompress(gz[0].read_bytes())
+            assert f2.read() == gzip.decompress(Path(gz[1]).read_bytes())
+
+    # Decompressors are cleaned up even when the consumer never opens the FIFOs
+    with pytest.raises(KeyError):
+        with decompressed_fifos(gz) as fifos:
+            raise KeyError(fifos[0])
+
+
+def test_fetch_cached(tmp_path):
+    cache_dir = tmp_path.joinpath("cache")
+    fills = []
+
+    def fill(d):
+        fills.append(d)
+        d.joinpath("obj.txt").write_text("x" * 100)
+
+    for i in range(2):
+        out_dir = tmp_path.joinpath(f"out{i}")
+        out_dir.mkdir()
+        out = fetch_cached("abcd", "obj.txt", out_dir, fill, cache_dir, budget=1000)
+        assert out.read_text() == "x" * 100
+    assert len(fills) == 1
+
+    # Handed out files are the caller's own, so writing to them leaves the cache intact
+    out.write_text("y")
+    out.rename(out.with_name("renamed.txt"))
+    cached = cache_dir.joinpath("objects", "ab", "abcd", "obj.txt")
+    assert cached.read_text() == "x" * 100
+
+    # A second object pushes the cache over budget and evicts the least recently used
+    fetch_cached("efgh", "obj.txt", tmp_path, fill, cache_dir, budget=150)
+    assert not cache_dir.joinpath("objects", "ab", "abcd").exists()
+    assert cache_dir.joinpath("objects", "ef", "efgh", "obj.txt").exists()
+
+
+def test_extract_tar_stream(tmp_path):
+    src = tmp_path.joinpath("bundle")
+    for sub in ["Ref", "Data"]:
+        src.joinpath(sub).mkdir(parents=True)
+        src.joinpath(sub, f"{sub.lower()}.txt").write_text(sub)
+    tar_path = tmp_path.joinpath("bundle.tar.gz")
+    with tarfile.open(tar_path, "w:gz") as tarf:
+        tarf.add(src, arcname="bundle")
+
+    out = tmp_path.joinpath("out")
+    with open(tar_path, "rb") as f:
+        extract_tar_stream(f, out, include=["*/Ref"])
+    assert out.joinpath("bundle", "Ref", "ref.txt").read_text() == "Ref"
+    assert not out.joinpath("bundle", "Data").exists()
+
+    # Members escaping the output directory are refused
+    evil_path = tmp_path.joinpath("evil.tar.gz")
+    with tarfile.open(evil_path, "w:gz") as tarf:
+        tarf.add(src.joinpath("Ref", "ref.txt"), arcname="../escaped.txt")
+    with open(evil_path, "rb") as f, pytest.raises(tarfile.FilterError):
+        extract_tar_stream(f, out)
+    assert not tmp_path.joinpath("escaped.txt").exists()
+
+
+def test_shard_paired_fastq(tmp_path):
+    r1 = Path(test_assets["filt_seq_dir"]).joinpath("ERR250683-tiny_1.filt.fastq.gz")
+    r2 = Path(test_assets["filt_seq_dir"]).joinpath("ERR250683-tiny_2.filt.fastq.gz")
+    shards = shard_paired_fastq(
+        r1, r2, tmp_path, "ERR250683-tiny-shard", 3, batch_size=50
+    )
+    assert len(shards) == 3
+    for mate, orig in enumerate([r1, r2]):
+        lines = b"".join(gzip.open(s[mate]).read() for s in shards).split(b"\n")
+        assert sorted(lines) == sorted(gzip.open(orig).read().split(b"\n"))
+
+
+def test_merge_alignment_summaries():
+    rep = Path(test_assets["bt2_sam_dir"]).joinpath(
+        "ERR250683-tiny_bowtie2_aligned_report.txt"
+    )
+    summary = rep.read_text()
+    assert merge_alignment_summaries([summary]) == summary
+    merged = merge_alignment_summaries([summary, summary])
+    assert merged.startswith("1865226 reads; of these:")
+    assert merged.endswith("0.61% overall alignment rate\n")
+
+
+def test_tool_threads():
+    # fastp stops scaling at 16 workers, samtools -@ counts threads beyond the main one
+    assert tool_threads("fastp", cpus=32) == 16
+    assert tool_threads("samtools", cpus=4) == 3
+    assert tool_threads("bowtie2", cpus=4) == 4
+    assert java_opts().startswith("-Xmx")
+    assert java_heap_mb(SHARED_JAVA_HEAP_FRACTION) < java_heap_mb()
+
+
+def test_samtools_sort_mem():
+    assert parse_mem("8Gi") == 8 * 1024**3
+    assert parse_mem("512M") == 512 * 10**6
+    assert samtools_sort_mem(threads=3, budget=parse_mem("8Gi")) == "2048M"
+    shared = parse_mem(samtools_sort_mem(threads=3, fraction=0.25) + "i")
+    assert shared < parse_mem(samtools_sort_mem(threads=3) + "i")
+    with pytest.raises(ValueError):
+        parse_mem("8 gigs")
+
+
+def test_sam_output_args():
+    assert sam_output_args("sam", "out.sam") == [">", "out.sam"]
+    bam = sam_output_args("bam", "out.bam", threads=2)
+    assert bam == ["|", "samtools", "view", "-@", "1", "-o", "out.bam", "-b", "-"]
+    assert "-T" in sam_output_args("cram", "out.cram", ref="ref.fa")
+    with pytest.raises(ValueError):
+        sam_output_args("cram", "out.cram")
+    # Compression takes a quarter of the CPUs, which aligners leave free
+    assert sam_output_threads("sam", cpus=16) == 0
+    assert sam_output_threads("bam", cpus=16) == 4
+    assert sam_output_threads("cram", cpus=2) == 1
+
+
+def test_balance_contigs():
+    ref = Path(test_assets["ref_path"])
+    fai = read_contig_lengths(ref.with_name(f"{ref.name}.fai"))
+    assert fai == read_contig_lengths(ref.with_suffix(".dict")) == {"chr1": 699930}
+    lengths = {"chr1": 100, "chr2": 90, "chr3": 60, "chr4": 40, "chrM": 5}
+    groups = balance_contigs(lengths, 3)
+    assert groups == [["chr1"], ["chr2", "chrM"], ["chr3", "chr4"]]
+    assert balance_contigs(lengths, 10) == [[c] for c in lengths]
+    gaps = [Interval("chr1", 0, 80)]
+    shards = plan_intervals(lengths, 2, gaps, split_contigs=False)
+    assert shards == [
+        [Interval("chr1", 80, 100), Interval("chr2", 0, 90)],
+        [Interval("chr3", 0, 60), Interval("chr4", 0, 40), Interval("chrM", 0, 5)],
+    ]
+
+
+def test_plan_intervals():
+    lengths = {"chr1": 1000, "chr2": 500, "chr3": 100}
+    shards = plan_intervals(lengths, 4)
+    assert [sum(len(i) for i in s) for s in shards] == [400, 400, 400, 400]
+    assert shards[1] == [Interval("chr1", 400, 800)]
+    assert shards[2] == [Interval("chr1", 800, 1000), Interval("chr2", 0, 200)]
+    gaps = [Interval("chr1", 100, 400), Interval("chr2", 0, 500)]
+    shards = plan_intervals(lengths, 2, gaps)
+    assert shards == [
+        [Interval("chr1", 0, 100), Interval("chr1", 400, 700)],
+        [Interval("chr1", 700, 1000), Interval("chr3", 0, 100)],
+    ]
+
+
+def test_find_n_gaps(tmp_path, monkeypatch):
+    ref = Path(test_assets["ref_path"])
+    gaps = find_n_gaps(ref)
+    assert gaps[0] == Interval("chr1", 0, 10000)
+    assert gaps[1].to_region() == "chr1:207667-257666"
+
+    # Bgzipped references give the same gaps, and runs spanning windows are joined
+    gz = tmp_path.joinpath(f"{ref.name}.gz")
+    bgzip(ref, gz)
+    shutil.copy(f"{ref}.fai", f"{gz}.fai")
+    monkeypatch.setattr(intervals, "FASTA_SCAN_WINDOW", 4096)
+    assert find_n_gaps(gz) == gaps
+
+
+def test_scatter_intervals():
+    ref = Reference(test_assets["ref_fn"], FlyteDirectory(test_assets["ref_dir"]))
+    shards = scatter_intervals(ref=ref, n=3, exclude_gaps=True)
+    assert len(shards) == 3
+    lines = open(shards[0].path).read().splitlines()
+    assert lines[0].startswith("@HD")
+    assert lines[2] == "chr1\t10001\t189977\t+\t."
+    beds = scatter_intervals(ref=ref, n=3, fmt="bed")
+    assert open(beds[0].path).read() == "chr1\t0\t233310\n"
+
+
+def test_scatter_intervals_bgzipped(tmp_path):
+    # A bgzipped reference with only the .fai and .gzi of the compressed FASTA
+    ref_path = Path(test_assets["ref_path"])
+    gz = tmp_path.joinpath(f"{ref_path.name}.gz")
+    bgzip(ref_path, gz)
+    shutil.copy(f"{ref_path}.fai", f"{gz}.fai")
+    shutil.copy(ref_path.with_suffix(".dict"), tmp_path)
+    ref = Reference(gz.name, FlyteDirectory(path=str(tmp_path)))
+
+    plain = Reference(test_assets["ref_fn"], FlyteDirectory(test_assets["ref_dir"]))
+    shards = scatter_intervals(ref=ref, n=3, exclude_gaps=True)
+    expected = scatter_intervals(ref=plain, n=3, exclude_gaps=True)
+    for shard, exp in zip(shards, expected):
+        assert open(shard.path).read() == open(exp.path).read()
+    assert not tmp_path.joinpath(ref_path.name).exists()
+
+
+def test_index_key():
+    key = index_key("abc", "ref.fa", "bwa", "0.7.17")
+    assert key == index_key("abc", "ref.fa", "bwa", "0.7.17")
+    assert (
+        len(
+            {
+                key,
+                index_key("abd", "ref.fa", "bwa", "0.7.17"),
+                index_key("abc", "ref2.fa", "bwa", "0.7.17"),
+                index_key("abc", "ref.fa", "bowtie2", "0.7.17"),
+                index_key("abc", "ref.fa", "bwa", "0.7.18"),
+            }
+        )
+        == 5
+    )
+
+
+def test_export_vcf_sites():
+    vcf = VCF.make_all(Path(test_assets["vcf_dir"]))[0]
+    out = export_vcf_sites(vcf=vcf, info_fields=["set", "DB"])
+    sites = out.sites_dataset()
+    assert sites.schema.names == [
+        "POS",
+        "ID",
+        "REF",
+        "ALT",
+        "QUAL",
+        "FILTER",
+        "INFO_set",
+        "INFO_DB",
+        "CHROM",
+    ]
+    table = sites.to_table()
+    with gzip.open(out.vcf.path, "rt") as f:
+        records = [line.split("\t") for line in f if not line.startswith("#")]
+    assert table.num_rows == len(records)
+    assert table["POS"].to_pylist() == [int(r[1]) for r in records]
+    assert table["CHROM"].unique().to_pylist() == ["chr1"]
+    assert sites.count_rows(filter=pc.field("QUAL") > 1000) == sum(
+        float(r[5]) > 1000 for r in records
+    )
+
+
+def test_parse_records():
+    header = parse_header(
+        [
+            '##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count, per ALT">\n',
+            '##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP">\n',
+            '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n',
+            '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">\n',
+            "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ts1\ts2\n",
+        ]
+    )
+    records = (
+        b"chr1\t10\trs1\tA\tC,G\t50\tPASS\tAC=1,.;DB\tGT:AD\t0/1:3,4,0\t./.\n"
+        b"chr1\t20\t.\tT\t.\t.\tq10;s50\t.\tAD:GT\t.,2:1/1\t.:0/0\n"
+    )
+    (table,) = parse_records(io.BytesIO(records), header, ["AC", "DB"], ["GT", "AD"])
+    assert table.to_pylist() == [
+        {
+            "POS": 10,
+            "ID": "rs1",
+            "REF": "A",
+            "ALT": ["C", "G"],
+            "QUAL": 50.0,
+            "FILTER": ["PASS"],
+            "INFO_AC": [1, None],
+            "INFO_DB": True,
+            "s1_GT": "0/1",
+            "s1_AD": [3, 4, 0],
+            "s2_GT": "./.",
+            "s2_AD": None,
+        },
+        {
+            "POS": 20,
+            "ID": None,
+            "REF": "T",
+            "ALT": None,
+            "QUAL": None,
+            "FILTER": ["q10", "s50"],
+            "INFO_AC": None,
+            "INFO_DB": False,
+            "s1_GT": "1/1",
+            "s1_AD": [None, 2],
+            "s2_GT": "0/0",
+            "s2_AD": None,
+        },
+    ]
+
+
+GT_HEADER = (
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n"
+)
+
+
+def write_gt_vcf(path, samples, records):
+    text = GT_HEADER.format("\t".join(samples))
+    for chrom, pos, ref, alt, *gts in records:
+        site = f"{chrom}\t{pos}\t.\t{ref}\t{alt}\t.\tPASS\t.\tGT"
+        text += "\t".join([site, *gts]) + "\n"
+    bgzip_vcf(text, path)
+    return path
+
+
+def test_cohort_matrix(tmp_path):
+    first = write_gt_vcf(
+        tmp_path.joinpath("a.vcf.gz"),
+        ["s1", "s2"],
+        [("chr1", 10, "A", "C", "0/1", "1/1"), ("chr2", 5, "G", "T", "./.", "0|1")],
+    )
+    cohort = CohortMatrix(tmp_path.joinpath("cohort"))
+    cohort.append([first])
+    assert cohort.samples == ["s1", "s2"]
+    assert cohort.genotypes().tolist() == [[1, 2], [-1, 1]]
+
+    # A later batch brings a new site, which reads as hom-ref for the first batch
+    second = write_gt_vcf(
+        tmp_path.joinpath("b.vcf.gz"),
+        ["sample"],
+        [("chr1", 10, "A", "C", "0/0"), ("chr1", 20, "T", "G", "1/1")],
+    )
+    cohort.append([second], names=["s3"])
+    gt_file = tmp_path.joinpath("cohort", "gt-00000.i8")
+    assert gt_file.stat().st_size == 4
+
+    reopened = CohortMatrix(tmp_path.joinpath("cohort"))
+    assert reopened.samples == ["s1", "s2", "s3"]
+    assert reopened.genotypes().tolist() == [[1, 2, 0], [-1, 1, 0], [0, 0, 2]]
+    summary = reopened.summary()
+    assert summary["POS"].to_pylist() == [10, 5, 20]
+    assert summary["AF"].to_pylist() == pytest.approx([0.5, 0.25, 1 / 3])
+    assert summary["call_rate"].to_pylist() == pytest.approx([1, 2 / 3, 1])
+
+    with pytest.raises(ValueError, match="already in the cohort"):
+        reopened.append([second], names=["s1"])
+
+
+def test_cohort_matrix_batches(tmp_path):
+    vcfs = [
+        write_gt_vcf(
+            tmp_path.joinpath(f"s{i}.vcf.gz"),
+            [f"s{i}"],
+            [("chr1", 10 * (i + 1), "A", "C", "0/1"), ("chr1", 100, "G", "T", "1/1")],
+        )
+        for i in range(3)
+    ]
+    whole = CohortMatrix(tmp_path.joinpath("whole"))
+    whole.append(vcfs)
+    batched = CohortMatrix(tmp_path.joinpath("batched"))
+    batched.append(vcfs, batch_size=2)
+    assert len(batched.meta["batches"]) == 2
+    assert batched.samples == whole.samples == ["s0", "s1", "s2"]
+    assert batched.sites().equals(whole.sites())
+    assert batched.genotypes().tolist() == whole.genotypes().tolist()
+
+
+def test_build_cohort(tmp_path):
+    for sample, gt in [("s1", "0/1"), ("s2", "1/1")]:
+        records = [("chr1", 10, "A", "C", gt)]
+        write_gt_vcf(tmp_path.joinpath(f"{sample}_caller.vcf.gz"), ["SAMPLE"], records)
+    cohort = build_cohort(vcfs=VCF.make_all(tmp_path))
+    assert sorted(CohortMatrix(cohort.path).samples) == ["s1", "s2"]
+    summary = pq.read_table(Path(cohort.path).joinpath("summary.parquet"))
+    assert summary["AF"].to_pylist() == [0.75]
+    assert CohortMatrix(build_cohort(vcfs=[]).path).samples == []
+
+
+def test_check_fastqc_reports(tmp_path):
+    # The test sample fails QC, so add reports for a second sample that passes
+    shutil.copytree(test_assets["fastqc_dir"], tmp_path, dirs_exist_ok=True)
+    for mate in (1, 2):
+        stem = f"good_{mate}_fastqc"
+        with zipfile.ZipFile(tmp_path.joinpath(f"{stem}.zip"), "w") as zf:
+            zf.writestr(
+                f"{stem}/summary.txt",
+                f"PASS\tBasic Statistics\tgood_{mate}.fastq.gz\n"
+                f"WARN\tAdapter Content\tgood_{mate}.fastq.gz\n",
+            )
+    samples = Reads.make_all(Path(test_assets["raw_seq_dir"]))
+    good = Reads(
+        sample="good",
+        read1=FlyteFile(path="s3://bucket/good_1.fastq.gz"),
+        read2=FlyteFile(path="s3://bucket/good_2.fastq.gz"),
+    )
+    missing = Reads(sample="missing", uread=FlyteFile(path="s3://bucket/missing.fq"))
+
+    qc = check_fastqc_reports(
+        rep_dir=FlyteDirectory(path=str(tmp_path)), samples=[*samples, good, missing]
+    )
+    assert [rs.sample for rs in qc.passed] == ["good"]
+    assert [rs.sample for rs in qc.quarantined] == ["ERR250683-tiny", "missing"]
+    failing = qc.verdicts["ERR250683-tiny_2.fastq.gz"]
+    assert failing["Per base sequence quality"] == "FAIL"
+    assert qc.verdicts["good_1.fastq.gz"] == {
+        "Basic Statistics": "PASS",
+        "Adapter Content": "WARN",
+    }
@@ -1,5 +1,14 @@
+import io
 import os
+import re
+import gzip
+import zlib
+import struct
 import filecmp
+import threading
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 
 def dir_contents_match(dir1, dir2):
@@ -21,3 +30,159 @@ def dir_contents_match(dir1, dir2):
         dir_contents_match(subdir1, subdir2)
 
     return True
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files with byte-range support, or gzip-encoded whatever the client asks for
+    when `gzip_encoding` is set, recording the Accept-Encoding of each request.
+    """
+
+    def __init__(self, *args, gzip_encoding=False, accept_encodings=None, **kwargs):
+        self.gzip_encoding = gzip_encoding
+        self.accept_encodings = accept_encodings
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        self.accept_encodings.append(self.headers.get("Accept-Encoding"))
+        with open(path, "rb") as f:
+            body = f.read()
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if self.gzip_encoding:
+            body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+        elif match:
+            start, end = int(match[1]), min(int(match[2]), len(body) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            body = body[start : end + 1]
+        else:
+            self.send_response(200)
+        if not self.gzip_encoding:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return io.BytesIO(body)
+
+
+@contextmanager
+def serve_dir(path, gzip_encoding=False):
+    """
+    Serve the files in `path` over HTTP on localhost for the duration of the context,
+    yielding the base URL and the list of Accept-Encoding headers received.
+    """
+    accept_encodings = []
+    handler = partial(
+        RangeRequestHandler,
+        directory=str(path),
+        gzip_encoding=gzip_encoding,
+        accept_encodings=accept_encodings,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}", accept_encodings
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def bgzf_blocks(data, block_size=65280):
+    """
+    Compress `data` into BGZF blocks, yielding each block's uncompressed offset and bytes.
+    """
+    for start in range(0, len(data), block_size):
+        chunk = data[start : start + block_size]
+        comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+        cdata = comp.compress(chunk) + comp.flush()
+        header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+        yield start, header + struct.pack("<H", len(cdata) + 25) + cdata + struct.pack(
+            "<II", zlib.crc32(chunk), len(chunk)
+        )
+
+
+def bgzip(src, dst, block_size=65280):
+    """
+    Compress `src` into BGZF at `dst` and write its .gzi, as `bgzip -i` would.
+    """
+    data = open(src, "rb").read()
+    offsets = []
+    with open(dst, "wb") as f:
+        for start, block in bgzf_blocks(data, block_size):
+            if start:
+                offsets.append((f.tell(), start))
+            f.write(block)
+        f.write(BGZF_EOF)
+    with open(f"{dst}.gzi", "wb") as f:
+        f.write(struct.pack("<Q", len(offsets)))
+        for c, u in offsets:
+            f.write(struct.pack("<QQ", c, u))
+
+
+def bgzip_vcf(text, dst):
+    """
+    Write VCF text as a bgzipped VCF at `dst` with a tabix index. Each contig starts a new
+    BGZF block and is indexed as a single chunk in the root bin, which is valid, if coarse.
+    """
+    lines = text.splitlines(keepends=True)
+    header = "".join(line for line in lines if line.startswith("#"))
+    contigs = {}
+    for line in lines:
+        if not line.startswith("#"):
+            contigs.setdefault(line.split("\t")[0], []).append(line)
+
+    spans = {}
+    with open(dst, "wb") as f:
+        f.writelines(block for _, block in bgzf_blocks(header.encode()))
+        for contig, records in contigs.items():
+            start = f.tell()
+            f.writelines(block for _, block in bgzf_blocks("".join(records).encode()))
+            spans[contig] = (start << 16, f.tell() << 16)
+        f.write(BGZF_EOF)
+
+    names = b"".join(c.encode() + b"\0" for c in contigs)
+    tbi = b"TBI\x01" + struct.pack(
+        "<8i", len(contigs), 2, 1, 2, 0, ord("#"), 0, len(names)
+    )
+    tbi += names
+    for start, end in spans.values():
+        tbi += struct.pack("<iIiQQiQ", 1, 0, 1, start, end, 1, start)
+    with open(f"{dst}.tbi", "wb") as f:
+        f.writelines(block for _, block in bgzf_blocks(tbi))
+        f.write(BGZF_EOF)
+
+
+def bam_flags(path):
+    """
+    Read the name and FLAG of every record in a BAM.
+    """
+    data = gzip.decompress(open(path, "rb").read())
+    assert data[:4] == b"BAM\x01"
+    (l_text,) = struct.unpack_from("<i", data, 4)
+    off = 8 + l_text
+    (n_ref,) = struct.unpack_from("<i", data, off)
+    off += 4
+    for _ in range(n_ref):
+        (l_name,) = struct.unpack_from("<i", data, off)
+        off += 8 + l_name
+    records = []
+    while off < len(data):
+        (block_size,) = struct.unpack_from("<i", data, off)
+        l_read_name = data[off + 12]
+        (flag,) = struct.unpack_from("<H", data, off + 18)
+        name = data[off + 36 : off + 36 + l_read_name - 1].decode()
+        records.append((name, flag))
+        off += 4 + block_size
+    return records